@@ -1,7 +1,9 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from .models import Profile
+from sns.thumbnails import remember_source, schedule_all, source_changed
+from sns.search import index_object, unindex_object
 
 @receiver(post_save, sender=User)
 def create_profile(sender, instance, created, **kwargs):
@@ -13,4 +15,22 @@ def save_profile(sender, instance, **kwargs):
     try:
         instance.profile.save()
     except Profile.DoesNotExist:
-        pass
\ No newline at end of file
+        pass
+
+@receiver(post_init, sender=Profile)
+def track_avatar(sender, instance, **kwargs):
+    remember_source(instance, 'avatar')
+
+@receiver(post_save, sender=Profile)
+def generate_avatar_thumbnails(sender, instance, **kwargs):
+    if source_changed(instance, 'avatar'):
+        schedule_all(instance.avatar, ['avatar_card', 'avatar_profile'])
+        remember_source(instance, 'avatar')
+
+@receiver(post_save, sender=Profile)
+def index_profile(sender, instance, **kwargs):
+    index_object('profile', instance)
+
+@receiver(post_delete, sender=Profile)
+def unindex_profile(sender, instance, **kwargs):
+    unindex_object('profile', instance.pk)
@@ -5,7 +5,10 @@ from django.views.generic import CreateView, DetailView, UpdateView, DateDetailV
 from django.contrib.auth.mixins import LoginRequiredMixin
 from .forms import SignupForm, ProfileForm
 from .models import Profile
-from sns.models import Notification
+from django.conf import settings
+from sns.notifications import notify
+from sns.search import search_ids
+from sns.timeline import schedule_follow, unfollow_author
 
 class SignupView(CreateView):
     model = User
@@ -16,12 +19,16 @@ class SignupView(CreateView):
 class ProfileListView(LoginRequiredMixin, ListView):
     model = Profile
     template_name = 'accounts/profile_list.html'
+    paginate_by = 30
     # 検索機能
     def get_queryset(self):
-        queryset = Profile.objects.all()
+        queryset = Profile.objects.select_related('user').order_by('pk')
         q = self.request.GET.get('q')  #検索ワード
         if q:
-            queryset = queryset.filter(user__username__icontains=q) | queryset.filter(bio__icontains=q)
+            # 全文検索の関連度順に並べる（上位 SEARCH_MAX_RESULTS 件まで）
+            hits = search_ids(q, kind='profile', limit=settings.SEARCH_MAX_RESULTS)
+            profiles = queryset.in_bulk([pk for _, pk, _ in hits])
+            return [profiles[pk] for _, pk, _ in hits if pk in profiles]
         return queryset
 
 class ProfileDetailView(LoginRequiredMixin, DetailView):
@@ -57,11 +64,13 @@ class FollowToggleView(LoginRequiredMixin, View):
         if request.user in target_profile.followers.all():
             # すでにフォローしていれば解除
             target_profile.followers.remove(request.user)
+            unfollow_author(request.user.pk, target_user.pk)
         else:
             # フォロー追加
             target_profile.followers.add(request.user)
+            schedule_follow(request.user.pk, target_user.pk)
             # 通知作成
-            Notification.objects.create(
+            notify(
                 sender=request.user,
                 recipient=target_user,
                 notification_type='follow',
@@ -1,3 +1,143 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.core.cache.backends.base import memcache_key_warnings
+from django.urls import reverse
+from .weather import WeatherClient, get_client
 
-# Create your tests here.
+class StubWeatherServer:
+    # OpenWeatherMap の代わりにローカルで応答するサーバー（mode で応答を切り替える）
+    def __init__(self):
+        self.mode = 'ok'
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                stub.requests.append(query)
+                if stub.mode == 'slow':
+                    time.sleep(1)
+                status, body = {
+                    'ok': (200, {'weather': [{'description': '晴れ', 'icon': '01d'}], 'main': {'temp': 21.6}}),
+                    'slow': (200, {}),
+                    'error': (500, {}),
+                    'notfound': (404, {'cod': '404'}),
+                }[stub.mode]
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                try:
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # タイムアウトしたクライアントが先に切断した
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/data/2.5/weather'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class WeatherClientTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.stub = StubWeatherServer().__enter__()
+        self.addCleanup(self.stub.__exit__)
+
+    def client_for(self, **options):
+        options = {
+            'url': self.stub.url, 'api_key': 'test', 'timeout': (0.5, 0.3), 'ttl': 600,
+            'stale_ttl': 3600, 'failure_threshold': 3, 'cooldown': 60, **options,
+        }
+        return WeatherClient(**options)
+
+    def test_view_uses_cache_for_repeated_requests(self):
+        get_client.cache_clear()
+        self.addCleanup(get_client.cache_clear)
+        with override_settings(WEATHER_API_URL=self.stub.url, OPENWEATHERMAP_API_KEY='test'):
+            for _ in range(3):
+                response = self.client.get(reverse('games:fortune_weather'))
+        self.assertEqual(response.context['weather']['condition'], '晴れ')
+        self.assertEqual(response.context['weather']['temperature'], 22)
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertEqual(self.stub.requests[0]['q'], ['Tokyo'])
+
+    def test_cache_key_is_safe_for_memcached(self):
+        client = self.client_for()
+        key = client.cache_key(' New York ')
+        self.assertEqual(key, client.cache_key('new york'))
+        self.assertNotEqual(key, client.cache_key('東京'))
+        self.assertEqual(list(memcache_key_warnings(key)), [])
+        self.assertEqual(list(memcache_key_warnings(client.cache_key('東京'))), [])
+
+    def test_stale_value_is_served_while_refreshing(self):
+        client = self.client_for()
+        client.get('Tokyo')
+        entry = cache.get(client.cache_key('Tokyo'))
+        entry['weather']['condition'] = '古い天気'
+        entry['fetched_at'] -= 601
+        cache.set(client.cache_key('Tokyo'), entry)
+        self.assertEqual(client.get('Tokyo')['condition'], '古い天気')
+        client.refresh_later('Tokyo').result(timeout=5)
+        self.assertEqual(client.get('Tokyo')['condition'], '晴れ')
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_stale_value_survives_failures(self):
+        client = self.client_for(ttl=0)
+        client.get('Tokyo')
+        self.stub.mode = 'error'
+        with self.assertLogs('games.weather', 'WARNING'):
+            self.assertEqual(client.get('Tokyo')['condition'], '晴れ')
+            client.refresh_later('Tokyo').result(timeout=5)
+        self.assertEqual(cache.get(client.cache_key('Tokyo'))['weather']['condition'], '晴れ')
+
+    def test_slow_response_times_out(self):
+        self.stub.mode = 'slow'
+        client = self.client_for()
+        started = time.monotonic()
+        with self.assertLogs('games.weather', 'WARNING'):
+            self.assertEqual(client.get('Tokyo')['condition'], '情報取得エラー')
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_circuit_breaker_stops_calls_until_cooldown(self):
+        self.stub.mode = 'error'
+        client = self.client_for(cooldown=0.2)
+        with self.assertLogs('games.weather', 'WARNING'):
+            for city in ['A', 'B', 'C', 'D', 'E']:
+                client.get(city)
+        self.assertEqual(len(self.stub.requests), 3)
+        time.sleep(0.25)
+        self.stub.mode = 'ok'
+        self.assertEqual(client.get('F')['condition'], '晴れ')
+        self.assertEqual(client.get('G')['condition'], '晴れ')
+        self.assertEqual(len(self.stub.requests), 5)
+
+    def test_unknown_city_is_cached_without_tripping_breaker(self):
+        self.stub.mode = 'notfound'
+        client = self.client_for(failure_threshold=1)
+        self.assertEqual(client.get('Nowhere')['condition'], '都市が見つかりません')
+        client.get('Nowhere')
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertTrue(client.breaker.allow())
+
+    def test_missing_api_key_does_not_call_api(self):
+        client = self.client_for(api_key=None)
+        self.assertEqual(client.get('Tokyo')['condition'], '情報取得エラー')
+        self.assertEqual(self.stub.requests, [])
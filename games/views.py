@@ -1,11 +1,10 @@
 from django.shortcuts import render, redirect
 from django.views.generic import TemplateView
 from django.views import View
-from django.conf import settings
 import random
-import requests
 
 from sns.views import NotificationListView
+from .weather import get_weather
 
 class JankenView(View):
     template_name = 'games/janken.html'
@@ -72,35 +71,11 @@ class NumberGuessVeiw(View):
 class FortuneWeatherView(View):
     template_name = 'games/fortune_weather.html'
 
-    def get_weather(self, city):
-        api_key = settings.OPENWEATHERMAP_API_KEY
-        url = f'http://api.openweathermap.org/data/2.5/weather?q={city}&appid={api_key}&units=metric&lang=ja'
-
-        try:
-            res = requests.get(url)
-            data = res.json()
-            icon_code = data['weather'][0]['icon']
-            weather = {
-                'city': city,
-                'condition': data['weather'][0]['description'],
-                'temperature': round(data['main']['temp']),
-                'icon_url': f"http://openweathermap.org/img/wn/{icon_code}@2x.png",
-            }
-        except Exception as e:
-            # APIエラー時はサンプル表示
-            weather = {
-                'city': city,
-                'condition': '情報取得エラー',
-                'temperature': '--',
-                'icon_url': '',
-            }
-        return weather
-
     def get(self, request):
         # 場所
         city = request.session.get('city', 'Tokyo')
         # 天気
-        weather = self.get_weather(city)
+        weather = get_weather(city)
         # 運勢はまだ引いていないので None
         fortune = request.session.get('fortune', None)
 
@@ -0,0 +1,154 @@
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+import requests
+from django.conf import settings
+from django.core.cache import cache as django_cache
+
+# OpenWeatherMap の現在の天気
+# 都市ごとに WEATHER_CACHE_TTL 秒キャッシュし、期限切れの後も WEATHER_STALE_TTL 秒までは古い値を返しつつ裏で取り直す
+# 失敗が WEATHER_FAILURE_THRESHOLD 回続いたら WEATHER_COOLDOWN 秒は API を呼ばない（サーキットブレーカー）
+
+logger = logging.getLogger(__name__)
+
+class WeatherError(Exception):
+    pass
+
+def placeholder(city, condition='情報取得エラー'):
+    return {'city': city, 'condition': condition, 'temperature': '--', 'icon_url': ''}
+
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        # 開いている間は呼ばない。cooldown 経過後は1回だけ試す（半開）
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+class WeatherClient:
+    def __init__(self, url, api_key, timeout, ttl, stale_ttl, failure_threshold, cooldown):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.breaker = CircuitBreaker(failure_threshold, cooldown)
+        # 接続を使い回す（リトライはしない。失敗はブレーカーと古い値で吸収する）
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=10, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='weather-refresh')
+        self._refreshing = {}
+        self._lock = threading.Lock()
+
+    def cache_key(self, city):
+        # 都市名には空白や日本語が入るので、memcached でも使えるようハッシュにする
+        digest = hashlib.sha1(city.strip().lower().encode()).hexdigest()
+        return f'games:weather:{digest}'
+
+    def fetch(self, city):
+        params = {'q': city, 'appid': self.api_key, 'units': 'metric', 'lang': 'ja'}
+        try:
+            response = self.session.get(self.url, params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise WeatherError(str(e)) from e
+        if response.status_code == 404:
+            # 存在しない都市は API の障害ではないので、結果としてキャッシュする
+            return placeholder(city, '都市が見つかりません')
+        if response.status_code != 200:
+            raise WeatherError(f'HTTP {response.status_code}')
+        try:
+            data = response.json()
+            icon_code = data['weather'][0]['icon']
+            return {
+                'city': city,
+                'condition': data['weather'][0]['description'],
+                'temperature': round(data['main']['temp']),
+                'icon_url': f'https://openweathermap.org/img/wn/{icon_code}@2x.png',
+            }
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise WeatherError(f'不正な応答: {e}') from e
+
+    def refresh(self, city):
+        if not self.breaker.allow():
+            raise WeatherError('API の呼び出しを一時停止中です')
+        try:
+            weather = self.fetch(city)
+        except WeatherError:
+            self.breaker.failure()
+            raise
+        self.breaker.success()
+        django_cache.set(self.cache_key(city), {'weather': weather, 'fetched_at': time.time()}, self.stale_ttl)
+        return weather
+
+    def refresh_later(self, city):
+        # 同じ都市の取り直しは1つだけ走らせる
+        key = self.cache_key(city)
+        with self._lock:
+            future = self._refreshing.get(key)
+            if future is None:
+                future = self.executor.submit(self._refresh_quietly, city)
+                self._refreshing[key] = future
+                future.add_done_callback(lambda _: self._refreshing.pop(key, None))
+        return future
+
+    def _refresh_quietly(self, city):
+        try:
+            self.refresh(city)
+        except WeatherError as e:
+            logger.warning('天気の取り直しに失敗しました（%s）: %s', city, e)
+
+    def get(self, city):
+        if not self.api_key:
+            return placeholder(city)
+        entry = django_cache.get(self.cache_key(city))
+        if entry:
+            if time.time() - entry['fetched_at'] >= self.ttl:
+                # 古い値をすぐ返し、取り直しは裏で行う
+                self.refresh_later(city)
+            return entry['weather']
+        try:
+            return self.refresh(city)
+        except WeatherError as e:
+            logger.warning('天気を取得できませんでした（%s）: %s', city, e)
+            return placeholder(city)
+
+@cache
+def get_client():
+    return WeatherClient(
+        url=settings.WEATHER_API_URL,
+        api_key=settings.OPENWEATHERMAP_API_KEY,
+        timeout=settings.WEATHER_TIMEOUT,
+        ttl=settings.WEATHER_CACHE_TTL,
+        stale_ttl=settings.WEATHER_STALE_TTL,
+        failure_threshold=settings.WEATHER_FAILURE_THRESHOLD,
+        cooldown=settings.WEATHER_COOLDOWN,
+    )
+
+def get_weather(city):
+    return get_client().get(city)
@@ -0,0 +1,93 @@
+from functools import cache
+from django.conf import settings
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import TruncMonth
+from django.utils.module_loading import import_string
+from .models import MonthlySummary, Record
+
+# 家計簿の集計バックエンド
+# 結果は素の Python の値で返す：
+#   monthly(user)           -> [{'month': date, 'income': int, 'expense': int, 'balance': int}, ...]（月の昇順）
+#   expense_breakdown(user) -> {メモ: 支出合計, ...}（メモが空のものは「未分類」）
+# settings.KAKEIBO_AGGREGATION_BACKEND で切り替える（通常は pandas を読み込まない ORM 集計を使う）
+
+def conditional_totals(field):
+    # 収入・支出・収支を1回の GROUP BY で求める（収支は収入を +、支出を - として合計）
+    def total(**cases):
+        whens = [When(category=category, then=field if sign > 0 else -field) for category, sign in cases.items()]
+        return Sum(Case(*whens, default=Value(0), output_field=IntegerField()))
+    return {
+        'income': total(income=1),
+        'expense': total(expense=1),
+        'balance': total(income=1, expense=-1),
+    }
+
+def memo_totals(user):
+    totals = {}
+    rows = (
+        Record.objects.filter(user=user, category='expense')
+        .values('memo').annotate(total=Sum('amount')).order_by()
+    )
+    for row in rows:
+        label = row['memo'] or '未分類'
+        totals[label] = totals.get(label, 0) + row['total']
+    return totals
+
+class SummaryAggregation:
+    # 月別集計テーブル（MonthlySummary）から読む。行数は月数×区分数なので記録数に依存しない
+    def monthly(self, user):
+        rows = (
+            MonthlySummary.objects.filter(user=user)
+            .values('month').annotate(**conditional_totals(F('total')))
+            .order_by('month')
+        )
+        return list(rows)
+
+    def expense_breakdown(self, user):
+        return memo_totals(user)
+
+class RecordAggregation:
+    # 記録から直接 TruncMonth で集計する（集計テーブルを使わない場合・作り直し中の確認用）
+    def monthly(self, user):
+        rows = (
+            Record.objects.filter(user=user)
+            .annotate(month=TruncMonth('date'))
+            .values('month').annotate(**conditional_totals(F('amount')))
+            .order_by('month')
+        )
+        return list(rows)
+
+    def expense_breakdown(self, user):
+        return memo_totals(user)
+
+class PandasAggregation:
+    # 分析用：記録全件を DataFrame に読み込む（移動平均などの高度な分析を追加するとき用）
+    def frame(self, user):
+        import pandas as pd
+        df = pd.DataFrame(Record.objects.filter(user=user).values('date', 'category', 'amount', 'memo'))
+        if not df.empty:
+            df['month'] = pd.to_datetime(df['date']).dt.to_period('M').dt.to_timestamp()
+        return df
+
+    def monthly(self, user):
+        df = self.frame(user)
+        if df.empty:
+            return []
+        pivot = df.pivot_table(index='month', columns='category', values='amount', aggfunc='sum', fill_value=0)
+        rows = []
+        for month, row in pivot.iterrows():
+            income, expense = int(row.get('income', 0)), int(row.get('expense', 0))
+            rows.append({'month': month.date(), 'income': income, 'expense': expense, 'balance': income - expense})
+        return rows
+
+    def expense_breakdown(self, user):
+        df = self.frame(user)
+        if df.empty:
+            return {}
+        expense = df[df['category'] == 'expense']
+        memo = expense['memo'].fillna('').replace('', '未分類')
+        return {label: int(total) for label, total in expense.groupby(memo)['amount'].sum().items()}
+
+@cache
+def get_aggregation():
+    return import_string(settings.KAKEIBO_AGGREGATION_BACKEND)()
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Sum
+from .models import MonthlySummary, Record
+from .aggregation import get_aggregation
+
+# 家計簿の集計結果（一覧・Plotly グラフ・Chart.js で共通）
+# ユーザーの記録の版（最新の updated_at と件数）をキーに含めてキャッシュするので、
+# 記録を追加・編集・削除すると次の読み込みで自動的に計算し直される
+
+def latest_update(user_id):
+    # 最新の updated_at は (user, updated_at) インデックスの端を読むだけで求まる
+    return Record.objects.filter(user_id=user_id).aggregate(latest=Max('updated_at'))['latest']
+
+def data_version(user_id):
+    # 削除では最新の updated_at が変わらないことがあるので、月別集計の件数の合計も含める
+    latest = latest_update(user_id)
+    count = MonthlySummary.objects.filter(user_id=user_id).aggregate(count=Sum('count'))['count']
+    return f'{latest.timestamp() if latest else 0:.6f}-{count or 0}'
+
+def cache_key(user_id, version):
+    return f'kakeibo:analytics:{user_id}:{version}'
+
+def compute_analytics(user):
+    aggregation = get_aggregation()
+    return {
+        'monthly': aggregation.monthly(user),
+        'expense_breakdown': aggregation.expense_breakdown(user),
+    }
+
+def get_analytics(user):
+    version = data_version(user.pk)
+    key = cache_key(user.pk, version)
+    analytics = cache.get(key)
+    if analytics is None:
+        analytics = compute_analytics(user)
+        analytics['version'] = version
+        cache.set(key, analytics, settings.KAKEIBO_ANALYTICS_TIMEOUT)
+    return analytics
+
+def invalidate_analytics(user_id):
+    # update() など updated_at が変わらない一括処理の後に呼ぶ
+    cache.delete(cache_key(user_id, data_version(user_id)))
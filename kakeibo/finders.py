@@ -0,0 +1,31 @@
+import importlib.util
+import os
+from django.contrib.staticfiles.finders import BaseFinder
+from django.core.files.storage import FileSystemStorage
+
+# plotly パッケージ同梱の plotly.min.js だけを /static/plotly/plotly.min.js として配信する
+# package_data にはデータセットやテンプレートも入っているので、ディレクトリごとは公開しない
+# find_spec で場所だけを調べるので plotly 自体は読み込まない
+
+class PlotlyFinder(BaseFinder):
+    prefix = 'plotly'
+    filename = 'plotly.min.js'
+
+    def __init__(self, *args, **kwargs):
+        spec = importlib.util.find_spec('plotly')
+        self.storage = None
+        if spec and os.path.exists(os.path.join(os.path.dirname(spec.origin), 'package_data', self.filename)):
+            self.storage = FileSystemStorage(location=os.path.join(os.path.dirname(spec.origin), 'package_data'))
+            # collectstatic は storage.prefix の下に集める
+            self.storage.prefix = self.prefix
+        super().__init__(*args, **kwargs)
+
+    def find(self, path, find_all=False, **kwargs):
+        if self.storage is None or path != f'{self.prefix}/{self.filename}':
+            return []
+        match = self.storage.path(self.filename)
+        return [match] if find_all else match
+
+    def list(self, ignore_patterns):
+        if self.storage is not None:
+            yield self.filename, self.storage
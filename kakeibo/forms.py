@@ -10,4 +10,16 @@ class RecordForm(forms.ModelForm):
             'category': forms.Select(attrs={'class': 'form-control'}),
             'amount': forms.NumberInput(attrs={'class': 'form-control'}),
             'memo': forms.Textarea(attrs={'class': 'form-control'}),
-        }
\ No newline at end of file
+        }
+class RecordImportForm(forms.Form):
+    file = forms.FileField(label='ファイル', widget=forms.ClearableFileInput(attrs={'class': 'form-control'}))
+
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        if file.name.lower().endswith('.parquet'):
+            self.file_format = 'parquet'
+        elif file.name.lower().endswith('.csv'):
+            self.file_format = 'csv'
+        else:
+            raise forms.ValidationError('CSV（.csv）または Parquet（.parquet）ファイルを選択してください。')
+        return file
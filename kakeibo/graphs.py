@@ -0,0 +1,70 @@
+import json
+from django.conf import settings
+from django.core.cache import cache
+from .analytics import get_analytics
+
+# 家計簿グラフ（Plotly）の組み立て
+# plotly は読み込みに時間がかかるので、モジュールの先頭では import せず初回の描画時に読み込む
+# （mysns.urls から全アプリの views が読み込まれるため、SNS だけを扱うワーカーでも起動が遅くなる）
+# 図の JSON は集計結果の版ごとにキャッシュし、ブラウザ側は plotly.min.js（静的ファイル）で描画する
+
+SERIES = (('income', '収入'), ('expense', '支出'), ('balance', '収支'))
+
+def line_figure(rows):
+    import plotly.graph_objects as go
+    months = [row['month'] for row in rows]
+    # pandas を使わず、集計済みの値から直接グラフを組み立てる
+    fig = go.Figure([
+        go.Scatter(x=months, y=[row[key] for row in rows], name=label, mode='lines+markers')
+        for key, label in SERIES
+    ])
+    # 軸とフォーマットの調整
+    fig.update_layout(title='📈 月ごとの収入・支出・収支', xaxis_title='月', yaxis_title='金額（円）', legend_title='区分')
+    fig.update_xaxes(tickformat='%Y-%m')
+    fig.update_yaxes(tickprefix='¥', tickformat=',d')
+    return fig
+
+def bar_figure(rows):
+    import plotly.graph_objects as go
+    months = [row['month'] for row in rows]
+    fig = go.Figure([
+        go.Bar(x=months, y=[row[key] for row in rows], name=label)
+        for key, label in SERIES[:2]
+    ])
+    fig.update_layout(
+        title='📊 月ごとの収入・支出（棒グラフ）', barmode='group',
+        xaxis_title='月', yaxis_title='金額（円）', legend_title='区分',
+    )
+    fig.update_xaxes(tickformat='%Y-%m')
+    fig.update_yaxes(tickprefix='￥', tickformat=',d')
+    return fig
+
+def pie_figure(expense_summary):
+    import plotly.graph_objects as go
+    fig = go.Figure(go.Pie(labels=list(expense_summary), values=list(expense_summary.values())))
+    fig.update_layout(title='🥧 支出の内訳（円グラフ）')
+    fig.update_traces(textposition='inside', textinfo='percent+label')
+    return fig
+
+def build_figures(analytics):
+    # 記録が無いグラフは null にする
+    from plotly.utils import PlotlyJSONEncoder
+    rows = analytics['monthly']
+    expense_summary = analytics['expense_breakdown']
+    figures = {
+        'line': line_figure(rows) if rows else None,
+        'bar': bar_figure(rows) if rows else None,
+        'pie': pie_figure(expense_summary) if expense_summary else None,
+    }
+    figures = {name: fig.to_plotly_json() if fig else None for name, fig in figures.items()}
+    return json.dumps(figures, cls=PlotlyJSONEncoder, separators=(',', ':'), ensure_ascii=False)
+
+def figures_json(user):
+    # (JSON 文字列, 版) を返す
+    analytics = get_analytics(user)
+    key = f'kakeibo:figures:{user.pk}:{analytics["version"]}'
+    figures = cache.get(key)
+    if figures is None:
+        figures = build_figures(analytics)
+        cache.set(key, figures, settings.KAKEIBO_ANALYTICS_TIMEOUT)
+    return figures, analytics['version']
@@ -0,0 +1,92 @@
+import datetime
+import random
+import time
+import pandas as pd
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from kakeibo.aggregation import RecordAggregation, SummaryAggregation
+from kakeibo.analytics import get_analytics
+from kakeibo.models import Record
+from kakeibo.summaries import rebuild_summaries
+
+def legacy_pipeline(user):
+    # 比較用：以前の一覧ビューと同じく全記録を DataFrame にして集計する
+    df = pd.DataFrame(Record.objects.filter(user=user).values('date', 'category', 'amount', 'memo'))
+    if df.empty:
+        return []
+    df['month'] = pd.to_datetime(df['date']).dt.to_period('M').dt.to_timestamp()
+    df['category'] = df['category'].map(dict(Record.CATEGORY_CHOICES))
+    monthly = df.groupby(['month', 'category'])['amount'].sum().reset_index()
+    monthly_pivot = monthly.pivot(index='month', columns='category', values='amount').fillna(0)
+    monthly_pivot['収支'] = monthly_pivot.get('収入', 0) - monthly_pivot.get('支出', 0)
+    monthly_pivot.reset_index(inplace=True)
+    expense_df = df[df['category'] == '支出'].copy()
+    expense_df['memo'] = expense_df['memo'].fillna('未分類').replace('', '未分類')
+    expense_df.groupby('memo')['amount'].sum()
+    return monthly_pivot.to_dict(orient='records')
+
+class Command(BaseCommand):
+    help = '家計簿の集計を以前の pandas による集計と比較します（--records 件のダミー記録で計測し、最後にロールバック）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='既存ユーザーの記録で計測する')
+        parser.add_argument('--records', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def measure(self, func, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - started) / repeat * 1000
+
+    def create_records(self, count):
+        user = User.objects.create_user(username=f'benchmark-{time.time_ns()}')
+        start = datetime.date.today() - datetime.timedelta(days=3650)
+        memos = ['食費', '日用品', '交通費', '', None]
+        Record.objects.bulk_create(
+            (
+                Record(
+                    user=user,
+                    date=start + datetime.timedelta(days=random.randrange(3650)),
+                    category=random.choice(('income', 'expense')),
+                    amount=random.randrange(100, 100000),
+                    memo=random.choice(memos),
+                )
+                for _ in range(count)
+            ),
+            batch_size=5000,
+        )
+        rebuild_summaries(user.pk)
+        return user
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['username']:
+                try:
+                    user = User.objects.get(username=options['username'])
+                except User.DoesNotExist:
+                    raise CommandError(f"ユーザー {options['username']} が存在しません")
+            else:
+                user = self.create_records(options['records'])
+            repeat = options['repeat']
+
+            def cold():
+                cache.clear()
+                get_analytics(user)
+
+            get_analytics(user)
+            results = {
+                'pandas': self.measure(lambda: legacy_pipeline(user), repeat),
+                'orm records': self.measure(lambda: RecordAggregation().monthly(user), repeat),
+                'orm summary': self.measure(lambda: SummaryAggregation().monthly(user), repeat),
+                'cold cache': self.measure(cold, repeat),
+                'warm cache': self.measure(lambda: get_analytics(user), repeat),
+            }
+            count = Record.objects.filter(user=user).count()
+            self.stdout.write(f'{count} 件の記録')
+            for name, ms in results.items():
+                self.stdout.write(f'{name:>12}: {ms:8.2f} ms/回')
+            # ダミーデータを残さない
+            transaction.set_rollback(True)
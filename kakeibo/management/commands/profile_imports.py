@@ -0,0 +1,71 @@
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# python -X importtime の出力行：「import time:  self [us] | cumulative | <字下げ>モジュール名」
+LINE_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+class Command(BaseCommand):
+    help = 'ワーカー起動時（django.setup() と URLconf の読み込み）の import 時間をアプリごとに表示します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='表示する外部パッケージの数')
+        parser.add_argument('--fail-over', type=float, help='合計がこのミリ秒を超えたらエラー終了する（CI 用）')
+
+    def run_importtime(self):
+        code = f'import django; django.setup(); import {settings.ROOT_URLCONF}'
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'mysns.settings'))
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            capture_output=True, text=True, env=env, cwd=settings.BASE_DIR,
+        )
+        if result.returncode != 0:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+        rows = []
+        for line in result.stderr.splitlines():
+            match = LINE_RE.match(line)
+            if match:
+                self_us, cumulative_us, indent, name = match.groups()
+                rows.append((len(indent) // 2, name, int(self_us), int(cumulative_us)))
+        return rows
+
+    def handle(self, *args, **options):
+        local_apps = {
+            config.name.split('.')[0] for config in apps.get_app_configs()
+            if str(config.path).startswith(str(settings.BASE_DIR))
+        }
+        local_apps.add(settings.ROOT_URLCONF.split('.')[0])
+
+        # importtime は子→親の順に出力されるので、逆順にたどって「どのアプリから読み込まれたか」を決める
+        per_app = defaultdict(int)
+        per_package = defaultdict(int)
+        stack = []
+        total = 0
+        for depth, name, self_us, cumulative_us in reversed(self.run_importtime()):
+            del stack[depth:]
+            package = name.split('.')[0]
+            # 一番近い祖先のアプリ（自分がアプリのモジュールならそのアプリ）の時間として数える
+            owner = package if package in local_apps else next((p for p in reversed(stack) if p in local_apps), None)
+            if owner:
+                per_app[owner] += self_us
+            if package not in local_apps:
+                per_package[package] += self_us
+            if depth == 0:
+                total += cumulative_us
+            stack.append(package)
+
+        self.stdout.write('アプリ（そのアプリが最初に読み込んだ外部ライブラリを含む）')
+        for app, us in sorted(per_app.items(), key=lambda item: -item[1]):
+            self.stdout.write(f'  {app:<20} {us / 1000:8.1f} ms')
+        self.stdout.write(f'外部パッケージ（上位 {options["top"]} 件）')
+        for package, us in sorted(per_package.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write(f'  {package:<20} {us / 1000:8.1f} ms')
+        self.stdout.write(f'合計 {total / 1000:.1f} ms')
+
+        if options['fail_over'] is not None and total / 1000 > options['fail_over']:
+            raise CommandError(f'起動時の import が {total / 1000:.1f} ms で、上限 {options["fail_over"]} ms を超えています')
@@ -0,0 +1,24 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from kakeibo.models import MonthlySummary, Record
+from kakeibo.analytics import invalidate_analytics
+from kakeibo.summaries import rebuild_summaries
+
+class Command(BaseCommand):
+    help = '家計簿の月別集計テーブルを記録から作り直します（差分更新のずれの修正用）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='指定したユーザー名だけ作り直す')
+
+    def handle(self, *args, **options):
+        if options['user']:
+            user_ids = User.objects.filter(username=options['user']).values_list('pk', flat=True)
+        else:
+            # 記録が全て削除されたユーザーの集計も消すため、集計側のユーザーも対象にする
+            user_ids = set(Record.objects.values_list('user_id', flat=True).distinct())
+            user_ids.update(MonthlySummary.objects.values_list('user_id', flat=True).distinct())
+        total = 0
+        for user_id in sorted(user_ids):
+            total += rebuild_summaries(user_id)
+            invalidate_analytics(user_id)
+        self.stdout.write(self.style.SUCCESS(f'{len(user_ids)} 人分・{total} 行の月別集計を作り直しました'))
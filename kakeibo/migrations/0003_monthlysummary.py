@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def fill_summaries(apps, schema_editor):
+    Record = apps.get_model('kakeibo', 'Record')
+    MonthlySummary = apps.get_model('kakeibo', 'MonthlySummary')
+    rows = (
+        Record.objects.annotate(month=TruncMonth('date'))
+        .values('user_id', 'month', 'category')
+        .annotate(total=Sum('amount'), count=Count('pk'))
+        .order_by()
+    )
+    MonthlySummary.objects.bulk_create((MonthlySummary(**row) for row in rows), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kakeibo', '0002_alter_record_amount'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='月')),
+                ('category', models.CharField(choices=[('income', '収入'), ('expense', '支出')], max_length=20, verbose_name='区分')),
+                ('total', models.BigIntegerField(default=0, verbose_name='合計')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='件数')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_summaries', to=settings.AUTH_USER_MODEL, verbose_name='ユーザー')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'month', 'category'), name='kakeibo_summary_unique')],
+            },
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
@@ -15,6 +15,30 @@ class Record(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='作成日')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新日')
 
+    class Meta:
+        indexes = [
+            # 集計キャッシュの版（最新の updated_at と件数）をインデックスだけで求める
+            models.Index(fields=['user', 'updated_at'], name='kakeibo_record_version_idx'),
+            # 予定フォームの記録選択（新しい日付順）をインデックスだけで辿る
+            models.Index(fields=['user', 'date'], name='kakeibo_record_date_idx'),
+        ]
+
     def __str__(self):
         return f'{self.date} - {self.get_category_display()} {self.amount} 円'
 
+
+class MonthlySummary(models.Model):
+    # ユーザー・月・区分ごとの合計（Record の保存・削除時に差分で更新する）
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_summaries', verbose_name='ユーザー')
+    month = models.DateField(verbose_name='月')  # 月初日
+    category = models.CharField(max_length=20, choices=Record.CATEGORY_CHOICES, verbose_name='区分')
+    total = models.BigIntegerField(default=0, verbose_name='合計')
+    count = models.PositiveIntegerField(default=0, verbose_name='件数')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month', 'category'], name='kakeibo_summary_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.month:%Y-%m} {self.get_category_display()} {self.total} 円'
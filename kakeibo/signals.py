@@ -0,0 +1,27 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from .models import Record
+from .summaries import apply_delta
+
+def remember_state(instance):
+    instance._summary_state = (instance.user_id, instance.date, instance.category, instance.amount)
+
+@receiver(post_init, sender=Record)
+def track_summary_state(sender, instance, **kwargs):
+    remember_state(instance)
+
+@receiver(post_save, sender=Record)
+def update_summary_on_save(sender, instance, created, **kwargs):
+    # 変更前の値を引いてから変更後の値を足す（日付・区分の変更にも対応）
+    # 集計を作り直した場合は変更後の値も反映済み
+    if not created:
+        user_id, date, category, amount = instance._summary_state
+        rebuilt = apply_delta(user_id, date, category, -amount, -1)
+    if created or not rebuilt:
+        apply_delta(instance.user_id, instance.date, instance.category, instance.amount, 1)
+    remember_state(instance)
+
+@receiver(post_delete, sender=Record)
+def update_summary_on_delete(sender, instance, **kwargs):
+    user_id, date, category, amount = instance._summary_state
+    apply_delta(user_id, date, category, -amount, -1)
@@ -0,0 +1,49 @@
+import datetime
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+from .models import MonthlySummary, Record
+
+# 月ごとの集計テーブル（MonthlySummary）の更新（読み出しは aggregation.py）
+# Record の保存・削除はシグナルで差分を反映する。bulk_create や update() は反映されないので
+# その場合は rebuild_monthly_summaries コマンドで作り直す
+
+def month_start(date):
+    # Record.objects.create(date='2025-01-31') のように文字列で渡された場合にも対応
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date)
+    return date.replace(day=1)
+
+def apply_delta(user_id, date, category, amount, count):
+    # 集計を作り直したとき（記録の現在の状態がすべて反映済み）は True を返す
+    key = {'user_id': user_id, 'month': month_start(date), 'category': category}
+    summaries = MonthlySummary.objects.filter(**key)
+    with transaction.atomic():
+        if count < 0:
+            # 引く側では行を作らない。件数が足りなければ集計がずれている（bulk_create など）ので作り直す
+            updated = summaries.filter(count__gte=-count).update(total=F('total') + amount, count=F('count') + count)
+            if not updated:
+                rebuild_summaries(user_id)
+                return True
+        else:
+            summary, _ = MonthlySummary.objects.get_or_create(**key)
+            MonthlySummary.objects.filter(pk=summary.pk).update(
+                total=F('total') + amount, count=F('count') + count,
+            )
+        # 記録が無くなった月は行ごと消す
+        summaries.filter(count=0).delete()
+    return False
+
+def rebuild_summaries(user_id):
+    rows = (
+        Record.objects.filter(user_id=user_id)
+        .annotate(month=TruncMonth('date'))
+        .values('month', 'category')
+        .annotate(total=Sum('amount'), count=Count('pk'))
+        .order_by()
+    )
+    summaries = [MonthlySummary(user_id=user_id, **row) for row in rows]
+    with transaction.atomic():
+        MonthlySummary.objects.filter(user_id=user_id).delete()
+        MonthlySummary.objects.bulk_create(summaries)
+    return len(summaries)
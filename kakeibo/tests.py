@@ -1,3 +1,243 @@
+import datetime
+import json
+import os
+import subprocess
+import sys
+from io import StringIO
+from unittest import skipUnless
 from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.contrib.staticfiles import finders
+from django.urls import reverse
+from .models import MonthlySummary, Record
+from .analytics import get_analytics
+from .transfer import parquet_available
+from .aggregation import PandasAggregation, RecordAggregation, SummaryAggregation
+from .finders import PlotlyFinder
+
+class MonthlySummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='kakeibo', password='pass')
+        self.client.force_login(self.user)
+
+    def summaries(self):
+        return sorted(
+            MonthlySummary.objects.filter(user=self.user).values_list('month', 'category', 'total', 'count')
+        )
+
+    def test_create_update_delete_adjust_summary(self):
+        record = Record.objects.create(user=self.user, date=datetime.date(2025, 1, 10), category='expense', amount=500)
+        Record.objects.create(user=self.user, date='2025-01-20', category='expense', amount=300)
+        Record.objects.create(user=self.user, date=datetime.date(2025, 1, 25), category='income', amount=1000)
+        self.assertEqual(self.summaries(), [
+            (datetime.date(2025, 1, 1), 'expense', 800, 2),
+            (datetime.date(2025, 1, 1), 'income', 1000, 1),
+        ])
+
+        # 月と金額を変更すると元の月から引かれて新しい月に足される
+        record.date = datetime.date(2025, 2, 1)
+        record.amount = 700
+        record.save()
+        self.assertEqual(self.summaries(), [
+            (datetime.date(2025, 1, 1), 'expense', 300, 1),
+            (datetime.date(2025, 1, 1), 'income', 1000, 1),
+            (datetime.date(2025, 2, 1), 'expense', 700, 1),
+        ])
+
+        record.delete()
+        self.assertNotIn(datetime.date(2025, 2, 1), [row[0] for row in self.summaries()])
+
+    def test_rebuild_fixes_drift(self):
+        Record.objects.bulk_create([
+            Record(user=self.user, date=datetime.date(2024, 12, day), category='income', amount=100)
+            for day in range(1, 11)
+        ])
+        self.assertEqual(self.summaries(), [])
+        call_command('rebuild_monthly_summaries', stdout=StringIO())
+        self.assertEqual(self.summaries(), [(datetime.date(2024, 12, 1), 'income', 1000, 10)])
+
+    def test_subtracting_from_drifted_summary_rebuilds(self):
+        Record.objects.bulk_create([
+            Record(user=self.user, date=datetime.date(2024, 12, day), category='income', amount=100)
+            for day in range(1, 4)
+        ])
+        record = Record.objects.filter(user=self.user).first()
+        record.amount = 500
+        record.save()
+        self.assertEqual(self.summaries(), [(datetime.date(2024, 12, 1), 'income', 700, 3)])
+
+        MonthlySummary.objects.all().delete()
+        response = self.client.post(reverse('kakeibo:record_delete', args=[record.pk]))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.summaries(), [(datetime.date(2024, 12, 1), 'income', 200, 2)])
+
+    def test_views_read_summary(self):
+        Record.objects.create(user=self.user, date=datetime.date(2025, 3, 1), category='income', amount=2000)
+        Record.objects.create(user=self.user, date=datetime.date(2025, 3, 2), category='expense', amount=500, memo='食費')
+        response = self.client.get(reverse('kakeibo:record_list'))
+        self.assertEqual(response.context['monthly_table'], [
+            {'month': datetime.date(2025, 3, 1), 'income': 2000, 'expense': 500, 'balance': 1500},
+        ])
+        response = self.client.get(reverse('kakeibo:record_graph_chartjs'))
+        self.assertEqual(json.loads(response.context['chart_data'])['expense_labels'], ['食費'])
+        response = self.client.get(reverse('kakeibo:record_graph_figures'))
+        figures = response.json()
+        self.assertEqual([trace['name'] for trace in figures['line']['data']], ['収入', '支出', '収支'])
+        self.assertEqual(figures['pie']['data'][0]['labels'], ['食費'])
+
+    def test_figures_revalidate_with_etag(self):
+        url = reverse('kakeibo:record_graph_figures')
+        response = self.client.get(url)
+        self.assertEqual(response.json(), {'line': None, 'bar': None, 'pie': None})
+        Record.objects.create(user=self.user, date=datetime.date(2025, 4, 1), category='income', amount=100)
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIsNotNone(response.json()['line'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # 記録を追加すると版が変わって 200 に戻る
+        Record.objects.create(user=self.user, date=datetime.date(2025, 4, 2), category='expense', amount=50)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_analytics_cached_per_data_version(self):
+        old = Record.objects.create(user=self.user, date=datetime.date(2025, 1, 1), category='expense', amount=100)
+        Record.objects.create(user=self.user, date=datetime.date(2025, 2, 1), category='expense', amount=200)
+        self.assertEqual(len(get_analytics(self.user)['monthly']), 2)
+        # キャッシュ済みなら版を確認するクエリだけで済む
+        with CaptureQueriesContext(connection) as ctx:
+            get_analytics(self.user)
+        self.assertEqual(len(ctx.captured_queries), 2)
+        # 最新ではない記録を削除しても版が変わる
+        old.delete()
+        self.assertEqual([row['month'] for row in get_analytics(self.user)['monthly']], [datetime.date(2025, 2, 1)])
+
+    def test_aggregation_backends_agree(self):
+        for day, category, amount, memo in [
+            (datetime.date(2024, 11, 3), 'income', 3000, ''),
+            (datetime.date(2024, 11, 5), 'expense', 1200, '食費'),
+            (datetime.date(2024, 12, 1), 'expense', 800, None),
+            (datetime.date(2024, 12, 9), 'expense', 200, '食費'),
+        ]:
+            Record.objects.create(user=self.user, date=day, category=category, amount=amount, memo=memo)
+        expected_monthly = [
+            {'month': datetime.date(2024, 11, 1), 'income': 3000, 'expense': 1200, 'balance': 1800},
+            {'month': datetime.date(2024, 12, 1), 'income': 0, 'expense': 1000, 'balance': -1000},
+        ]
+        for backend in (SummaryAggregation(), RecordAggregation(), PandasAggregation()):
+            with self.subTest(backend=type(backend).__name__):
+                self.assertEqual(backend.monthly(self.user), expected_monthly)
+                self.assertEqual(backend.expense_breakdown(self.user), {'食費': 1400, '未分類': 800})
+
+class StartupImportTests(TestCase):
+    def test_urlconf_does_not_import_pandas_or_plotly(self):
+        # ワーカー起動時（URLconf の読み込みまで）に重いライブラリを読み込まない
+        code = (
+            'import sys, django; django.setup(); import mysns.urls; '
+            'print(",".join(m for m in ("pandas", "plotly") if m in sys.modules))'
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, text=True, check=True,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'mysns.settings'},
+        )
+        self.assertEqual(result.stdout.strip(), '')
+
+class PlotlyFinderTests(TestCase):
+    def test_only_plotly_min_js_is_served(self):
+        path = finders.find('plotly/plotly.min.js')
+        if path is None:
+            self.skipTest('plotly がインストールされていません')
+        self.assertTrue(path.endswith('plotly.min.js'))
+        self.assertIsNone(finders.find('plotly/widgetbundle.js'))
+        listed = [(path, storage.prefix) for path, storage in PlotlyFinder().list([])]
+        self.assertEqual(listed, [('plotly.min.js', 'plotly')])
+
+class RecordTransferTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='transfer', password='pass')
+        self.client.force_login(self.user)
+
+    def test_csv_export_streams_user_records(self):
+        Record.objects.create(user=self.user, date=datetime.date(2025, 5, 2), category='expense', amount=300, memo='昼食')
+        Record.objects.create(user=self.user, date=datetime.date(2025, 5, 1), category='income', amount=1000)
+        other = User.objects.create_user(username='other', password='pass')
+        Record.objects.create(user=other, date=datetime.date(2025, 5, 1), category='income', amount=999)
+        response = self.client.get(reverse('kakeibo:record_export'), {'format': 'csv'})
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        self.assertEqual(content.splitlines(), [
+            'date,category,amount,memo',
+            '2025-05-01,income,1000,',
+            '2025-05-02,expense,300,昼食',
+        ])
+
+    def test_csv_import_validates_rows_and_updates_summary(self):
+        csv_file = SimpleUploadedFile('records.csv', (
+            '\ufeffdate,category,amount,memo\n'
+            '2025-06-01,income,5000,給料\n'
+            '2025-06-03,支出,1200,\n'
+            'not-a-date,expense,100,\n'
+            '2025-06-04,gift,100,\n'
+        ).encode('utf-8'))
+        response = self.client.post(reverse('kakeibo:record_import'), {'file': csv_file})
+        result = response.context['result']
+        self.assertEqual(result.created, 2)
+        self.assertEqual([line for line, _ in result.errors], [4, 5])
+        self.assertEqual(
+            list(MonthlySummary.objects.filter(user=self.user).order_by('category').values_list('category', 'total', 'count')),
+            [('expense', 1200, 1), ('income', 5000, 1)],
+        )
+
+    def test_round_trip_through_csv(self):
+        for day in range(1, 6):
+            Record.objects.create(user=self.user, date=datetime.date(2025, 7, day), category='expense', amount=day * 100)
+        content = b''.join(self.client.get(reverse('kakeibo:record_export')).streaming_content)
+        Record.objects.all().delete()
+        self.client.post(reverse('kakeibo:record_import'), {'file': SimpleUploadedFile('records.csv', content)})
+        self.assertEqual(sorted(Record.objects.values_list('amount', flat=True)), [100, 200, 300, 400, 500])
+
+    @skipUnless(parquet_available(), 'pyarrow が必要です')
+    def test_round_trip_through_parquet(self):
+        Record.objects.create(user=self.user, date=datetime.date(2025, 8, 1), category='income', amount=700, memo='賞与')
+        response = self.client.get(reverse('kakeibo:record_export'), {'format': 'parquet'})
+        content = b''.join(response.streaming_content)
+        Record.objects.all().delete()
+        self.client.post(reverse('kakeibo:record_import'), {'file': SimpleUploadedFile('records.parquet', content)})
+        self.assertEqual(list(Record.objects.values_list('date', 'category', 'amount', 'memo')), [
+            (datetime.date(2025, 8, 1), 'income', 700, '賞与'),
+        ])
+
+
+class RecordLookupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='lookup', password='pass')
+        self.other = User.objects.create_user(username='other', password='pass')
+        self.client.force_login(self.user)
+        Record.objects.bulk_create([
+            Record(user=self.user, date=datetime.date(2025, 1, 1) + datetime.timedelta(days=i), category='expense', amount=100 + i, memo=f'買い物{i}')
+            for i in range(30)
+        ] + [Record(user=self.other, date=datetime.date(2025, 1, 1), category='expense', amount=105, memo='他人の記録')])
+
+    def test_pages_only_own_records(self):
+        url = reverse('kakeibo:record_lookup')
+        first = self.client.get(url).json()
+        self.assertEqual(len(first['results']), 20)
+        self.assertTrue(first['results'][0]['text'].startswith('2025-01-30'))
+        second = self.client.get(url, {'cursor': first['next']}).json()
+        self.assertEqual(len(second['results']), 10)
+        self.assertIsNone(second['next'])
+        ids = {item['id'] for item in first['results'] + second['results']}
+        self.assertEqual(ids, set(Record.objects.filter(user=self.user).values_list('pk', flat=True)))
+
+    def test_filters_by_amount_and_memo(self):
+        url = reverse('kakeibo:record_lookup')
+        self.assertEqual(len(self.client.get(url, {'q': '105'}).json()['results']), 1)
+        self.assertEqual(len(self.client.get(url, {'q': '買い物1'}).json()['results']), 11)
+        self.assertEqual(self.client.get(url, {'q': '他人'}).json()['results'], [])
 
-# Create your tests here.
@@ -0,0 +1,117 @@
+import csv
+import io
+import importlib.util
+from collections import Counter
+from django.db import transaction
+from .forms import RecordForm
+from .models import Record
+from .summaries import apply_delta
+
+# 家計簿の記録の書き出し・取り込み（CSV / Parquet）
+# どちらもチャンク単位で処理するので、ファイルの大きさに関係なくメモリ使用量は一定
+# Parquet は pyarrow がインストールされている場合だけ使える
+
+FIELDS = ['date', 'category', 'amount', 'memo']
+CHUNK_SIZE = 2000
+# 画面に表示するエラー行の上限
+MAX_ERRORS = 50
+
+CATEGORY_LABELS = {label: value for value, label in Record.CATEGORY_CHOICES}
+
+def parquet_available():
+    return importlib.util.find_spec('pyarrow') is not None
+
+def record_rows(user):
+    return (
+        Record.objects.filter(user=user).order_by('date', 'pk')
+        .values_list(*FIELDS).iterator(chunk_size=CHUNK_SIZE)
+    )
+
+class Echo:
+    # csv.writer の書き込み先（書いた行をそのまま返す）
+    def write(self, value):
+        return value
+
+def iter_csv(user):
+    writer = csv.writer(Echo())
+    # Excel で開いても文字化けしないように BOM を付ける
+    yield '\ufeff' + writer.writerow(FIELDS)
+    for date, category, amount, memo in record_rows(user):
+        yield writer.writerow([date.isoformat(), category, amount, memo or ''])
+
+def write_parquet(user, fileobj):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([
+        ('date', pa.date32()), ('category', pa.string()), ('amount', pa.int64()), ('memo', pa.string()),
+    ])
+    with pq.ParquetWriter(fileobj, schema) as writer:
+        chunk = []
+        for row in record_rows(user):
+            chunk.append(row)
+            if len(chunk) >= CHUNK_SIZE:
+                writer.write_batch(pa.RecordBatch.from_pylist([dict(zip(FIELDS, r)) for r in chunk], schema=schema))
+                chunk = []
+        if chunk:
+            writer.write_batch(pa.RecordBatch.from_pylist([dict(zip(FIELDS, r)) for r in chunk], schema=schema))
+
+def read_csv(fileobj):
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    try:
+        yield from csv.DictReader(text)
+    finally:
+        # アップロードファイル本体は閉じない
+        text.detach()
+
+def read_parquet(fileobj):
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(fileobj).iter_batches(batch_size=CHUNK_SIZE):
+        yield from batch.to_pylist()
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+        self.error_count = 0
+
+    def add_error(self, line, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            messages = [f'{field}: {message}' for field, items in errors.items() for message in items]
+            self.errors.append((line, ' / '.join(messages)))
+
+@transaction.atomic
+def import_records(user, rows, batch_size=1000):
+    # RecordForm と同じ検証を通った行だけを batch_size 件ずつ bulk_create する
+    # 不正な行は読み飛ばし、行番号（ヘッダーを1行目とする）とエラー内容を返す
+    result = ImportResult()
+    batch = []
+    deltas = Counter()
+    counts = Counter()
+
+    def flush():
+        Record.objects.bulk_create(batch)
+        result.created += len(batch)
+        batch.clear()
+
+    for line, row in enumerate(rows, start=2):
+        data = {field: row.get(field) for field in FIELDS}
+        data['category'] = CATEGORY_LABELS.get(data['category'], data['category'])
+        form = RecordForm(data=data)
+        if not form.is_valid():
+            result.add_error(line, form.errors)
+            continue
+        record = form.save(commit=False)
+        record.user = user
+        batch.append(record)
+        month = record.date.replace(day=1)
+        deltas[month, record.category] += record.amount
+        counts[month, record.category] += 1
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    # bulk_create はシグナルが飛ばないので月別集計へまとめて反映する
+    for (month, category), amount in deltas.items():
+        apply_delta(user.pk, month, category, amount, counts[month, category])
+    return result
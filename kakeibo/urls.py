@@ -5,10 +5,14 @@ app_name = 'kakeibo'
 
 urlpatterns = [
     path('records/', views.RecordListView.as_view(), name='record_list'),
+    path('records/export/', views.RecordExportView.as_view(), name='record_export'),
+    path('records/import/', views.RecordImportView.as_view(), name='record_import'),
+    path('records/lookup/', views.RecordLookupView.as_view(), name='record_lookup'),
     path('record/create/', views.RecordCreateView.as_view(), name='record_create'),
     path('record/<int:pk>/update/', views.RecordUpdateView.as_view(), name='record_update'),
     path('record/<int:pk>/delete/', views.RecordDeleteView.as_view(), name='record_delete'),
     path('record/<int:pk>/detail/', views.RecordDetailView.as_view(), name='record_detail'),
     path('record/graph/', views.RecordGraphView.as_view(), name='record_graph'),
+    path('record/graph/figures/', views.RecordGraphFiguresView.as_view(), name='record_graph_figures'),
     path('record/graph_chartjs/', views.RecordGraphChartJSView.as_view(), name='record_graph_chartjs'),
 ]
\ No newline at end of file
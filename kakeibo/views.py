@@ -1,49 +1,39 @@
 from calendar import month
 import json
+import tempfile
 from os import replace
 from django.shortcuts import render
 from django.views.generic import (
     ListView, CreateView, UpdateView,
-    DeleteView, DetailView, TemplateView,
+    DeleteView, DetailView, TemplateView, FormView,
 )
 from django.urls import reverse_lazy, reverse
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.http import condition
 from .models import Record
-from .forms import RecordForm
-import plotly.express as px
-import pandas as pd
-from plotly.offline import plot
+from .forms import RecordForm, RecordImportForm
+from .transfer import import_records, iter_csv, parquet_available, read_csv, read_parquet, write_parquet
+from .analytics import data_version, get_analytics, latest_update
+from . import graphs
+from sns.pagination import paginate_keyset
 
 class RecordListView(LoginRequiredMixin, ListView):
     model = Record
     template_name = 'kakeibo/record_list.html'
+    paginate_by = 50
 
     def get_queryset(self):
         return Record.objects.filter(user=self.request.user).order_by('-date')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        
-        qs = Record.objects.filter(user=self.request.user).values('date', 'category', 'amount')
-        df = pd.DataFrame(qs)
-        if not df.empty:
-            # 月単位に変換
-            df['month'] = pd.to_datetime(df['date']).dt.to_period('M').dt.to_timestamp()
-            # カテゴリを日本語に変換
-            category_map = dict(Record.CATEGORY_CHOICES)
-            df['category'] = df['category'].map(category_map)
-            # 月ごとに集計
-            monthly = df.groupby(['month', 'category'])['amount'].sum().reset_index()
-            monthly_pivot = monthly.pivot(index='month', columns='category', values='amount').fillna(0)
-            # 収支を追加
-            monthly_pivot['収支'] = monthly_pivot.get('収入', 0) - monthly_pivot.get('支出', 0)
-            # インデックスをリセットして辞書化
-            monthly_pivot.reset_index(inplace=True)
-            context['monthly_table'] = monthly_pivot.to_dict(orient='records')
-        else:
-            context['monthly_table'] = []
-        
+        # 月別集計テーブルから読み出す（記録全件の読み込みはしない）
+        context['monthly_table'] = get_analytics(self.request.user)['monthly']
         return context
 
 class RecordCreateView(LoginRequiredMixin, CreateView):
@@ -93,121 +83,103 @@ class RecordDetailView(LoginRequiredMixin, DetailView):
             raise PermissionDenied
         return obj
 
+class RecordLookupView(LoginRequiredMixin, View):
+    # 予定フォームの記録選択用（自分の記録だけを新しい日付順に返す。?q= で絞り込み、?cursor= で次ページ）
+    per_page = 20
+
+    def get(self, request):
+        records = Record.objects.filter(user=request.user)
+        q = request.GET.get('q', '').strip()
+        if q.isdigit():
+            records = records.filter(amount=int(q))
+        elif q:
+            records = records.filter(memo__icontains=q)
+        page = paginate_keyset(records, request.GET.get('cursor'), self.per_page, field='date')
+        return JsonResponse({
+            'results': [{'id': record.pk, 'text': str(record)} for record in page.object_list],
+            'next': page.next_cursor,
+        })
+
 class RecordGraphView(LoginRequiredMixin, TemplateView):
+    # グラフは RecordGraphFiguresView の JSON をブラウザ側で描画する
     template_name = 'kakeibo/record_graph.html'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        # ユーザーの記録を取得してデータフレーム作成
-        qs = Record.objects.filter(user=self.request.user).values('date', 'category', 'amount', 'memo')
-        df = pd.DataFrame(qs)
-        if df.empty:
-            context['line_graph'] = None
-            context['bar_graph'] = None
-            context['pie_graph'] = None
-            return context
-        # 月ごとの集計
-        df['month'] = pd.to_datetime(df['date']).dt.to_period('M').dt.to_timestamp()
-        monthly = df.groupby(['month', 'category'])['amount'].sum().reset_index()
-        # カテゴリを日本語に変換
-        category_map = dict(Record.CATEGORY_CHOICES)
-        monthly['category'] = monthly['category'].map(category_map)
-        # 収入/支出を列に展開
-        monthly_pivot = monthly.pivot(index='month', columns='category', values='amount').fillna(0)
-        # 収支を追加
-        monthly_pivot['収支'] = monthly_pivot.get('収入', 0) - monthly_pivot.get('支出', 0)
-        # Indexをリセット
-        monthly_pivot.reset_index(inplace=True)
-
-        # ========= 折れ線グラフ =========
-        fig_line = px.line(
-            monthly_pivot,
-            x='month',
-            y=['収入', '支出', '収支'],
-            title='📈 月ごとの収入・支出・収支',
-            markers=True,
-        )
-        # 軸とフォーマットの調整
-        fig_line.update_layout(xaxis_title='月', yaxis_title='金額（円）', legend_title='区分')
-        fig_line.update_xaxes(tickformat='%Y-%m')
-        fig_line.update_yaxes(tickprefix='¥', tickformat=',d')
-        # HTMLとして埋め込む
-        context['line_graph'] = fig_line.to_html(full_html=False)
-
-        # ========= 棒グラフ =========
-        fig_bar = px.bar(
-            monthly,
-            x='month',
-            y='amount',
-            color='category',
-            barmode='group',
-            title='📊 月ごとの収入・支出（棒グラフ）',
-        )
-        fig_bar.update_layout(xaxis_title='月', yaxis_title='金額（円）', legend_title='区分')
-        fig_bar.update_xaxes(tickformat='%Y-%m')
-        fig_bar.update_yaxes(tickprefix='￥', tickformat=',d')
-
-        context['bar_graph'] = fig_bar.to_html(full_html=False)
-
-        # ===== 支出割合 円グラフ =====
-        expense_df = df[df['category'] == 'expense'].copy()
-        if not expense_df.empty:
-            # memo が空欄や None の場合は「未分類」に置き換え
-            expense_df['memo'] = expense_df['memo'].fillna('未分類').replace('', '未分類')
-            # メモ単位で集計
-            expense_summary = expense_df.groupby('memo')['amount'].sum().reset_index()
-            
-            fig_pie = px.pie(
-                expense_summary,
-                names='memo',
-                values='amount',
-                title='🥧 支出の内訳（円グラフ）',
-            )
-            fig_pie.update_traces(textposition='inside', textinfo='percent+label')
-            context['pie_graph'] = fig_pie.to_html(full_html=False)
-        else:
-            context['pie_graph'] = None
+def figures_etag(request):
+    return f'{request.user.pk}-{data_version(request.user.pk)}'
 
-        return context
+def figures_last_modified(request):
+    return latest_update(request.user.pk)
+
+class RecordGraphFiguresView(LoginRequiredMixin, View):
+    # 記録が変わっていなければ 304 を返す（図の組み立ても JSON 化も行わない）
+    @method_decorator(condition(etag_func=figures_etag, last_modified_func=figures_last_modified))
+    def get(self, request):
+        figures, _ = graphs.figures_json(request.user)
+        response = HttpResponse(figures, content_type='application/json')
+        # ブラウザには保存させつつ、毎回 ETag で再検証させる
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
 
 class RecordGraphChartJSView(LoginRequiredMixin, TemplateView):
     template_name = 'kakeibo/record_graph_chartjs.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # ログインユーザーの記録を取得
-        qs = Record.objects.filter(user=self.request.user).values('date', 'category', 'amount', 'memo')
-        df = pd.DataFrame(qs)
-
-        if df.empty:
+        analytics = get_analytics(self.request.user)
+        rows = analytics['monthly']
+        if not rows:
             context['chart_data'] = None
             return context
-        # 日付を月単位に変換し、カテゴリを日本語に変換
-        df['month'] = pd.to_datetime(df['date']).dt.to_period('M').dt.to_timestamp()
-        category_map = dict(Record.CATEGORY_CHOICES)
-        df['category'] = df['category'].map(category_map)
-        # 月ごとの収入・支出を集計
-        monthly = df.groupby(['month', 'category'])['amount'].sum().reset_index()
-        monthly_pivot = monthly.pivot(index='month', columns='category', values='amount').fillna(0)
-        monthly_pivot['収支'] = monthly_pivot.get('収入', 0) - monthly_pivot.get('支出', 0)
-        monthly_pivot.reset_index(inplace=True)
         # 棒、折れ線グラフ用データ
         chart_data = {
-            'labels': monthly_pivot['month'].dt.strftime('%Y-%m').tolist(),
-            'income': monthly_pivot.get('収入', pd.Series([0]*len(monthly_pivot))).tolist(),
-            'expense': monthly_pivot.get('支出', pd.Series([0]*len(monthly_pivot))).tolist(),
-            'balance': monthly_pivot['収支'].tolist(),
+            'labels': [row['month'].strftime('%Y-%m') for row in rows],
+            'income': [row['income'] for row in rows],
+            'expense': [row['expense'] for row in rows],
+            'balance': [row['balance'] for row in rows],
         }
         # 円グラフ用データ
-        expense_df = df[df['category'] == '支出'].copy()
-        if not expense_df.empty:
-            expense_df['memo'] = expense_df['memo'].fillna('未分類').replace('', '未分類')
-            expense_summary = expense_df.groupby('memo')['amount'].sum().reset_index()
-            chart_data['expense_labels'] = expense_summary['memo'].to_list()
-            chart_data['expense_values'] = expense_summary['amount'].to_list()
-        else:
-            chart_data['expense_labels'] = []
-            chart_data['expense_values'] = []
-        
+        expense_summary = analytics['expense_breakdown']
+        chart_data['expense_labels'] = list(expense_summary)
+        chart_data['expense_values'] = list(expense_summary.values())
+
         context['chart_data'] = json.dumps(chart_data)
-        return context
\ No newline at end of file
+        return context
+
+class RecordExportView(LoginRequiredMixin, View):
+    # 記録を日付順に書き出す（?format=csv / parquet）
+    def get(self, request):
+        file_format = request.GET.get('format', 'csv')
+        if file_format == 'csv':
+            # 1行ずつ生成して送るので、記録が何件あってもメモリに溜めない
+            response = StreamingHttpResponse(iter_csv(request.user), content_type='text/csv; charset=utf-8')
+            response['Content-Disposition'] = 'attachment; filename="kakeibo.csv"'
+            return response
+        if file_format == 'parquet' and parquet_available():
+            # Parquet は末尾にメタデータを書くので一時ファイルに書いてから送る
+            tmp = tempfile.TemporaryFile()
+            write_parquet(request.user, tmp)
+            tmp.seek(0)
+            return FileResponse(tmp, as_attachment=True, filename='kakeibo.parquet', content_type='application/vnd.apache.parquet')
+        raise Http404
+
+class RecordImportView(LoginRequiredMixin, FormView):
+    template_name = 'kakeibo/record_import.html'
+    form_class = RecordImportForm
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['parquet_available'] = parquet_available()
+        return context
+
+    def form_valid(self, form):
+        file = form.cleaned_data['file']
+        if form.file_format == 'parquet':
+            if not parquet_available():
+                form.add_error('file', 'Parquet の取り込みは利用できません（pyarrow が必要です）。')
+                return self.form_invalid(form)
+            rows = read_parquet(file)
+        else:
+            rows = read_csv(file)
+        result = import_records(self.request.user, rows)
+        return self.render_to_response(self.get_context_data(form=RecordImportForm(), result=result))
+
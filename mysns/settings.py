@@ -130,15 +130,80 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static'),
 ]
+STATICFILES_FINDERS = [
+    'django.contrib.staticfiles.finders.FileSystemFinder',
+    'django.contrib.staticfiles.finders.AppDirectoriesFinder',
+    # plotly パッケージ同梱の plotly.min.js だけを /static/plotly/ で配信する
+    'kakeibo.finders.PlotlyFinder',
+]
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# 添付ファイル1件あたりの上限サイズ（バイト）
+ATTACHMENT_MAX_SIZE = 50 * 1024 * 1024
+# 添付ファイルの送信を Web サーバーに任せる場合に指定（'nginx' は X-Accel-Redirect、'sendfile' は X-Sendfile）
+ATTACHMENT_SENDFILE_BACKEND = None
+# nginx の internal location（例: location /protected/ { internal; alias MEDIA_ROOT/; }）
+ATTACHMENT_SENDFILE_PREFIX = '/protected/'
+
+# 画像の縮小版（sns.thumbnails）
+THUMBNAIL_SPECS = {
+    'avatar_card': {'size': (100, 100), 'crop': True},
+    'avatar_profile': {'size': (120, 120), 'crop': True},
+    'post_detail': {'size': (600, 600), 'crop': False},
+}
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_WORKERS = 2
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# キャッシュ（本番では複数ワーカーで共有できる Redis / Memcached を指定する）
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+# 未読バッジ件数のキャッシュ保持秒数
+UNREAD_COUNT_TIMEOUT = 60 * 5
+# ホームタイムラインの最大件数
+TIMELINE_MAX_LENGTH = 800
+# フォロワー数がこれを超えるアカウントの投稿は配信せず、読み込み時に取得する
+TIMELINE_FANOUT_LIMIT = 10000
+# 書き込みのたびに 1/この値 の確率で切り詰める（最大件数を平均してこの件数程度まで超えてよい）
+TIMELINE_TRIM_SLACK = 50
+# タイムラインへの配信・フォロー直後の取り込み方法（通知と同じディスパッチャを使う。OutboxDispatcher は使えない）
+TIMELINE_DISPATCHER = 'sns.notifications.ThreadDispatcher'
+TIMELINE_DISPATCHER_OPTIONS = {'workers': 1, 'batch_size': 20, 'handler': 'sns.timeline.handle_payloads'}
+# 通知の書き込み方法
+# sns.notifications.SyncDispatcher / ThreadDispatcher / OutboxDispatcher
+NOTIFICATION_DISPATCHER = 'sns.notifications.ThreadDispatcher'
+# workers を増やすのは select_for_update が効くデータベース（PostgreSQL など）だけにする
+NOTIFICATION_DISPATCHER_OPTIONS = {'workers': 1, 'batch_size': 100}
+# 同じ対象へのいいね・フォロー通知を1件にまとめる期間（秒）
+NOTIFICATION_COALESCE_WINDOW = 60 * 60 * 24
+# プロフィール検索で関連度順に取得する最大件数
+SEARCH_MAX_RESULTS = 200
+# 家計簿の集計方法
+# kakeibo.aggregation.SummaryAggregation / RecordAggregation / PandasAggregation
+KAKEIBO_AGGREGATION_BACKEND = 'kakeibo.aggregation.SummaryAggregation'
+# 家計簿の集計結果のキャッシュ保持秒数（記録が変わるとキーが変わる）
+KAKEIBO_ANALYTICS_TIMEOUT = 60 * 60 * 24
+# 繰り返しの予定を期間ごとに展開した結果のキャッシュ保持秒数
+SCHEDULE_OCCURRENCE_CACHE_TIMEOUT = 60 * 60
+# 天気 API の URL と (接続, 読み込み) タイムアウト秒数
+WEATHER_API_URL = 'https://api.openweathermap.org/data/2.5/weather'
+WEATHER_TIMEOUT = (3, 5)
+# 都市ごとの天気のキャッシュ秒数と、期限切れの後も古い値を返す秒数
+WEATHER_CACHE_TTL = 60 * 10
+WEATHER_STALE_TTL = 60 * 60 * 24
+# 連続して失敗したら API の呼び出しを止める回数と、止める秒数
+WEATHER_FAILURE_THRESHOLD = 3
+WEATHER_COOLDOWN = 60
+
 LOGIN_REDIRECT_URL = 'sns:index'
 LOGOUT_REDIRECT_URL = 'accounts:login'
 
@@ -1,4 +1,6 @@
 from django.contrib import admin
-from .models import Event
+from .models import CalendarFeed, Event, EventException
 
 admin.site.register(Event)
+admin.site.register(EventException)
+admin.site.register(CalendarFeed)
@@ -0,0 +1,142 @@
+import calendar
+import heapq
+from datetime import date, datetime, time, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from .models import Event, EventException
+
+# 予定の期間検索（月・週・日表示で共通）
+# 期間は半開区間 [start, end) で扱い、期間と重なる予定（前の月から続く予定も含む）を返す
+# start_time__year / __month のように列を関数で包まず、(user, start_time) インデックスの範囲検索にする
+# 繰り返しの予定は表示する期間の分だけ回を展開し、期間ごとにキャッシュする
+
+SCOPES = ('month', 'week', 'day')
+
+def local_midnight(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+def period(scope, day):
+    # (期間の開始日, 期間の開始日時, 終了日時, 前の期間の日付, 次の期間の日付) を返す
+    if scope == 'month':
+        first = day.replace(day=1)
+        days = calendar.monthrange(first.year, first.month)[1]
+        following = first + timedelta(days=days)
+        previous = (first - timedelta(days=1)).replace(day=1)
+    elif scope == 'week':
+        # 週は月曜始まり
+        first = day - timedelta(days=day.weekday())
+        following = first + timedelta(days=7)
+        previous = first - timedelta(days=7)
+    elif scope == 'day':
+        first = day
+        following = first + timedelta(days=1)
+        previous = first - timedelta(days=1)
+    else:
+        raise ValueError(f'unknown scope: {scope}')
+    return first, local_midnight(first), local_midnight(following), previous, following
+
+def overlapping(start, end):
+    # 終了日時が無い予定は開始時刻だけの予定として扱う
+    return Q(start_time__lt=end) & (Q(end_time__gt=start) | Q(start_time__gte=start))
+
+def single_events(user, start, end):
+    # 短い予定は開始日時が [start - LONG_EVENT_SPAN, end) のものだけを見ればよい
+    # 長い予定は件数が少ないので、開始日時が end より前のものから探す
+    # それぞれ部分インデックスを使えるよう、OR ではなく UNION で結合する
+    events = Event.objects.filter(user=user, rrule='').filter(overlapping(start, end))
+    short = events.filter(is_long=False, start_time__gte=start - Event.LONG_EVENT_SPAN)
+    long = events.filter(is_long=True)
+    return short.union(long, all=True).order_by('start_time', 'pk')
+
+def recurring_series(user, start, end):
+    # 期間が終わる前に始まり、最後の回が期間の開始より後に終わる繰り返しの予定
+    return (
+        Event.objects.filter(user=user, is_long=True, start_time__lt=end).exclude(rrule='')
+        .filter(Q(recurrence_end__isnull=True) | Q(recurrence_end__gte=start))
+    )
+
+class Occurrence:
+    # 繰り返しの予定の1回分（テンプレートでは Event と同じように使える）
+    is_occurrence = True
+
+    def __init__(self, event, original_start, start_time, end_time, title='', description=None):
+        self.event = event
+        self.pk = event.pk
+        self.original_start = original_start
+        self.start_time = start_time
+        self.end_time = end_time
+        self.title = title or event.title
+        self.description = event.description if description is None else description
+
+def iter_occurrences(event, start, end):
+    # [start, end) と重なる回の開始日時を順に生成する（期間より後は展開しない）
+    duration = event.duration()
+    try:
+        rule = event.rule()
+    except ValueError:
+        # 以前に取り込まれた、受け付けなくなった繰り返しは展開しない
+        return
+    for occurrence_start in rule.xafter(start - duration, inc=not duration):
+        if occurrence_start >= end:
+            return
+        yield occurrence_start
+
+def expand_series(event, start, end, exceptions):
+    # [(元の開始日時, 開始日時, 終了日時, タイトル, 説明), ...]（例外を反映済み）
+    duration = event.duration()
+    exceptions = {exception.original_start: exception for exception in exceptions}
+    rows = []
+    for original_start in iter_occurrences(event, start, end):
+        if original_start not in exceptions:
+            rows.append((original_start, original_start, original_start + duration if event.end_time else None, '', None))
+    # 例外のある回は変更後の日時が期間と重なるものだけ表示する（期間外から移動してきた回も含む）
+    for exception in exceptions.values():
+        if exception.cancelled:
+            continue
+        start_time = exception.start_time or exception.original_start
+        end_time = exception.end_time or (start_time + duration if event.end_time else None)
+        if start_time < end and ((end_time and end_time > start) or start_time >= start):
+            rows.append((exception.original_start, start_time, end_time, exception.title, exception.description or None))
+    rows.sort(key=lambda row: row[1])
+    return rows
+
+def occurrence_cache_key(event, start, end):
+    # 予定（と例外）を変更すると updated_at が変わるので古い展開結果は使われなくなる
+    return f'schedule:occurrences:{event.pk}:{event.updated_at.timestamp()}:{start.timestamp()}:{end.timestamp()}'
+
+def occurrences_between(series, start, end):
+    # よく見られる期間（今月・今週など）の展開結果はキャッシュから返す
+    keys = {event.pk: occurrence_cache_key(event, start, end) for event in series}
+    cached = cache.get_many(keys.values())
+    missing = [event for event in series if keys[event.pk] not in cached]
+    if missing:
+        # 変更後の日時が期間内に移動してきた回もあるので、元の日時に関係なく取り出す
+        span = max(event.duration() for event in missing)
+        exceptions = {}
+        rows = EventException.objects.filter(event__in=missing).filter(
+            Q(original_start__gte=start - span, original_start__lt=end)
+            | Q(cancelled=False, start_time__gte=start - span, start_time__lt=end)
+        )
+        for exception in rows:
+            exceptions.setdefault(exception.event_id, []).append(exception)
+        expanded = {keys[event.pk]: expand_series(event, start, end, exceptions.get(event.pk, [])) for event in missing}
+        cache.set_many(expanded, settings.SCHEDULE_OCCURRENCE_CACHE_TIMEOUT)
+        cached.update(expanded)
+    occurrences = [
+        Occurrence(event, *row)
+        for event in series for row in cached[keys[event.pk]]
+    ]
+    occurrences.sort(key=lambda occurrence: (occurrence.start_time, occurrence.pk))
+    return occurrences
+
+def events_between(user, start, end):
+    # 単発の予定と繰り返しの予定の各回を開始日時順にまとめて返す
+    singles = single_events(user, start, end)
+    occurrences = occurrences_between(list(recurring_series(user, start, end)), start, end)
+    return list(heapq.merge(singles, occurrences, key=lambda event: (event.start_time, event.pk)))
+
+def events_for(user, scope, day):
+    _, start, end, _, _ = period(scope, day)
+    return events_between(user, start, end)
@@ -1,7 +1,29 @@
+from datetime import datetime, time, timezone as dt_timezone
 from django import forms
+from django.urls import reverse_lazy
+from django.utils import timezone
+from kakeibo.models import Record
+from sns.widgets import LookupSelect
 from .models import Event
 
 class EventForm(forms.ModelForm):
+    # 画面では頻度と終了日だけを選び、RRULE 文字列に変換して保存する
+    REPEAT_CHOICES = (
+        ('', '繰り返さない'),
+        ('DAILY', '毎日'),
+        ('WEEKLY', '毎週'),
+        ('MONTHLY', '毎月'),
+        ('YEARLY', '毎年'),
+    )
+    repeat = forms.ChoiceField(
+        choices=REPEAT_CHOICES, required=False, label='繰り返し',
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+    repeat_until = forms.DateField(
+        required=False, label='繰り返しの終了日',
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
+    )
+
     class Meta:
         model = Event
         fields = ['title', 'start_time', 'end_time', 'description', 'related_record']
@@ -16,5 +38,68 @@ class EventForm(forms.ModelForm):
                 format='%Y-%m-%dT%H:%M',
             ),
             'description': forms.Textarea(attrs={'class': 'form-control'}),
-            'related_record': forms.Select(attrs={'class': 'form-control'}),
-        }
\ No newline at end of file
+            'related_record': LookupSelect(reverse_lazy('kakeibo:record_lookup'), attrs={'class': 'form-control'}),
+        }
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 自分の記録だけを選べる（検証は選ばれた1件の取得だけ）
+        self.fields['related_record'].queryset = Record.objects.filter(user=user) if user else Record.objects.none()
+        parts = dict(part.split('=', 1) for part in self.instance.rrule.split(';') if '=' in part)
+        try:
+            if parts.get('FREQ') in dict(self.REPEAT_CHOICES):
+                self.initial['repeat'] = parts['FREQ']
+            if 'UNTIL' in parts:
+                until = datetime.strptime(parts['UNTIL'], '%Y%m%dT%H%M%SZ').replace(tzinfo=dt_timezone.utc)
+                self.initial['repeat_until'] = timezone.localtime(until).date()
+            simple = not self.instance.rrule or (set(parts) <= {'FREQ', 'UNTIL'} and 'repeat' in self.initial)
+        except ValueError:
+            simple = False
+        if not simple:
+            try:
+                self.instance.rule()
+            except ValueError:
+                # 以前に取り込まれた、今は受け付けない繰り返しは選び直してもらう
+                self.fields['repeat'].help_text = f'取り込んだ繰り返し（{self.instance.rrule}）には対応していません。選び直してください。'
+            else:
+                # 取り込んだ予定の BYDAY・COUNT・INTERVAL などは画面で表せないので、繰り返しは変更できない
+                for name in ('repeat', 'repeat_until'):
+                    self.fields[name].disabled = True
+                    self.fields[name].help_text = f'取り込んだ繰り返し（{self.instance.rrule}）は変更できません。'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # 繰り返しを変更していなければ RRULE はそのまま残す（開始日時を変えた場合も展開できるかは確かめる）
+        if not {'repeat', 'repeat_until'} & set(self.changed_data):
+            if self.instance.rrule and cleaned_data.get('start_time'):
+                try:
+                    Event(start_time=cleaned_data['start_time'], rrule=self.instance.rrule).rule()
+                except ValueError as e:
+                    self.add_error('repeat', str(e))
+            return cleaned_data
+        repeat = cleaned_data.get('repeat')
+        until = cleaned_data.get('repeat_until')
+        start_time = cleaned_data.get('start_time')
+        if not repeat:
+            self.instance.rrule = ''
+            return cleaned_data
+        rrule = f'FREQ={repeat}'
+        if until:
+            if start_time and until < timezone.localtime(start_time).date():
+                self.add_error('repeat_until', '終了日は開始日以降にしてください。')
+                return cleaned_data
+            # 終了日の終わりまで（RRULE の UNTIL は UTC で書く）
+            until_end = timezone.make_aware(datetime.combine(until, time.max.replace(microsecond=0)))
+            rrule += f';UNTIL={until_end.astimezone(dt_timezone.utc):%Y%m%dT%H%M%SZ}'
+        self.instance.rrule = rrule
+        return cleaned_data
+
+
+class EventImportForm(forms.Form):
+    file = forms.FileField(label='iCalendar ファイル（.ics）', widget=forms.ClearableFileInput(attrs={'class': 'form-control'}))
+
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        if not file.name.lower().endswith('.ics'):
+            raise forms.ValidationError('.ics ファイルを選択してください。')
+        return file
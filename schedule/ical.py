@@ -0,0 +1,267 @@
+import io
+import zoneinfo
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from dateutil.rrule import rrulestr
+from django.db.models import Count, Max
+from django.utils import timezone
+from .models import Event, EventException
+
+# iCalendar（RFC 5545）の書き出し・取り込み
+# 書き出しは予定をチャンク単位で読みながら1件ずつ VEVENT を生成し、取り込みも1行ずつ読んで一定件数ごとに登録する
+
+CHUNK_SIZE = 500
+PRODID = '-//mysns//schedule//JA'
+# 画面に表示するエラーの上限
+MAX_ERRORS = 50
+
+def escape_text(value):
+    return (
+        value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+def unescape_text(value):
+    result = []
+    chars = iter(value)
+    for char in chars:
+        if char == '\\':
+            char = next(chars, '')
+            result.append('\n' if char in ('n', 'N') else char)
+        else:
+            result.append(char)
+    return ''.join(result)
+
+def fold(line):
+    # 1行 75 オクテットまで（マルチバイト文字の途中では折り返さない）
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts = []
+    current = ''
+    limit = 75
+    for char in line:
+        if len((current + char).encode('utf-8')) > limit:
+            parts.append(current)
+            current = ''
+            limit = 74  # 継続行は先頭の空白1文字分短い
+        current += char
+    parts.append(current)
+    return '\r\n '.join(parts) + '\r\n'
+
+def format_utc(value):
+    return value.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+def vevent(event, domain):
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:event-{event.pk}@{domain}',
+        f'DTSTAMP:{format_utc(event.updated_at)}',
+        f'DTSTART:{format_utc(event.start_time)}',
+    ]
+    if event.end_time:
+        lines.append(f'DTEND:{format_utc(event.end_time)}')
+    lines.append(f'SUMMARY:{escape_text(event.title)}')
+    if event.description:
+        lines.append(f'DESCRIPTION:{escape_text(event.description)}')
+    exceptions = list(event.exceptions.all()) if event.rrule else []
+    if event.rrule:
+        lines.append(f'RRULE:{event.rrule}')
+        for exception in exceptions:
+            if exception.cancelled:
+                lines.append(f'EXDATE:{format_utc(exception.original_start)}')
+    lines.append('END:VEVENT')
+    # 1回分だけ変更した回は RECURRENCE-ID 付きの VEVENT で上書きする
+    for exception in exceptions:
+        if exception.cancelled:
+            continue
+        start_time = exception.start_time or exception.original_start
+        end_time = exception.end_time or (start_time + event.duration() if event.end_time else None)
+        lines += [
+            'BEGIN:VEVENT',
+            f'UID:event-{event.pk}@{domain}',
+            f'DTSTAMP:{format_utc(event.updated_at)}',
+            f'RECURRENCE-ID:{format_utc(exception.original_start)}',
+            f'DTSTART:{format_utc(start_time)}',
+        ]
+        if end_time:
+            lines.append(f'DTEND:{format_utc(end_time)}')
+        lines.append(f'SUMMARY:{escape_text(exception.title or event.title)}')
+        description = exception.description or event.description
+        if description:
+            lines.append(f'DESCRIPTION:{escape_text(description)}')
+        lines.append('END:VEVENT')
+    return ''.join(fold(line) for line in lines)
+
+def calendar_version(user_id):
+    # (最新の updated_at, 件数)。削除では最新の updated_at が変わらないことがあるので件数も見る
+    stats = Event.objects.filter(user_id=user_id).aggregate(latest=Max('updated_at'), count=Count('pk'))
+    return stats['latest'], stats['count']
+
+def iter_calendar(user, domain):
+    yield ''.join(fold(line) for line in [
+        'BEGIN:VCALENDAR', 'VERSION:2.0', f'PRODID:{PRODID}', 'CALSCALE:GREGORIAN',
+        f'X-WR-CALNAME:{escape_text(user.username)} の予定',
+    ])
+    events = Event.objects.filter(user=user).order_by('pk').prefetch_related('exceptions')
+    for event in events.iterator(chunk_size=CHUNK_SIZE):
+        yield vevent(event, domain)
+    yield fold('END:VCALENDAR')
+
+# ---- 取り込み ----
+
+def iter_lines(fileobj):
+    # 折り返された行を1行に戻しながら読む
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    try:
+        current = None
+        for raw in text:
+            raw = raw.rstrip('\r\n')
+            if raw[:1] in (' ', '\t') and current is not None:
+                current += raw[1:]
+                continue
+            if current is not None:
+                yield current
+            current = raw
+        if current:
+            yield current
+    finally:
+        # アップロードファイル本体は閉じない
+        text.detach()
+
+def parse_line(line):
+    # 'DTSTART;TZID=Asia/Tokyo:20250101T090000' -> ('DTSTART', {'TZID': 'Asia/Tokyo'}, '20250101T090000')
+    head, _, value = line.partition(':')
+    name, *params = head.split(';')
+    return name.upper(), dict(param.split('=', 1) for param in params if '=' in param), value
+
+def parse_datetime(value, params):
+    if params.get('VALUE') == 'DATE' or len(value) == 8:
+        # 終日の予定はその日の 0:00 とする
+        return timezone.make_aware(datetime.combine(date(int(value[:4]), int(value[4:6]), int(value[6:8])), time.min))
+    if value.endswith('Z'):
+        return datetime.strptime(value, '%Y%m%dT%H%M%SZ').replace(tzinfo=dt_timezone.utc)
+    naive = datetime.strptime(value, '%Y%m%dT%H%M%S')
+    if 'TZID' in params:
+        return naive.replace(tzinfo=zoneinfo.ZoneInfo(params['TZID'].strip('"')))
+    return timezone.make_aware(naive)
+
+def parse_duration(value):
+    # 'PT1H30M' / 'P1D' のような形式
+    sign = -1 if value.startswith('-') else 1
+    value = value.lstrip('+-').lstrip('P')
+    days = hours = minutes = seconds = 0
+    number = ''
+    in_time = False
+    for char in value:
+        if char.isdigit():
+            number += char
+            continue
+        if char == 'T':
+            in_time = True
+            continue
+        amount = int(number or 0)
+        number = ''
+        if char == 'W':
+            days += amount * 7
+        elif char == 'D':
+            days += amount
+        elif char == 'H' and in_time:
+            hours += amount
+        elif char == 'M' and in_time:
+            minutes += amount
+        elif char == 'S' and in_time:
+            seconds += amount
+    return sign * timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds)
+
+def iter_vevents(fileobj):
+    # VEVENT ごとに {プロパティ名: [(パラメータ, 値), ...]} を返す
+    properties = None
+    for line in iter_lines(fileobj):
+        name, params, value = parse_line(line)
+        if name == 'BEGIN' and value.upper() == 'VEVENT':
+            properties = {}
+        elif name == 'END' and value.upper() == 'VEVENT' and properties is not None:
+            yield properties
+            properties = None
+        elif properties is not None:
+            properties.setdefault(name, []).append((params, value))
+
+def build_event(user, properties):
+    # (Event, 取り消す回の開始日時のリスト) を返す。取り込めない VEVENT は ValueError
+    def first(name):
+        values = properties.get(name)
+        return values[0] if values else (None, None)
+
+    params, value = first('DTSTART')
+    if value is None:
+        raise ValueError('DTSTART がありません')
+    start_time = parse_datetime(value, params)
+    params, value = first('DTEND')
+    end_time = parse_datetime(value, params) if value else None
+    if end_time is None and first('DURATION')[1]:
+        end_time = start_time + parse_duration(first('DURATION')[1])
+    if end_time and end_time < start_time:
+        raise ValueError('DTEND が DTSTART より前です')
+    rrule = first('RRULE')[1] or ''
+    if rrule:
+        # 展開に時間のかかる繰り返しは予定を作る前に断る
+        Event.check_rrule(rrule)
+    event = Event(
+        user=user,
+        title=unescape_text(first('SUMMARY')[1] or '（無題）')[:Event._meta.get_field('title').max_length],
+        description=unescape_text(first('DESCRIPTION')[1] or ''),
+        start_time=start_time,
+        end_time=end_time,
+        rrule=rrule,
+    )
+    exdates = []
+    if event.rrule:
+        # 解釈できない RRULE は取り込まない
+        try:
+            event.rule()
+        except (ValueError, TypeError) as e:
+            raise ValueError(f'RRULE を解釈できません（{e}）')
+        for params, value in properties.get('EXDATE', []):
+            exdates += [parse_datetime(item, params) for item in value.split(',') if item]
+    event.update_span()
+    return event, exdates
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.skipped = 0
+        self.errors = []
+
+    def add_error(self, number, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((number, message))
+
+def import_calendar(user, fileobj, batch_size=1000):
+    # 1回分だけの変更（RECURRENCE-ID 付きの VEVENT）は取り込まない
+    result = ImportResult()
+    batch = []
+
+    def flush():
+        Event.objects.bulk_create([event for event, _ in batch])
+        EventException.objects.bulk_create([
+            EventException(event=event, original_start=exdate, cancelled=True)
+            for event, exdates in batch for exdate in exdates
+        ], ignore_conflicts=True)
+        result.created += len(batch)
+        batch.clear()
+
+    for number, properties in enumerate(iter_vevents(fileobj), start=1):
+        if 'RECURRENCE-ID' in properties:
+            result.add_error(number, '繰り返しの1回分だけの変更は取り込めません')
+            continue
+        try:
+            batch.append(build_event(user, properties))
+        except (ValueError, zoneinfo.ZoneInfoNotFoundError) as e:
+            result.add_error(number, str(e))
+            continue
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return result
@@ -0,0 +1,73 @@
+import random
+import time
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from schedule.calendar import events_between, period, single_events
+from schedule.models import Event
+
+class Command(BaseCommand):
+    help = '予定の月表示の検索時間を以前の start_time__year / __month による検索と比較します（ダミーデータは最後にロールバック）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=1000000)
+        parser.add_argument('--users', type=int, default=10, help='予定を振り分けるユーザー数')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def create_events(self, users, count):
+        now = timezone.now()
+        batch = []
+        for i in range(count):
+            start = now + timedelta(minutes=random.randrange(-5 * 365 * 24 * 60, 5 * 365 * 24 * 60))
+            # 1% は数日〜数週間にわたる予定
+            length = timedelta(days=random.randrange(2, 30)) if random.random() < 0.01 else timedelta(hours=1)
+            event = Event(user=users[i % len(users)], title=f'event{i}', start_time=start, end_time=start + length)
+            event.update_span()
+            batch.append(event)
+            if len(batch) >= 10000:
+                Event.objects.bulk_create(batch)
+                batch = []
+        Event.objects.bulk_create(batch)
+
+    def measure(self, func, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            rows = len(list(func()))
+        return (time.perf_counter() - started) / repeat * 1000, rows
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            users = [User.objects.create_user(username=f'calendar-benchmark-{time.time_ns()}-{i}') for i in range(options['users'])]
+            started = time.perf_counter()
+            self.create_events(users, options['events'])
+            self.stdout.write(f"{options['events']} 件の予定を {time.perf_counter() - started:.1f} 秒で作成しました")
+
+            user = users[0]
+            today = timezone.localdate()
+            _, start, end, _, _ = period('month', today)
+
+            def legacy():
+                return Event.objects.filter(
+                    user=user, start_time__year=today.year, start_time__month=today.month,
+                ).order_by('start_time')
+
+            def ranged():
+                return events_between(user, start, end)
+
+            plans = {'year/month': legacy(), 'range': single_events(user, start, end)}
+            for name, func in (('year/month', legacy), ('range', ranged)):
+                ms, rows = self.measure(func, options['repeat'])
+                self.stdout.write(f'{name:>10}: {ms:8.2f} ms/回  {rows} 件')
+                if connection.vendor == 'sqlite':
+                    for line in self.plan(plans[name]):
+                        self.stdout.write(f'            {line}')
+            # ダミーデータを残さない
+            transaction.set_rollback(True)
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:05
+
+from django.conf import settings
+from datetime import timedelta
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_is_long(apps, schema_editor):
+    Event = apps.get_model('schedule', 'Event')
+    Event.objects.filter(end_time__gt=F('start_time') + timedelta(days=1)).update(is_long=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kakeibo', '0004_record_version_idx'),
+        ('schedule', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='is_long',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('is_long', False)), fields=['user', 'start_time'], name='schedule_event_short_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('is_long', True)), fields=['user', 'start_time'], name='schedule_event_long_idx'),
+        ),
+        migrations.RunPython(fill_is_long, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0002_event_range_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='recurrence_end',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='rrule',
+            field=models.CharField(blank=True, max_length=500, verbose_name='繰り返し'),
+        ),
+        migrations.CreateModel(
+            name='EventException',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_start', models.DateTimeField(verbose_name='元の開始日時')),
+                ('cancelled', models.BooleanField(default=False, verbose_name='取り消し')),
+                ('start_time', models.DateTimeField(blank=True, null=True, verbose_name='開始日時')),
+                ('end_time', models.DateTimeField(blank=True, null=True, verbose_name='終了日時')),
+                ('title', models.CharField(blank=True, max_length=100, verbose_name='予定タイトル')),
+                ('description', models.TextField(blank=True, verbose_name='説明')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exceptions', to='schedule.event')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('event', 'original_start'), name='schedule_exception_unique')],
+            },
+        ),
+    ]
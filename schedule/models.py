@@ -1,4 +1,9 @@
+import secrets
+from datetime import MAXYEAR, timedelta
+from itertools import islice
+from dateutil.rrule import rrulestr
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 from kakeibo.models import Record
 
@@ -12,6 +17,130 @@ class Event(models.Model):
     related_record = models.ForeignKey(Record, on_delete=models.SET_NULL, blank=True, null=True, verbose_name='関連家計簿')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # 繰り返し（RFC 5545 の RRULE 形式。例：FREQ=WEEKLY;BYDAY=MO）。回ごとの行は作らず表示時に展開する
+    rrule = models.CharField(max_length=500, blank=True, verbose_name='繰り返し')
+    # 繰り返しの最後の回の終了日時（無期限なら None）
+    recurrence_end = models.DateTimeField(blank=True, null=True, editable=False)
+    # LONG_EVENT_SPAN より長い予定と繰り返しの予定（期間検索で開始日時の下限を絞れないので別に探す）
+    is_long = models.BooleanField(default=False, editable=False)
+
+    LONG_EVENT_SPAN = timedelta(days=1)
+    # 受け付ける繰り返し（画面で作れる日・週・月・年単位のみ）。秒・分・時間単位の繰り返しや
+    # 回数の多すぎる繰り返しは展開に時間がかかるので取り込まない
+    RRULE_FREQS = ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY')
+    RRULE_FORBIDDEN_PARTS = ('BYSECOND', 'BYMINUTE', 'BYHOUR')
+    RRULE_MAX_COUNT = 1000
+    # 最初の回がこの年数以内に無い繰り返し（2月30日など条件に合う日が無いもの）も取り込まない
+    RRULE_HORIZON_YEARS = 10
+
+    class Meta:
+        indexes = [
+            # 期間検索：短い予定・長い予定それぞれ (user, start_time) の範囲をインデックスで辿る
+            models.Index(fields=['user', 'start_time'], name='schedule_event_short_idx', condition=models.Q(is_long=False)),
+            models.Index(fields=['user', 'start_time'], name='schedule_event_long_idx', condition=models.Q(is_long=True)),
+            # .ics フィードの ETag（最新の updated_at と件数）をインデックスだけで求める
+            models.Index(fields=['user', 'updated_at'], name='schedule_event_version_idx'),
+        ]
 
     def __str__(self):
         return f'{self.title} ({self.start_time})'
+
+    def duration(self):
+        return self.end_time - self.start_time if self.end_time else timedelta(0)
+
+    @classmethod
+    def check_rrule(cls, rrule):
+        # 受け付けない繰り返しは ValueError
+        max_length = cls._meta.get_field('rrule').max_length
+        if len(rrule) > max_length:
+            raise ValueError(f'繰り返し（RRULE）は {max_length} 文字までです')
+        parts = dict(part.partition('=')[::2] for part in rrule.upper().split(';'))
+        if parts.get('FREQ') not in cls.RRULE_FREQS:
+            raise ValueError(f'繰り返しの頻度（FREQ={parts.get("FREQ", "")}）には対応していません')
+        for name in cls.RRULE_FORBIDDEN_PARTS:
+            if name in parts:
+                raise ValueError(f'{name} を含む繰り返しには対応していません')
+        if 'COUNT' in parts and not (parts['COUNT'].isdigit() and int(parts['COUNT']) <= cls.RRULE_MAX_COUNT):
+            raise ValueError(f'繰り返しの回数（COUNT）は {cls.RRULE_MAX_COUNT} 回までです')
+
+    def rule(self):
+        self.check_rrule(self.rrule)
+        # 曜日などを日本時間で解釈するため、開始日時を現在のタイムゾーンに直して渡す
+        start = timezone.localtime(self.start_time)
+        rule = rrulestr(self.rrule, dtstart=start)
+        # dateutil は条件に合う日が無いと 9999 年まで探し続けるので、先に RRULE_HORIZON_YEARS 以内に回があるかを確かめる。
+        # 暦は曜日も含めて 400 年で一巡するので、開始日時を 400 年単位で 9999 年の手前までずらして探す範囲を絞る
+        shift = max((MAXYEAR - self.RRULE_HORIZON_YEARS - start.year) // 400 * 400, 0)
+        probe_start = start.replace(year=start.year + shift)
+        first = next(iter(rule.replace(dtstart=probe_start, count=None, until=None)), None)
+        if first is None or first.year - probe_start.year > self.RRULE_HORIZON_YEARS:
+            raise ValueError(f'{self.RRULE_HORIZON_YEARS} 年以内に当てはまる日がない繰り返しには対応していません')
+        return rule
+
+    def update_span(self):
+        # bulk_create では save() が呼ばれないので、一括登録の前にも呼ぶ
+        self.is_long = bool(self.rrule) or bool(self.end_time and self.duration() > self.LONG_EVENT_SPAN)
+        self.recurrence_end = None
+        rrule = self.rrule.upper()
+        if 'COUNT=' in rrule or 'UNTIL=' in rrule:
+            # 数えるのは RRULE_MAX_COUNT 回まで。それより多い UNTIL 付きの繰り返しは無期限として扱う
+            # （期間検索の候補に残るだけで、表示する回は期間の分しか展開しない）
+            occurrences = list(islice(self.rule(), self.RRULE_MAX_COUNT + 1))
+            if len(occurrences) > self.RRULE_MAX_COUNT:
+                return
+            last = occurrences[-1] if occurrences else self.start_time
+            self.recurrence_end = last + self.duration()
+
+    def save(self, *args, **kwargs):
+        self.update_span()
+        super().save(*args, **kwargs)
+
+
+class EventException(models.Model):
+    # 繰り返しの予定の1回分だけの変更・取り消し（original_start で対象の回を指定する）
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='exceptions')
+    original_start = models.DateTimeField(verbose_name='元の開始日時')
+    cancelled = models.BooleanField(default=False, verbose_name='取り消し')
+    start_time = models.DateTimeField(blank=True, null=True, verbose_name='開始日時')
+    end_time = models.DateTimeField(blank=True, null=True, verbose_name='終了日時')
+    title = models.CharField(max_length=100, blank=True, verbose_name='予定タイトル')
+    description = models.TextField(blank=True, verbose_name='説明')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'original_start'], name='schedule_exception_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.event.title} ({self.original_start})'
+
+    def touch_event(self):
+        # 展開済みの回のキャッシュは予定の updated_at で区別しているので、変更したら予定側も更新する
+        Event.objects.filter(pk=self.event_id).update(updated_at=timezone.now())
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.touch_event()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self.touch_event()
+        return result
+
+
+def new_feed_token():
+    return secrets.token_urlsafe(32)
+
+class CalendarFeed(models.Model):
+    # カレンダーアプリ購読用の .ics フィード（URL のトークンだけで認証する）
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='calendar_feed')
+    token = models.CharField(max_length=64, unique=True, default=new_feed_token)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.user} のカレンダーフィード'
+
+    def regenerate(self):
+        # URL が漏れたときは作り直して古い URL を無効にする
+        self.token = new_feed_token()
+        self.save(update_fields=['token'])
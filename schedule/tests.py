@@ -1,3 +1,326 @@
+import io
+import re
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils import timezone
+from django.core.files.uploadedfile import SimpleUploadedFile
+from kakeibo.models import Record
+from .calendar import events_between, events_for, period
+from .forms import EventForm
+from .ical import fold, import_calendar
+from .models import CalendarFeed, Event, EventException
+
+def local(*args):
+    return timezone.make_aware(datetime(*args))
+
+class CalendarQueryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='planner', password='pass')
+        self.client.force_login(self.user)
+
+    def create(self, title, start, end=None):
+        return Event.objects.create(user=self.user, title=title, start_time=start, end_time=end)
+
+    def titles(self, scope, day):
+        return [event.title for event in events_for(self.user, scope, day)]
+
+    def test_month_includes_overlapping_events(self):
+        self.create('前月から続く旅行', local(2025, 1, 28, 9), local(2025, 2, 3, 18))
+        self.create('前月末の予定', local(2025, 1, 31, 23), local(2025, 2, 1, 0))
+        self.create('月初', local(2025, 2, 1, 0))
+        self.create('月末の夜通し', local(2025, 2, 28, 22), local(2025, 3, 1, 2))
+        self.create('翌月', local(2025, 3, 1, 0))
+        self.assertEqual(self.titles('month', date(2025, 2, 14)), ['前月から続く旅行', '月初', '月末の夜通し'])
+        self.assertTrue(Event.objects.get(title='前月から続く旅行').is_long)
+
+    def test_week_and_day(self):
+        self.create('月曜', local(2025, 3, 3, 10), local(2025, 3, 3, 11))
+        self.create('日曜', local(2025, 3, 9, 10))
+        self.create('次の月曜', local(2025, 3, 10, 0))
+        self.assertEqual(self.titles('week', date(2025, 3, 5)), ['月曜', '日曜'])
+        self.assertEqual(self.titles('day', date(2025, 3, 9)), ['日曜'])
+
+    def test_other_users_events_are_excluded(self):
+        other = User.objects.create_user(username='other', password='pass')
+        Event.objects.create(user=other, title='他人', start_time=local(2025, 4, 1, 9))
+        self.assertEqual(self.titles('month', date(2025, 4, 1)), [])
+
+    def test_views(self):
+        self.create('長期出張', local(2025, 5, 20, 9), local(2025, 6, 5, 18))
+        response = self.client.get(reverse('schedule:dashboard'), {'date': '2025-06-10'})
+        self.assertEqual([e.title for e in response.context['events']], ['長期出張'])
+        response = self.client.get(reverse('schedule:calendar', args=['week']), {'date': '2025-06-02'})
+        self.assertEqual([e.title for e in response.context['events']], ['長期出張'])
+        self.assertEqual(self.client.get(reverse('schedule:calendar', args=['year'])).status_code, 404)
+
+class RecurrenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='weekly', password='pass')
+        self.client.force_login(self.user)
+        # 2025/1/6 から毎週月曜 10:00-11:00
+        self.event = Event.objects.create(
+            user=self.user, title='定例会議', rrule='FREQ=WEEKLY;BYDAY=MO',
+            start_time=local(2025, 1, 6, 10), end_time=local(2025, 1, 6, 11),
+        )
+
+    def starts(self, scope, day):
+        return [event.start_time for event in events_for(self.user, scope, day)]
+
+    def test_occurrences_are_expanded_only_for_the_window(self):
+        self.assertEqual(self.starts('month', date(2025, 2, 1)), [
+            local(2025, 2, 3, 10), local(2025, 2, 10, 10), local(2025, 2, 17, 10), local(2025, 2, 24, 10),
+        ])
+        self.assertEqual(self.starts('month', date(2024, 12, 1)), [])
+        # 無期限の繰り返しでも1行だけ
+        self.assertEqual(Event.objects.count(), 1)
+        self.assertIsNone(self.event.recurrence_end)
+
+    def test_until_limits_series(self):
+        self.event.rrule = 'FREQ=WEEKLY;BYDAY=MO;COUNT=3'
+        self.event.save()
+        self.assertEqual(self.event.recurrence_end, local(2025, 1, 20, 11))
+        self.assertEqual(self.starts('month', date(2025, 2, 1)), [])
+
+    def test_exceptions_cancel_and_move_occurrences(self):
+        EventException.objects.create(event=self.event, original_start=local(2025, 2, 10, 10), cancelled=True)
+        EventException.objects.create(
+            event=self.event, original_start=local(2025, 2, 17, 10),
+            start_time=local(2025, 2, 18, 15), end_time=local(2025, 2, 18, 16), title='定例会議（火曜に変更）',
+        )
+        occurrences = events_for(self.user, 'month', date(2025, 2, 1))
+        self.assertEqual(
+            [(o.start_time, o.title) for o in occurrences],
+            [(local(2025, 2, 3, 10), '定例会議'), (local(2025, 2, 18, 15), '定例会議（火曜に変更）'), (local(2025, 2, 24, 10), '定例会議')],
+        )
+        # 翌月の初回を前月末に移動した場合は前月に表示される
+        EventException.objects.create(event=self.event, original_start=local(2025, 3, 3, 10), start_time=local(2025, 2, 28, 10))
+        self.assertIn(local(2025, 2, 28, 10), self.starts('month', date(2025, 2, 1)))
+        self.assertNotIn(local(2025, 3, 3, 10), self.starts('month', date(2025, 3, 1)))
+
+    def test_hot_window_is_served_from_cache(self):
+        _, start, end, _, _ = period('month', date(2025, 2, 1))
+        events_between(self.user, start, end)
+        with CaptureQueriesContext(connection) as ctx:
+            events_between(self.user, start, end)
+        # 単発の予定と繰り返しの予定を探す2クエリだけ（例外の取得と展開は行わない）
+        self.assertEqual(len(ctx.captured_queries), 2)
+
+    def test_long_until_is_not_counted_to_the_end(self):
+        self.event.rrule = 'FREQ=DAILY;UNTIL=99991231T000000Z'
+        self.event.save()
+        self.assertIsNone(self.event.recurrence_end)
+        self.assertEqual(len(self.starts('week', date(2025, 2, 3))), 7)
+
+    def test_rejected_rrule_already_stored_is_not_expanded(self):
+        # 以前の取り込みで保存された繰り返し（save() を通さずに書き換える）
+        for rrule in ('FREQ=SECONDLY', 'FREQ=DAILY;BYMONTH=2;BYMONTHDAY=30'):
+            cache.clear()
+            Event.objects.filter(pk=self.event.pk).update(rrule=rrule)
+            self.assertEqual(self.starts('day', date(2025, 2, 3)), [])
+        # 編集画面では繰り返しを選び直せる
+        data = {
+            'title': '定例会議', 'start_time': '2025-01-06T10:00', 'end_time': '2025-01-06T11:00',
+            'repeat': 'DAILY', 'description': '',
+        }
+        response = self.client.post(reverse('schedule:event_update', args=[self.event.pk]), data)
+        self.assertContains(response, '当てはまる日がない')
+        response = self.client.post(reverse('schedule:event_update', args=[self.event.pk]), {**data, 'repeat': 'WEEKLY'})
+        self.assertEqual(response.status_code, 302)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.rrule, 'FREQ=WEEKLY')
+
+    def test_merged_with_single_events(self):
+        Event.objects.create(user=self.user, title='単発', start_time=local(2025, 2, 3, 9))
+        self.assertEqual(
+            [event.title for event in events_for(self.user, 'day', date(2025, 2, 3))], ['単発', '定例会議'],
+        )
+
+    def test_form_builds_rrule_and_cancel_view(self):
+        response = self.client.post(reverse('schedule:dashboard'), {
+            'title': 'ジム', 'start_time': '2025-04-01T07:00', 'end_time': '2025-04-01T08:00',
+            'repeat': 'DAILY', 'repeat_until': '2025-04-03', 'description': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        event = Event.objects.get(title='ジム')
+        self.assertEqual(event.rrule, 'FREQ=DAILY;UNTIL=20250403T145959Z')
+        self.assertEqual(len(events_for(self.user, 'day', date(2025, 4, 3))), 1)
+        self.assertEqual(len(events_for(self.user, 'day', date(2025, 4, 4))), 0)
+
+        response = self.client.post(reverse('schedule:occurrence_cancel', args=[event.pk]), {
+            'original_start': local(2025, 4, 2, 7).isoformat(),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(events_for(self.user, 'day', date(2025, 4, 2))), 0)
+        # 繰り返しに含まれない日時は取り消せない
+        response = self.client.post(reverse('schedule:occurrence_cancel', args=[event.pk]), {
+            'original_start': local(2025, 4, 2, 8).isoformat(),
+        })
+        self.assertEqual(response.status_code, 404)
+
+    def test_editing_title_keeps_imported_rrule(self):
+        self.event.rrule = 'FREQ=WEEKLY;BYDAY=MO,WE;COUNT=10;INTERVAL=2'
+        self.event.save()
+        form = EventForm(instance=self.event, user=self.user)
+        self.assertTrue(form.fields['repeat'].disabled)
+        response = self.client.post(reverse('schedule:event_update', args=[self.event.pk]), {
+            'title': '隔週の会議', 'start_time': '2025-01-06T10:00', 'end_time': '2025-01-06T11:00',
+            'repeat': 'DAILY', 'description': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.title, '隔週の会議')
+        self.assertEqual(self.event.rrule, 'FREQ=WEEKLY;BYDAY=MO,WE;COUNT=10;INTERVAL=2')
+        self.assertEqual(self.event.recurrence_end, local(2025, 3, 5, 11))
+
+    def test_editing_title_keeps_simple_rrule(self):
+        self.event.rrule = 'FREQ=DAILY;UNTIL=20250403T145959Z'
+        self.event.save()
+        response = self.client.post(reverse('schedule:event_update', args=[self.event.pk]), {
+            'title': 'ジム', 'start_time': '2025-01-06T10:00', 'end_time': '2025-01-06T11:00',
+            'repeat': 'DAILY', 'repeat_until': '2025-04-03', 'description': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.event.refresh_from_db()
+        self.assertEqual((self.event.title, self.event.rrule), ('ジム', 'FREQ=DAILY;UNTIL=20250403T145959Z'))
+        # 繰り返しをやめる
+        self.client.post(reverse('schedule:event_update', args=[self.event.pk]), {
+            'title': 'ジム', 'start_time': '2025-01-06T10:00', 'end_time': '2025-01-06T11:00',
+            'repeat': '', 'repeat_until': '', 'description': '',
+        })
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.rrule, '')
+
+
+class ICalendarTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='subscriber', password='pass')
+        self.client.force_login(self.user)
+        self.feed = CalendarFeed.objects.create(user=self.user)
+        self.url = reverse('schedule:calendar_feed', args=[self.feed.token])
+        self.event = Event.objects.create(
+            user=self.user, title='定例会議, 第1会議室', description='議題;\n予算', rrule='FREQ=WEEKLY;BYDAY=MO;COUNT=4',
+            start_time=local(2025, 1, 6, 10), end_time=local(2025, 1, 6, 11),
+        )
+        EventException.objects.create(event=self.event, original_start=local(2025, 1, 13, 10), cancelled=True)
+
+    def test_feed_content(self):
+        self.client.logout()
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn('BEGIN:VCALENDAR\r\n', body)
+        self.assertIn('SUMMARY:定例会議\\, 第1会議室\r\n', body)
+        self.assertIn('DTSTART:20250106T010000Z\r\n', body)
+        self.assertIn('RRULE:FREQ=WEEKLY;BYDAY=MO;COUNT=4\r\n', body)
+        self.assertIn('EXDATE:20250113T010000Z\r\n', body)
+
+    def test_not_modified_until_events_change(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Event.objects.create(user=self.user, title='追加', start_time=local(2025, 2, 1, 9))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_unknown_and_regenerated_token(self):
+        self.assertEqual(self.client.get(reverse('schedule:calendar_feed', args=['unknown'])).status_code, 404)
+        self.client.post(reverse('schedule:calendar_feed_regenerate'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_fold_keeps_multibyte_characters(self):
+        line = 'SUMMARY:' + 'あ' * 40
+        folded = fold(line)
+        self.assertTrue(all(len(part.encode()) <= 75 for part in folded.split('\r\n')))
+        self.assertEqual(folded.replace('\r\n ', '').rstrip('\r\n'), line)
+
+    def test_import_round_trip(self):
+        body = b''.join(self.client.get(self.url).streaming_content)
+        other = User.objects.create_user(username='importer', password='pass')
+        result = import_calendar(other, io.BytesIO(body))
+        self.assertEqual((result.created, result.skipped), (1, 0))
+        event = Event.objects.get(user=other)
+        self.assertEqual(event.title, self.event.title)
+        self.assertEqual(event.description, self.event.description)
+        self.assertEqual(event.rrule, self.event.rrule)
+        self.assertEqual(event.recurrence_end, local(2025, 1, 27, 11))
+        self.assertEqual(
+            [o.start_time for o in events_between(other, local(2025, 1, 1), local(2025, 2, 1))],
+            [local(2025, 1, 6, 10), local(2025, 1, 20, 10), local(2025, 1, 27, 10)],
+        )
+
+    def test_import_rejects_expensive_rrules(self):
+        rules = [
+            'FREQ=SECONDLY;COUNT=2000000000', 'FREQ=DAILY;BYHOUR=9,10', 'FREQ=WEEKLY;COUNT=1001',
+            'FREQ=DAILY;BYMONTH=2;BYMONTHDAY=30;COUNT=5', 'FREQ=WEEKLY;BYDAY=' + ','.join(['MO'] * 200),
+            'FREQ=WEEKLY;COUNT=3',
+        ]
+        data = 'BEGIN:VCALENDAR\r\n' + ''.join(
+            f'BEGIN:VEVENT\r\nSUMMARY:繰り返し{i}\r\nDTSTART:20250106T010000Z\r\nRRULE:{rule}\r\nEND:VEVENT\r\n'
+            for i, rule in enumerate(rules)
+        ) + 'END:VCALENDAR\r\n'
+        result = import_calendar(self.user, io.BytesIO(data.encode()))
+        self.assertEqual((result.created, result.skipped), (1, 5))
+        self.assertEqual([number for number, _ in result.errors], [1, 2, 3, 4, 5])
+        self.assertEqual(Event.objects.get(title='繰り返し5').recurrence_end, local(2025, 1, 20, 10))
+
+    def test_import_view_reports_errors(self):
+        data = (
+            'BEGIN:VCALENDAR\r\n'
+            'BEGIN:VEVENT\r\nSUMMARY:終日\r\nDTSTART;VALUE=DATE:20250301\r\nDURATION:P1D\r\nEND:VEVENT\r\n'
+            'BEGIN:VEVENT\r\nSUMMARY:東京時間\r\nDTSTART;TZID=Asia/Tokyo:20250302T090000\r\nEND:VEVENT\r\n'
+            'BEGIN:VEVENT\r\nSUMMARY:開始なし\r\nEND:VEVENT\r\n'
+            'END:VCALENDAR\r\n'
+        ).encode()
+        response = self.client.post(reverse('schedule:event_import'), {
+            'file': SimpleUploadedFile('calendar.ics', data, content_type='text/calendar'),
+        })
+        self.assertEqual(response.context['result'].created, 2)
+        self.assertContains(response, '3 件目')
+        all_day = Event.objects.get(title='終日')
+        self.assertEqual(all_day.end_time - all_day.start_time, timedelta(days=1))
+        self.assertEqual(Event.objects.get(title='東京時間').start_time, datetime(2025, 3, 2, 0, tzinfo=dt_timezone.utc))
+
+
+class RelatedRecordTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='pass')
+        self.other = User.objects.create_user(username='stranger', password='pass')
+        self.client.force_login(self.user)
+        self.record = Record.objects.create(user=self.user, date=date(2025, 4, 1), category='expense', amount=1200, memo='ランチ')
+        self.foreign = Record.objects.create(user=self.other, date=date(2025, 4, 1), category='expense', amount=9999, memo='他人')
+        Record.objects.bulk_create([
+            Record(user=self.user, date=date(2025, 3, 1), category='income', amount=i) for i in range(50)
+        ])
+
+    def record_options(self, response):
+        select = re.search(r'<select name="related_record".*?</select>', response.content.decode(), re.S).group()
+        return select.count('<option')
+
+    def data(self, record):
+        return {'title': '食事会', 'start_time': '2025-04-01T12:00', 'related_record': record.pk}
+
+    def test_dashboard_renders_only_selected_record(self):
+        response = self.client.get(reverse('schedule:dashboard'))
+        self.assertContains(response, reverse('kakeibo:record_lookup'))
+        self.assertNotContains(response, '9999')
+        self.assertEqual(self.record_options(response), 1)
+        event = Event.objects.create(user=self.user, title='食事会', start_time=local(2025, 4, 1, 12), related_record=self.record)
+        response = self.client.get(reverse('schedule:event_update', args=[event.pk]))
+        self.assertContains(response, '1200 円')
+        self.assertEqual(self.record_options(response), 2)
+
+    def test_other_users_record_is_rejected(self):
+        self.assertTrue(EventForm(self.data(self.record), user=self.user).is_valid())
+        form = EventForm(self.data(self.foreign), user=self.user)
+        self.assertFalse(form.is_valid())
+        self.assertIn('related_record', form.errors)
+        # 選ばれた1件だけを取得して検証する（記録の一覧は読み込まない）
+        with CaptureQueriesContext(connection) as queries:
+            EventForm(self.data(self.record), user=self.user).is_valid()
+        self.assertTrue(all('LIMIT' in query['sql'] for query in queries))
 
-# Create your tests here.
@@ -5,8 +5,13 @@ app_name = 'schedule'
 
 urlpatterns = [
     path('dashboard/', views.DashboardView.as_view(), name='dashboard'),
+    path('calendar/<str:scope>/', views.CalendarView.as_view(), name='calendar'),
     path('events/', views.EventListView.as_view(), name='event_list'),
+    path('events/import/', views.EventImportView.as_view(), name='event_import'),
+    path('feed/<str:token>.ics', views.CalendarFeedView.as_view(), name='calendar_feed'),
+    path('feed/regenerate/', views.CalendarFeedRegenerateView.as_view(), name='calendar_feed_regenerate'),
     path('event/<int:pk>/update/', views.EventUpdateView.as_view(), name='event_update'),
     path('event/<int:pk>/delete/', views.EventDeleteView.as_view(), name='event_delete'),
     path('event/<int:pk>/detail/', views.EventDetailView.as_view(), name='event_detail'),
+    path('event/<int:pk>/occurrence/cancel/', views.OccurrenceCancelView.as_view(), name='occurrence_cancel'),
 ]
\ No newline at end of file
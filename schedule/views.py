@@ -1,47 +1,74 @@
+from datetime import date, datetime, timedelta
 from django.shortcuts import render, get_object_or_404, redirect
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import PermissionDenied
-from django.views.generic import ListView, CreateView, UpdateView, DeleteView, View, DetailView
-from django.urls import reverse_lazy
+from django.views.generic import ListView, CreateView, UpdateView, DeleteView, View, DetailView, TemplateView, FormView
+from django.urls import reverse, reverse_lazy
 from django.utils import timezone
-from .models import Event
-from .forms import EventForm
+from django.utils.http import url_has_allowed_host_and_scheme
+from .models import CalendarFeed, Event, EventException
+from .forms import EventForm, EventImportForm
+from .ical import calendar_version, import_calendar, iter_calendar
+from .calendar import SCOPES, events_between, period
+
+def selected_day(request):
+    # ?date=YYYY-MM-DD（不正・未指定なら今日）
+    try:
+        return date.fromisoformat(request.GET.get('date', ''))
+    except ValueError:
+        return timezone.localdate()
 
 class DashboardView(LoginRequiredMixin, View):
     template_name = 'schedule/dashboard.html'
-    
-    def get(self, request):
-        today = timezone.now().date()
-        events = Event.objects.filter(
-            user=request.user,
-            start_time__year=today.year,
-            start_time__month=today.month,
-        ).order_by('start_time')
-        form = EventForm()
+
+    def render_dashboard(self, request, form):
+        today = selected_day(request)
+        first, start, end, previous, following = period('month', today)
         return render(request, self.template_name, {
             'form': form,
-            'events': events,
+            'events': events_between(request.user, start, end),
             'today': today,
+            'previous': previous,
+            'following': following,
         })
+
+    def get(self, request):
+        return self.render_dashboard(request, EventForm(user=request.user))
+
     def post(self, request):
-        today = timezone.now().date()
-        events = Event.objects.filter(
-            user=request.user,
-            start_time__year=today.year,
-            start_time__month=today.month,
-        ).order_by('start_time')
-        form = EventForm(request.POST)
+        form = EventForm(request.POST, user=request.user)
         if form.is_valid():
             event = form.save(commit=False)
             event.user = request.user
             event.save()
             return redirect('schedule:dashboard')
-        
-        return render(request, self.template_name, {
-            'form': form,
-            'events': events,
-            'today': today,
+        # 予定一覧の検索はエラーで再表示するときだけ行う
+        return self.render_dashboard(request, form)
+
+class CalendarView(LoginRequiredMixin, TemplateView):
+    # 月・週・日表示（同じ期間検索を使う）
+    template_name = 'schedule/calendar.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        scope = kwargs['scope']
+        if scope not in SCOPES:
+            raise Http404
+        first, start, end, previous, following = period(scope, selected_day(self.request))
+        context.update({
+            'scope': scope,
+            'scopes': SCOPES,
+            'first': first,
+            'last': following - timedelta(days=1),
+            'previous': previous,
+            'following': following,
+            'events': events_between(self.request.user, start, end),
         })
+        return context
 
 class EventListView(LoginRequiredMixin, ListView):
     model = Event
@@ -51,6 +78,12 @@ class EventListView(LoginRequiredMixin, ListView):
     def get_queryset(self):
         return Event.objects.filter(user=self.request.user).order_by('start_time')
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        feed, _ = CalendarFeed.objects.get_or_create(user=self.request.user)
+        context['feed_url'] = self.request.build_absolute_uri(reverse('schedule:calendar_feed', args=[feed.token]))
+        return context
+
 class EventUpdateView(LoginRequiredMixin, UpdateView):
     model = Event
     template_name = 'schedule/event_update.html'
@@ -63,6 +96,11 @@ class EventUpdateView(LoginRequiredMixin, UpdateView):
             raise PermissionDenied
         return obj
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
 class EventDeleteView(LoginRequiredMixin, DeleteView):
     model = Event
     template_name = 'schedule/event_delete.html'
@@ -82,4 +120,72 @@ class EventDetailView(LoginRequiredMixin, DetailView):
         obj = super().get_object(queryset)
         if obj.user != self.request.user:
             raise PermissionDenied
-        return obj
\ No newline at end of file
+        return obj
+
+class OccurrenceCancelView(LoginRequiredMixin, View):
+    # 繰り返しの予定の1回分だけを取り消す（予定全体は残す）
+    def post(self, request, pk):
+        event = get_object_or_404(Event, pk=pk)
+        if event.user != request.user:
+            raise PermissionDenied
+        try:
+            original_start = datetime.fromisoformat(request.POST.get('original_start', ''))
+        except ValueError:
+            raise Http404
+        if not event.rrule or original_start.tzinfo is None:
+            raise Http404
+        try:
+            rule = event.rule()
+        except ValueError:
+            raise Http404
+        if not rule.between(original_start, original_start, inc=True):
+            raise Http404
+        EventException.objects.update_or_create(
+            event=event, original_start=original_start, defaults={'cancelled': True},
+        )
+        next_url = request.POST.get('next')
+        if next_url and url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+            return redirect(next_url)
+        return redirect('schedule:dashboard')
+
+def feed_user_id(token):
+    return CalendarFeed.objects.filter(token=token).values_list('user_id', flat=True).first()
+
+def feed_etag(request, token):
+    user_id = feed_user_id(token)
+    if user_id is None:
+        return None
+    latest, count = calendar_version(user_id)
+    return f'{user_id}-{latest.timestamp() if latest else 0}-{count}'
+
+def feed_last_modified(request, token):
+    user_id = feed_user_id(token)
+    return calendar_version(user_id)[0] if user_id else None
+
+class CalendarFeedView(View):
+    # カレンダーアプリからの定期取得用（ログイン不要。変更が無ければ 304 を返す）
+    @method_decorator(condition(etag_func=feed_etag, last_modified_func=feed_last_modified))
+    def get(self, request, token):
+        feed = get_object_or_404(CalendarFeed.objects.select_related('user'), token=token)
+        response = StreamingHttpResponse(
+            iter_calendar(feed.user, request.get_host().split(':')[0]), content_type='text/calendar; charset=utf-8',
+        )
+        response['Content-Disposition'] = 'inline; filename="schedule.ics"'
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+class CalendarFeedRegenerateView(LoginRequiredMixin, View):
+    def post(self, request):
+        feed, created = CalendarFeed.objects.get_or_create(user=request.user)
+        if not created:
+            feed.regenerate()
+        return redirect('schedule:event_list')
+
+class EventImportView(LoginRequiredMixin, FormView):
+    template_name = 'schedule/event_import.html'
+    form_class = EventImportForm
+
+    def form_valid(self, form):
+        result = import_calendar(self.request.user, form.cleaned_data['file'])
+        return self.render_to_response(self.get_context_data(form=EventImportForm(), result=result))
+
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SnsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sns'
+
+    def ready(self):
+        import sns.signals
@@ -0,0 +1,50 @@
+from collections import Counter
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Attachment, Blob
+from .storage import ContentAddressedStorage
+
+# 添付ファイルの実体（Blob）の参照数管理
+# 参照数が0になった Blob は猶予期間の後に gc_blobs コマンドで削除する
+
+def is_blob_name(name):
+    return name.startswith(f'{ContentAddressedStorage.prefix}/')
+
+def acquire_blobs(files):
+    # files: [(保存名, サイズ), ...]
+    # ストレージに保存する前に呼ぶ（保存後だと gc_blobs が消したファイルを参照することがある）
+    sizes = dict(files)
+    for name, count in Counter(name for name, _ in files).items():
+        if not is_blob_name(name):
+            continue
+        if Blob.objects.filter(name=name).update(ref_count=F('ref_count') + count, updated_at=timezone.now()):
+            continue
+        try:
+            with transaction.atomic():
+                Blob.objects.create(name=name, size=sizes[name], ref_count=count)
+        except IntegrityError:
+            # 同時に作成された
+            Blob.objects.filter(name=name).update(ref_count=F('ref_count') + count, updated_at=timezone.now())
+
+def release_blob(name):
+    Blob.objects.filter(name=name, ref_count__gt=0).update(ref_count=F('ref_count') - 1, updated_at=timezone.now())
+
+def collect_garbage(grace_seconds, batch_size=500):
+    # 参照数0の Blob を1バッチ分削除し、削除件数を返す
+    threshold = timezone.now() - timedelta(seconds=grace_seconds)
+    storage = Attachment._meta.get_field('file').storage
+    names = list(
+        Blob.objects.filter(ref_count=0, updated_at__lt=threshold)
+        .order_by('updated_at').values_list('name', flat=True)[:batch_size]
+    )
+    deleted = 0
+    for name in names:
+        # 行とファイルを同じトランザクションで消す。アップロードは保存前に acquire_blobs で参照を取るので、
+        # 参照が取られた Blob は消さず、削除中の Blob への acquire_blobs は削除の確定を待ってから作り直す
+        with transaction.atomic():
+            if Blob.objects.filter(name=name, ref_count=0).delete()[0]:
+                storage.delete(name)
+                deleted += 1
+    return deleted
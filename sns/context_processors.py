@@ -1,22 +1,15 @@
-from .models import Message, Notification
+from .unread import get_unread_count
 
 # settings.pyのtemplatesに追加が必要
+# 件数はキャッシュから取得し、未読の増減はシグナルで反映する（sns/signals.py）
 def unread_message_count(request):
     if request.user.is_authenticated:
-        unread_count = Message.objects.filter(
-            recipient=request.user,
-            is_read=False,
-        ).count()
-        return {'unread_count': unread_count}
+        return {'unread_count': get_unread_count('message', request.user.pk)}
     
     return {'unread_count': 0}
 
 def unread_notification_count(request):
     if request.user.is_authenticated:
-        unread_count = Notification.objects.filter(
-            recipient=request.user,
-            is_read=False,
-        ).count()
-        return {'unread_notification_count': unread_count}
+        return {'unread_notification_count': get_unread_count('notification', request.user.pk)}
     
-    return {'unread_notification_count': 0}
\ No newline at end of file
+    return {'unread_notification_count': 0}
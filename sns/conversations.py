@@ -0,0 +1,63 @@
+from django.db import transaction
+from django.db.models import F
+from .models import Conversation, ConversationMember, Message, conversation_pair
+from .unread import reset_unread_count
+
+# メッセージのスレッド管理（送信者と宛先の組ごとに1つのスレッド）
+# Conversation.last_message と ConversationMember.unread_count / last_message_at を非正規化して持つ
+
+def add_message(message):
+    # 送信したメッセージを2人のスレッドに追加する（まだ無ければ作る）
+    with transaction.atomic():
+        conversation, _ = Conversation.objects.get_or_create(
+            pair=conversation_pair(message.sender_id, message.recipient_id),
+            defaults={'last_message': message},
+        )
+        Conversation.objects.filter(pk=conversation.pk).update(last_message=message, updated_at=message.created_at)
+        Message.objects.filter(pk=message.pk).update(conversation=conversation)
+        message.conversation = conversation
+
+        for user_id in {message.sender_id, message.recipient_id}:
+            ConversationMember.objects.get_or_create(conversation=conversation, user_id=user_id)
+        ConversationMember.objects.filter(conversation=conversation).update(last_message_at=message.created_at)
+        ConversationMember.objects.filter(conversation=conversation, user_id=message.recipient_id).update(
+            unread_count=F('unread_count') + 1,
+        )
+    return conversation
+
+def mark_message_read(message):
+    # 1件既読にしたらスレッドの未読数も1減らす
+    ConversationMember.objects.filter(
+        conversation_id=message.conversation_id, user_id=message.recipient_id, unread_count__gt=0,
+    ).update(unread_count=F('unread_count') - 1)
+
+def mark_conversation_read(conversation, user):
+    # スレッド内の自分宛ての未読を1回の UPDATE で既読にする
+    with transaction.atomic():
+        updated = Message.objects.filter(conversation=conversation, recipient=user, is_read=False).update(is_read=True)
+        ConversationMember.objects.filter(conversation=conversation, user=user).update(unread_count=0)
+    if updated:
+        reset_unread_count('message', user.pk)
+
+def inbox(user):
+    # 受信ボックス：(user, last_message_at) のインデックスだけで並べられる
+    return (
+        ConversationMember.objects.filter(user=user)
+        .select_related('conversation__last_message__sender', 'conversation__last_message__recipient')
+    )
+
+def build_conversations(batch_size=1000):
+    # スレッド未設定の既存メッセージを、送信者と宛先の組ごとのスレッドへ入れる
+    # 読みながら同じテーブルを更新しないよう、先に対象の ID を集めてから処理する
+    before = Conversation.objects.count()
+    pks = list(
+        Message.objects.filter(conversation__isnull=True).order_by('created_at', 'pk').values_list('pk', flat=True)
+    )
+    for start in range(0, len(pks), batch_size):
+        messages = Message.objects.filter(pk__in=pks[start:start + batch_size]).order_by('created_at', 'pk')
+        for message in list(messages):
+            add_message(message)
+            # 既読済みのメッセージは未読数に数えない
+            if message.is_read:
+                mark_message_read(message)
+    return Conversation.objects.count() - before
@@ -0,0 +1,86 @@
+import mimetypes
+import os
+import re
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+# 添付ファイルのダウンロード
+# ATTACHMENT_SENDFILE_BACKEND が設定されていれば Web サーバーに送信を任せ、
+# なければ Range リクエスト対応のストリーミングで返す
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+def parse_range(header, size):
+    # 単一の Range のみ対応。不正な指定は None（全体を返す）
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-500 は末尾500バイト
+        start = max(size - int(last), 0)
+        end = size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError('Range Not Satisfiable')
+    return start, end
+
+def iter_range(file, start, length):
+    file.seek(start)
+    remaining = length
+    try:
+        while remaining > 0:
+            data = file.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        file.close()
+
+def offload_response(field_file, filename):
+    backend = settings.ATTACHMENT_SENDFILE_BACKEND
+    response = HttpResponse()
+    if backend == 'nginx':
+        response['X-Accel-Redirect'] = settings.ATTACHMENT_SENDFILE_PREFIX + field_file.name
+    else:
+        response['X-Sendfile'] = field_file.path
+    # Content-Type は Web サーバー側で決めさせる
+    del response['Content-Type']
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
+
+def attachment_response(request, field_file, filename=None):
+    filename = filename or os.path.basename(field_file.name)
+    if settings.ATTACHMENT_SENDFILE_BACKEND:
+        return offload_response(field_file, filename)
+
+    size = field_file.size
+    header = request.headers.get('Range')
+    try:
+        byte_range = parse_range(header, size) if header else None
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range is None:
+        response = FileResponse(field_file.open('rb'), as_attachment=True, filename=filename)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = StreamingHttpResponse(
+            iter_range(field_file.open('rb'), start, length), status=206, content_type=content_type,
+        )
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Accept-Ranges'] = 'bytes'
+    return response
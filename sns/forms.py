@@ -1,6 +1,9 @@
 from django import forms
+from django.conf import settings
+from django.urls import reverse_lazy
 from .models import Post, Message, Comment
 from django.contrib.auth.models import User
+from .widgets import LookupSelect
 
 class PostCreateForm(forms.ModelForm):
     class Meta:
@@ -13,7 +16,11 @@ class PostCreateForm(forms.ModelForm):
         }
 
 class MessageForm(forms.ModelForm):
-    recipient = forms.ModelChoiceField(queryset=User.objects.all(), label='宛先')
+    # 宛先の候補は sns:recipient_lookup から検索する（検証は選ばれた1件の取得だけ）
+    recipient = forms.ModelChoiceField(
+        queryset=User.objects.filter(is_active=True), label='宛先',
+        widget=LookupSelect(reverse_lazy('sns:recipient_lookup'), attrs={'class': 'form-control'}),
+    )
     # 単発ファイルフィールド（複数はJSで追加）
     files = forms.FileField(
         required=False,
@@ -23,11 +30,24 @@ class MessageForm(forms.ModelForm):
         model = Message
         fields = ['recipient', 'subject', 'body']
         widgets= {
-            'recipient': forms.Select(attrs={'class': 'form-control'}),
             'subject': forms.TextInput(attrs={'class': 'form-control'}),
             'body': forms.Textarea(attrs={'class': 'form-control', 'rows': 5}),
         }
 
+    def __init__(self, *args, rejected_files=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        # サイズ上限を超えてアップロードハンドラで受け取らなかったファイル
+        self.rejected_files = rejected_files
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.rejected_files:
+            limit = settings.ATTACHMENT_MAX_SIZE // (1024 * 1024)
+            raise forms.ValidationError(
+                f'{", ".join(self.rejected_files)} は {limit}MB を超えているため添付できません。'
+            )
+        return cleaned_data
+
 class CommentForm(forms.ModelForm):
     class Meta:
         model = Comment
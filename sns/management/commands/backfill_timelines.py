@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from sns.models import Post
+from sns.timeline import following_ids, follow_author, is_large_account, trim_timeline, insert_entries
+
+class Command(BaseCommand):
+    help = 'フォロー関係から既存投稿のホームタイムラインを作成します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='指定したユーザーのタイムラインだけを作成')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['username']:
+            users = users.filter(username=options['username'])
+
+        # 大規模アカウントの投稿は読み込み時取得に切り替える
+        author_ids = Post.objects.order_by().values_list('author_id', flat=True).distinct()
+        for author_id in author_ids:
+            Post.objects.filter(author_id=author_id).update(fanned_out=not is_large_account(author_id))
+
+        total = 0
+        for user in users.iterator(chunk_size=500):
+            own_posts = Post.objects.filter(author=user).order_by('-created_at', '-id')
+            insert_entries([user.pk], list(own_posts[:settings.TIMELINE_MAX_LENGTH]))
+            for author_id in list(following_ids(user.pk)):
+                follow_author(user.pk, author_id)
+            trim_timeline(user.pk)
+            total += 1
+        self.stdout.write(self.style.SUCCESS(f'{total} 人分のタイムラインを作成しました'))
@@ -0,0 +1,36 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from sns.timeline import home_timeline, naive_home_timeline
+
+class Command(BaseCommand):
+    help = 'ホームタイムラインの読み込み時間を JOIN による組み立てと比較します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--per-page', type=int, default=20)
+
+    def measure(self, func, repeat):
+        func()  # ウォームアップ
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                func()
+            elapsed = time.perf_counter() - started
+        return elapsed / repeat * 1000, len(ctx.captured_queries) // repeat
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"ユーザー {options['username']} が存在しません")
+        per_page = options['per_page']
+        results = {
+            'timeline': self.measure(lambda: home_timeline(user, None, per_page), options['repeat']),
+            'naive join': self.measure(lambda: naive_home_timeline(user, per_page), options['repeat']),
+        }
+        for name, (ms, queries) in results.items():
+            self.stdout.write(f'{name:>12}: {ms:8.2f} ms/回  {queries} クエリ/回')
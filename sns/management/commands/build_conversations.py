@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from sns.conversations import build_conversations
+
+class Command(BaseCommand):
+    help = 'スレッド未設定の既存メッセージからスレッドを作成します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = build_conversations(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{count} 件のスレッドを作成しました'))
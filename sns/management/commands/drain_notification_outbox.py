@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from sns.notifications import drain_outbox
+
+class Command(BaseCommand):
+    help = 'アウトボックスに積まれた通知をまとめて書き込みます'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help='終了せずに監視し続ける')
+        parser.add_argument('--interval', type=float, default=1.0, help='空のときの待機秒数')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            count = drain_outbox(options['batch_size'])
+            total += count
+            if count:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'{total} 件の通知を書き込みました'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from sns.blobs import collect_garbage
+
+class Command(BaseCommand):
+    help = '参照されなくなった添付ファイルの実体を少しずつ削除します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--max-batches', type=int, default=10, help='1回の実行で処理するバッチ数の上限')
+        parser.add_argument('--grace-seconds', type=int, default=60 * 60, help='参照数が0になってから削除するまでの猶予')
+
+    def handle(self, *args, **options):
+        total = 0
+        for _ in range(options['max_batches']):
+            deleted = collect_garbage(options['grace_seconds'], options['batch_size'])
+            total += deleted
+            if deleted < options['batch_size']:
+                break
+        self.stdout.write(self.style.SUCCESS(f'{total} 件のファイルを削除しました'))
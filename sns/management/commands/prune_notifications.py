@@ -0,0 +1,42 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from sns.models import Notification, NotificationArchive
+
+class Command(BaseCommand):
+    help = '指定日数より古い既読通知をアーカイブへ移動します（バッチ処理）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--no-archive', action='store_true', help='アーカイブせずに削除だけ行う')
+
+    def handle(self, *args, **options):
+        threshold = timezone.now() - timedelta(days=options['days'])
+        old_notifications = Notification.objects.filter(is_read=True, updated_at__lt=threshold).order_by('pk')
+        total = 0
+        while True:
+            with transaction.atomic():
+                batch = list(old_notifications[:options['batch_size']])
+                if not batch:
+                    break
+                if not options['no_archive']:
+                    NotificationArchive.objects.bulk_create([
+                        NotificationArchive(
+                            original_id=n.pk,
+                            sender_id=n.sender_id,
+                            recipient_id=n.recipient_id,
+                            post_id=n.post_id,
+                            comment_id=n.comment_id,
+                            notification_type=n.notification_type,
+                            actor_count=n.actor_count,
+                            created_at=n.created_at,
+                            updated_at=n.updated_at,
+                        )
+                        for n in batch
+                    ])
+                # 既読なので未読バッジのカウンタには影響しない
+                Notification.objects.filter(pk__in=[n.pk for n in batch]).delete()
+            total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'{total} 件の通知を整理しました'))
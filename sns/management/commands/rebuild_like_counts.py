@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from sns.models import Post, Comment
+
+class Command(BaseCommand):
+    help = '投稿・コメントのいいね数カウンタを中間テーブルから再計算します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for model in (Post, Comment):
+            model.rebuild_like_counts(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'{model._meta.verbose_name} のいいね数を再計算しました'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from sns.search import SOURCES, reindex
+
+class Command(BaseCommand):
+    help = '全文検索の索引をバッチ処理で作り直します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=list(SOURCES), help='指定した種類だけ作り直す')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        kinds = [options['kind']] if options['kind'] else list(SOURCES)
+        for kind in kinds:
+            count = reindex(kind, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'{kind}: {count} 件を索引に登録しました'))
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:37
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_likes_count(apps, schema_editor):
+    for model_name in ('post', 'comment'):
+        model = apps.get_model('sns', model_name)
+        through = model.likes.through
+        counts = (
+            through.objects.filter(**{model_name: OuterRef('pk')})
+            .order_by().values(model_name).annotate(total=Count('pk')).values('total')
+        )
+        model.objects.update(likes_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sns', '0015_post_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_likes_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:43
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_actors(apps, schema_editor):
+    Notification = apps.get_model('sns', 'Notification')
+    Notification.objects.update(updated_at=F('created_at'))
+    for notification in Notification.objects.select_related('sender').iterator(chunk_size=1000):
+        notification.recent_actors = [{'id': notification.sender_id, 'username': notification.sender.username}]
+        notification.save(update_fields=['recent_actors'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sns', '0020_notification_outbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='actor_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='recent_actors',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['recipient', 'notification_type', 'post', 'comment'], name='sns_notification_group_idx'),
+        ),
+        migrations.RunPython(fill_actors, migrations.RunPython.noop),
+    ]
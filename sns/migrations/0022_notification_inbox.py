@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sns', '0021_notification_coalescing'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.BigIntegerField()),
+                ('sender_id', models.BigIntegerField()),
+                ('recipient_id', models.BigIntegerField(db_index=True)),
+                ('post_id', models.BigIntegerField(blank=True, null=True)),
+                ('comment_id', models.BigIntegerField(blank=True, null=True)),
+                ('notification_type', models.CharField(max_length=20)),
+                ('actor_count', models.PositiveIntegerField(default=1)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', '-updated_at', '-id'], name='sns_notification_inbox_idx'),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:51
+
+from django.db import migrations, models
+
+SQLITE_FORWARD = [
+    # 外部コンテンツ型の FTS5 テーブル。sns_searchdocument の変更はトリガーで反映する
+    """CREATE VIRTUAL TABLE sns_searchdocument_fts USING fts5(
+        title_tokens, body_tokens,
+        content='sns_searchdocument', content_rowid='id', tokenize='unicode61'
+    )""",
+    """CREATE TRIGGER sns_searchdocument_ai AFTER INSERT ON sns_searchdocument BEGIN
+        INSERT INTO sns_searchdocument_fts(rowid, title_tokens, body_tokens)
+        VALUES (new.id, new.title_tokens, new.body_tokens);
+    END""",
+    """CREATE TRIGGER sns_searchdocument_ad AFTER DELETE ON sns_searchdocument BEGIN
+        INSERT INTO sns_searchdocument_fts(sns_searchdocument_fts, rowid, title_tokens, body_tokens)
+        VALUES ('delete', old.id, old.title_tokens, old.body_tokens);
+    END""",
+    """CREATE TRIGGER sns_searchdocument_au AFTER UPDATE ON sns_searchdocument BEGIN
+        INSERT INTO sns_searchdocument_fts(sns_searchdocument_fts, rowid, title_tokens, body_tokens)
+        VALUES ('delete', old.id, old.title_tokens, old.body_tokens);
+        INSERT INTO sns_searchdocument_fts(rowid, title_tokens, body_tokens)
+        VALUES (new.id, new.title_tokens, new.body_tokens);
+    END""",
+]
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS sns_searchdocument_au',
+    'DROP TRIGGER IF EXISTS sns_searchdocument_ad',
+    'DROP TRIGGER IF EXISTS sns_searchdocument_ai',
+    'DROP TABLE IF EXISTS sns_searchdocument_fts',
+]
+POSTGRES_FORWARD = [
+    """ALTER TABLE sns_searchdocument ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', title_tokens), 'A') ||
+        setweight(to_tsvector('simple', body_tokens), 'B')
+    ) STORED""",
+    'CREATE INDEX sns_searchdocument_vector_idx ON sns_searchdocument USING GIN (search_vector)',
+]
+POSTGRES_BACKWARD = [
+    'DROP INDEX IF EXISTS sns_searchdocument_vector_idx',
+    'ALTER TABLE sns_searchdocument DROP COLUMN IF EXISTS search_vector',
+]
+
+
+def run_vendor_sql(sqlite, postgres):
+    def run(apps, schema_editor):
+        statements = {'sqlite': sqlite, 'postgresql': postgres}.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sns', '0024_content_addressed_attachments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post', '投稿'), ('comment', 'コメント'), ('profile', 'プロフィール')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('title_tokens', models.TextField(blank=True)),
+                ('body_tokens', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='sns_searchdocument_unique')],
+            },
+        ),
+        migrations.RunPython(
+            run_vendor_sql(SQLITE_FORWARD, POSTGRES_FORWARD),
+            run_vendor_sql(SQLITE_BACKWARD, POSTGRES_BACKWARD),
+        ),
+    ]
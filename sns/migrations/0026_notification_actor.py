@@ -0,0 +1,47 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:32
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_actors(apps, schema_editor):
+    # 既存の通知は分かる範囲（直近の送信者と sender）で送信者を記録する
+    Notification = apps.get_model('sns', 'Notification')
+    NotificationActor = apps.get_model('sns', 'NotificationActor')
+    batch = []
+    for notification in Notification.objects.only('pk', 'sender_id', 'recent_actors').iterator(chunk_size=1000):
+        user_ids = {actor['id'] for actor in notification.recent_actors or []} | {notification.sender_id}
+        batch += [NotificationActor(notification_id=notification.pk, user_id=user_id) for user_id in user_ids]
+        if len(batch) >= 1000:
+            NotificationActor.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    NotificationActor.objects.bulk_create(batch, ignore_conflicts=True)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sns', '0025_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.CreateModel(
+            name='NotificationActor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actors', to='sns.notification')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('notification', 'user'), name='sns_notification_actor_unique')],
+            },
+        ),
+        migrations.RunPython(fill_actors, migrations.RunPython.noop),
+    ]
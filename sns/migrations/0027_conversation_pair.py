@@ -0,0 +1,54 @@
+from django.db import migrations, models
+
+
+def merge_pairs(apps, schema_editor):
+    # 送信者と宛先の組ごとに1つのスレッドへまとめ、pair を埋める
+    Conversation = apps.get_model('sns', 'Conversation')
+    ConversationMember = apps.get_model('sns', 'ConversationMember')
+    Message = apps.get_model('sns', 'Message')
+    kept = {}
+    for pk in list(Conversation.objects.order_by('pk').values_list('pk', flat=True)):
+        message = Message.objects.filter(conversation_id=pk).order_by('-created_at', '-pk').first()
+        if message is None:
+            Conversation.objects.filter(pk=pk).delete()
+            continue
+        pair = '-'.join(str(user_id) for user_id in sorted((message.sender_id, message.recipient_id)))
+        target = kept.get(pair)
+        if target is None:
+            kept[pair] = pk
+            Conversation.objects.filter(pk=pk).update(pair=pair)
+            continue
+        Message.objects.filter(conversation_id=pk).update(conversation_id=target)
+        for member in list(ConversationMember.objects.filter(conversation_id=pk)):
+            merged, created = ConversationMember.objects.get_or_create(
+                conversation_id=target, user_id=member.user_id,
+                defaults={'unread_count': member.unread_count, 'last_message_at': member.last_message_at},
+            )
+            if not created:
+                merged.unread_count += member.unread_count
+                merged.last_message_at = max(merged.last_message_at, member.last_message_at)
+                merged.save(update_fields=['unread_count', 'last_message_at'])
+        Conversation.objects.filter(pk=pk).delete()
+        latest = Message.objects.filter(conversation_id=target).order_by('-created_at', '-pk').first()
+        Conversation.objects.filter(pk=target).update(last_message=latest, updated_at=latest.created_at)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sns', '0026_notification_actor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='pair',
+            field=models.CharField(max_length=50, null=True),
+        ),
+        migrations.RunPython(merge_pairs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='conversation',
+            name='pair',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+    ]
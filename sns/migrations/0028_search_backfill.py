@@ -0,0 +1,57 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+# 索引を作った時点の sns.search の 2-gram 分割（後で sns.search を変えてもこの移行の結果は変えない）
+CJK = '\u3005\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff66-\uff9f'
+TOKEN_RE = re.compile(rf'[{CJK}]+|[^\W_{CJK}]+')
+CJK_RE = re.compile(rf'^[{CJK}]+$')
+
+
+def ngram_tokens(text):
+    tokens = []
+    for run in TOKEN_RE.findall(unicodedata.normalize('NFKC', text or '').lower()):
+        if CJK_RE.match(run):
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.append(run[-1])
+        else:
+            tokens.append(run)
+    return ' '.join(tokens)
+
+
+def fill_documents(apps, schema_editor):
+    # 0025 より前からある投稿・コメント・プロフィールを索引に登録する
+    # （索引済みのものはそのまま残す）
+    SearchDocument = apps.get_model('sns', 'SearchDocument')
+    sources = {
+        'post': (apps.get_model('sns', 'Post').objects.all(), lambda obj: (obj.title, obj.content)),
+        'comment': (apps.get_model('sns', 'Comment').objects.all(), lambda obj: ('', obj.body)),
+        'profile': (
+            apps.get_model('accounts', 'Profile').objects.select_related('user'),
+            lambda obj: (obj.user.username, obj.bio),
+        ),
+    }
+    for kind, (queryset, fields) in sources.items():
+        batch = []
+        for obj in queryset.order_by('pk').iterator(chunk_size=1000):
+            title, body = fields(obj)
+            batch.append(SearchDocument(
+                kind=kind, object_id=obj.pk,
+                title_tokens=ngram_tokens(title), body_tokens=ngram_tokens(body),
+            ))
+            if len(batch) >= 1000:
+                SearchDocument.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        SearchDocument.objects.bulk_create(batch, ignore_conflicts=True)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sns', '0027_conversation_pair'),
+        ('accounts', '0003_profile_followers_delete_follow'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_documents, migrations.RunPython.noop),
+    ]
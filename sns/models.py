@@ -1,22 +1,142 @@
+import os
 from urllib.request import build_opener
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q, OuterRef, Subquery, Count
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .storage import ContentAddressedStorage
 from django.contrib.auth.models import User
 
-class Post(models.Model):
+class LikeCounterMixin:
+    # likes(M2M) と likes_count(非正規化カウンタ) を同時に更新する
+    def like_count(self):
+        return self.likes_count
+
+    def is_liked_by(self, user):
+        # 中間テーブルの1行だけを確認（全件ロードしない）
+        return self.likes.filter(pk=user.pk).exists()
+
+    def _like_rows(self, user):
+        through = self.likes.through
+        return through.objects.filter(**{f'{self._meta.model_name}_id': self.pk, 'user_id': user.pk})
+
+    def toggle_like(self, user):
+        # いいね済みなら取り消し、未いいねなら追加。
+        # 追加した場合 True、取り消した場合 False、同時リクエストで既に追加済みだった場合 None を返す
+        model = type(self)
+        with transaction.atomic():
+            deleted, _ = self._like_rows(user).delete()
+            if deleted:
+                model.objects.filter(pk=self.pk).update(likes_count=F('likes_count') - 1)
+                self.likes_count -= 1
+                return False
+            try:
+                with transaction.atomic():
+                    self.likes.through.objects.create(**{f'{self._meta.model_name}_id': self.pk, 'user_id': user.pk})
+            except IntegrityError:
+                # 同時リクエストで既に追加済み（通知はそちらで送られる）
+                return None
+            model.objects.filter(pk=self.pk).update(likes_count=F('likes_count') + 1)
+            self.likes_count += 1
+            return True
+
+    @classmethod
+    def rebuild_like_counts(cls, batch_size=1000):
+        # 中間テーブルから件数を数え直す（主キー順にバッチ処理）
+        fk = cls._meta.model_name
+        counts = (
+            cls.likes.through.objects.filter(**{fk: OuterRef('pk')})
+            .order_by().values(fk).annotate(total=Count('pk')).values('total')
+        )
+        last_pk = 0
+        while True:
+            pks = list(cls.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            cls.objects.filter(pk__in=pks).update(likes_count=Coalesce(Subquery(counts), 0))
+            last_pk = pks[-1]
+
+class Post(LikeCounterMixin, models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='作成者')
     title = models.CharField(max_length=100, verbose_name='タイトル')
     content = models.TextField(verbose_name='本文')
     image = models.ImageField(upload_to='post_images/', blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     likes = models.ManyToManyField(User, related_name='likes_posts', blank=True)
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    # False の投稿はフォロワーのタイムラインに配信せず、読み込み時に取得する（大規模アカウント用）
+    fanned_out = models.BooleanField(default=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # 投稿一覧のカーソルページネーション用
+            models.Index(fields=['-created_at', '-id'], name='sns_post_created_id_idx'),
+            models.Index(
+                fields=['author', '-created_at', '-id'],
+                condition=Q(fanned_out=False),
+                name='sns_post_pull_idx',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.author.username} の {self.title} 投稿'
-
-    def like_count(self):
-        return self.likes.count()
     
+class TimelineEntry(models.Model):
+    # フォロー中ユーザーの投稿を配信済みのホームタイムライン
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    # 並び替え用に投稿日時をコピーして持つ
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='sns_timeline_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='sns_timeline_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} ← {self.post_id}'
+
+def conversation_pair(user_id, other_id):
+    # 2人の組を表すキー（順序によらず同じ値）
+    return '-'.join(str(pk) for pk in sorted((user_id, other_id)))
+
+class Conversation(models.Model):
+    # メッセージのスレッド（送信者と宛先の組ごとに1つ。返信も新規メッセージも同じスレッドに入る）
+    pair = models.CharField(max_length=50, unique=True)
+    last_message = models.ForeignKey(
+        'Message', on_delete=models.SET_NULL, blank=True, null=True, related_name='+',
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'スレッド {self.pk}'
+
+class ConversationMember(models.Model):
+    # 参加者ごとの未読数と最終メッセージ日時（受信ボックスはこのテーブルだけを読む）
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='members')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_memberships')
+    unread_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'user'], name='sns_conversation_member_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-last_message_at', '-id'], name='sns_conversation_inbox_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} ({self.conversation})'
+
 class Message(models.Model):
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.SET_NULL, blank=True, null=True, related_name='messages',
+    )
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages')
     subject = models.CharField(max_length=100, verbose_name='件名')
@@ -26,29 +146,62 @@ class Message(models.Model):
     is_delete = models.BooleanField(default=False)
     is_update = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', 'is_read'], name='sns_message_unread_idx'),
+            models.Index(fields=['sender', '-created_at', '-id'], name='sns_message_outbox_idx'),
+            models.Index(fields=['conversation', 'created_at', 'id'], name='sns_message_thread_idx'),
+        ]
+
     def __str__(self):
         return f"{self.subject} ({self.sender} → {self.recipient})"
 
 class Attachment(models.Model):
     message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='attachments')
-    file = models.FileField(upload_to='message_files')
+    file = models.FileField(upload_to='message_files', storage=ContentAddressedStorage())
+    # 保存名はハッシュになるため、アップロード時のファイル名を別に持つ
+    original_name = models.CharField(max_length=255, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return self.file.name
+        return self.display_name()
+
+    def display_name(self):
+        return self.original_name or os.path.basename(self.file.name)
+
+class Blob(models.Model):
+    # ContentAddressedStorage に保存された実ファイルと参照数
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # gc_blobs 用（参照されなくなった実ファイル）
+            models.Index(fields=['updated_at'], condition=Q(ref_count=0), name='sns_blob_garbage_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.ref_count})'
     
-class Comment(models.Model):
+class Comment(LikeCounterMixin, models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     body = models.TextField(verbose_name='コメント')
     created_at = models.DateTimeField(auto_now_add=True)
     likes = models.ManyToManyField(User, related_name='liked_comments', blank=True)
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # 投稿詳細のコメントスレッド用
+            models.Index(fields=['post', 'created_at', 'id'], name='sns_comment_thread_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.username}: {self.body[:20]}'
-    
-    def like_count(self):
-        return self.likes.count()
 
 class Notification(models.Model):
     NOTIFICATION_TYPE = (
@@ -61,9 +214,96 @@ class Notification(models.Model):
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_notifications')
     post = models.ForeignKey(Post, on_delete=models.CASCADE, blank=True, null=True)
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE, blank=True, null=True)
+    # 同じ対象への同じ種類の通知はまとめる（sender は最後の送信者）
+    COALESCE_TYPES = ('like_post', 'like_comment', 'follow')
+    RECENT_ACTORS = 5
     notification_type = models.CharField(max_length=20, choices=NOTIFICATION_TYPE)
+    actor_count = models.PositiveIntegerField(default=1)
+    # 直近の送信者 [{'id': ..., 'username': ...}, ...]（新しい順）
+    recent_actors = models.JSONField(default=list, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # 最後に送信者が追加された日時（既読にしても変わらないよう auto_now にしない）
+    updated_at = models.DateTimeField(default=timezone.now)
     is_read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', 'is_read'], name='sns_notification_unread_idx'),
+            # 通知一覧のカーソルページネーション用
+            models.Index(fields=['recipient', '-updated_at', '-id'], name='sns_notification_inbox_idx'),
+            models.Index(
+                fields=['recipient', 'notification_type', 'post', 'comment'],
+                condition=Q(is_read=False),
+                name='sns_notification_group_idx',
+            ),
+        ]
+
     def __str__(self):
         return f'{self.sender} → {self.recipient} ({self.notification_type})'
+
+    def other_actor_count(self):
+        return self.actor_count - 1
+
+    def add_actor(self, user_id, username, is_new):
+        # is_new: 初めての送信者か（NotificationActor で判定する。いいね→取り消し→いいね の重複対策）
+        if is_new:
+            self.actor_count += 1
+        others = [actor for actor in self.recent_actors if actor['id'] != user_id]
+        self.recent_actors = ([{'id': user_id, 'username': username}] + others)[:self.RECENT_ACTORS]
+        self.sender_id = user_id
+
+class NotificationActor(models.Model):
+    # まとめた通知の送信者（actor_count の重複判定用。recent_actors は直近の表示用）
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='actors')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['notification', 'user'], name='sns_notification_actor_unique'),
+        ]
+
+class NotificationArchive(models.Model):
+    # 保存期間を過ぎた既読通知の退避先（prune_notifications コマンド）
+    original_id = models.BigIntegerField()
+    sender_id = models.BigIntegerField()
+    recipient_id = models.BigIntegerField(db_index=True)
+    post_id = models.BigIntegerField(blank=True, null=True)
+    comment_id = models.BigIntegerField(blank=True, null=True)
+    notification_type = models.CharField(max_length=20)
+    actor_count = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.sender_id} → {self.recipient_id} ({self.notification_type})'
+
+class NotificationOutbox(models.Model):
+    # 書き込み待ちの通知（OutboxDispatcher 用）
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.payload.get("notification_type")} → {self.payload.get("recipient_id")}'
+
+class SearchDocument(models.Model):
+    # 全文検索用の文書（投稿・コメント・プロフィール）。検索は sns.search を使う
+    KIND_CHOICES = (
+        ('post', '投稿'),
+        ('comment', 'コメント'),
+        ('profile', 'プロフィール'),
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    # n-gram に分割済みのテキスト（空白区切り）
+    title_tokens = models.TextField(blank=True)
+    body_tokens = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='sns_searchdocument_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind}:{self.object_id}'
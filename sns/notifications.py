@@ -0,0 +1,234 @@
+import atexit
+import logging
+import queue
+import threading
+from collections import Counter
+from datetime import timedelta
+from functools import cache
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Comment, Notification, NotificationActor, NotificationOutbox, Post
+from .unread import adjust_unread_count
+
+# 通知の作成はリクエスト内で行わず、ディスパッチャに登録してまとめて書き込む
+# settings.NOTIFICATION_DISPATCHER で実装を切り替える
+# いいね・フォローは NOTIFICATION_COALESCE_WINDOW 秒以内の同じ対象の未読通知に集約する
+# ディスパッチャは handler を差し替えて他の非同期処理（タイムラインの配信など）にも使う
+
+logger = logging.getLogger(__name__)
+
+def _drop_orphans(payloads):
+    # キュー待ちの間に削除された投稿・コメントへの通知は捨てる
+    post_ids = {p['post_id'] for p in payloads if p['post_id']}
+    comment_ids = {p['comment_id'] for p in payloads if p['comment_id']}
+    if post_ids:
+        post_ids = set(Post.objects.filter(pk__in=post_ids).values_list('pk', flat=True))
+    if comment_ids:
+        comment_ids = set(Comment.objects.filter(pk__in=comment_ids).values_list('pk', flat=True))
+    return [
+        p for p in payloads
+        if (not p['post_id'] or p['post_id'] in post_ids)
+        and (not p['comment_id'] or p['comment_id'] in comment_ids)
+    ]
+
+def _group_key(payload):
+    return (payload['recipient_id'], payload['notification_type'], payload['post_id'], payload['comment_id'])
+
+def _merge_group(key, sender_ids, usernames):
+    # 集約期間内の未読の通知があればそこに送信者を追加し、なければ新しい通知を返す
+    recipient_id, notification_type, post_id, comment_id = key
+    now = timezone.now()
+    since = now - timedelta(seconds=settings.NOTIFICATION_COALESCE_WINDOW)
+    with transaction.atomic():
+        notification = (
+            Notification.objects.select_for_update()
+            .filter(
+                recipient_id=recipient_id, notification_type=notification_type,
+                post_id=post_id, comment_id=comment_id,
+                is_read=False, updated_at__gte=since,
+            )
+            .order_by('-updated_at').first()
+        )
+        created = notification is None
+        if created:
+            notification = Notification(
+                recipient_id=recipient_id, notification_type=notification_type,
+                post_id=post_id, comment_id=comment_id, actor_count=0, updated_at=now,
+            )
+            seen = set()
+            for sender_id in sender_ids:
+                notification.add_actor(sender_id, usernames.get(sender_id, ''), sender_id not in seen)
+                seen.add(sender_id)
+            return notification
+        for sender_id in sender_ids:
+            _, is_new = NotificationActor.objects.get_or_create(notification=notification, user_id=sender_id)
+            notification.add_actor(sender_id, usernames.get(sender_id, ''), is_new)
+        notification.updated_at = now
+        notification.save(update_fields=['sender', 'actor_count', 'recent_actors', 'updated_at'])
+    return None
+
+def write_notifications(payloads):
+    # いいね・フォローは対象ごとにまとめ、残りと新規分をまとめて INSERT する
+    payloads = _drop_orphans(payloads)
+    usernames = dict(
+        User.objects.filter(pk__in={p['sender_id'] for p in payloads}).values_list('pk', 'username')
+    )
+    new_notifications = []
+    groups = {}
+    for payload in payloads:
+        if payload['notification_type'] in Notification.COALESCE_TYPES:
+            groups.setdefault(_group_key(payload), []).append(payload['sender_id'])
+        else:
+            notification = Notification(**payload, recent_actors=[
+                {'id': payload['sender_id'], 'username': usernames.get(payload['sender_id'], '')},
+            ])
+            new_notifications.append(notification)
+    merged = {}
+    for key, sender_ids in groups.items():
+        notification = _merge_group(key, sender_ids, usernames)
+        if notification:
+            new_notifications.append(notification)
+            merged[id(notification)] = set(sender_ids)
+
+    Notification.objects.bulk_create(new_notifications)
+    # 新しくまとめ始めた通知の送信者を記録する
+    NotificationActor.objects.bulk_create([
+        NotificationActor(notification=notification, user_id=sender_id)
+        for notification in new_notifications for sender_id in merged.get(id(notification), ())
+    ], ignore_conflicts=True)
+    # 未読バッジのカウンタを宛先ごとに加算する（既存の通知へ集約した分は増えない）
+    for recipient_id, count in Counter(n.recipient_id for n in new_notifications).items():
+        adjust_unread_count('notification', recipient_id, count)
+
+DEFAULT_HANDLER = 'sns.notifications.write_notifications'
+
+class BaseDispatcher:
+    # True なら呼び出し元のトランザクション内で enqueue する
+    transactional = False
+
+    def __init__(self, handler=DEFAULT_HANDLER, **options):
+        # handler はペイロードのリストを受け取って処理する関数
+        self.handler_path = handler
+        self.handler = import_string(handler)
+
+    def enqueue(self, payload):
+        raise NotImplementedError
+
+class SyncDispatcher(BaseDispatcher):
+    # その場で書き込む（テストやデバッグ用）
+    def enqueue(self, payload):
+        self.handler([payload])
+
+class ThreadDispatcher(BaseDispatcher):
+    # プロセス内のキューとワーカースレッドでまとめて書き込む
+    # プロセスが強制終了されるとキュー内の通知は失われる（確実に届けたい場合は OutboxDispatcher）
+    # 集約は select_for_update で同じ対象の同時書き込みを防ぐが、SQLite では効かないので
+    # SQLite では workers=1 のままにする（同じ対象の通知が別々の集約行になる）
+    def __init__(self, workers=1, batch_size=100, wait=0.2, **options):
+        super().__init__(**options)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.wait = wait
+        self.queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def enqueue(self, payload):
+        self._start()
+        self.queue.put(payload)
+
+    def _start(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'dispatcher-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _next_batch(self, block=True):
+        batch = [self.queue.get(block=block)]
+        # 少し待って後続の通知も同じ INSERT にまとめる
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get(timeout=self.wait))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        close_old_connections()
+        try:
+            self.handler(batch)
+        except Exception:
+            logger.exception('%s の処理に失敗しました（%d 件）', self.handler_path, len(batch))
+        finally:
+            close_old_connections()
+
+    def _run(self):
+        while True:
+            self._write(self._next_batch())
+
+    def flush(self):
+        # プロセス終了時にキューに残っている通知を書き込む
+        while True:
+            try:
+                batch = self._next_batch(block=False)
+            except queue.Empty:
+                return
+            self._write(batch)
+
+class OutboxDispatcher(BaseDispatcher):
+    # DB のアウトボックスに積み、drain_notification_outbox コマンドで書き込む
+    # 元の操作と同じトランザクションで積むので取りこぼさない
+    transactional = True
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        if self.handler_path != DEFAULT_HANDLER:
+            raise ImproperlyConfigured('OutboxDispatcher は通知の書き込みにだけ使えます')
+
+    def enqueue(self, payload):
+        NotificationOutbox.objects.create(payload=payload)
+
+def drain_outbox(batch_size=500):
+    # 処理した件数を返す
+    with transaction.atomic():
+        rows = list(
+            NotificationOutbox.objects.select_for_update(skip_locked=True)
+            .order_by('pk')[:batch_size]
+        )
+        if not rows:
+            return 0
+        write_notifications([row.payload for row in rows])
+        NotificationOutbox.objects.filter(pk__in=[row.pk for row in rows]).delete()
+    return len(rows)
+
+def make_dispatcher(path, options):
+    return import_string(path)(**options)
+
+@cache
+def get_dispatcher():
+    return make_dispatcher(settings.NOTIFICATION_DISPATCHER, settings.NOTIFICATION_DISPATCHER_OPTIONS)
+
+def notify(sender, recipient, notification_type, post=None, comment=None):
+    payload = {
+        'sender_id': sender.pk,
+        'recipient_id': recipient.pk,
+        'post_id': post.pk if post else None,
+        'comment_id': comment.pk if comment else None,
+        'notification_type': notification_type,
+    }
+    dispatcher = get_dispatcher()
+    if dispatcher.transactional:
+        dispatcher.enqueue(payload)
+    else:
+        # トランザクション確定後に登録する（ロールバックされた操作の通知を出さない）
+        transaction.on_commit(lambda: dispatcher.enqueue(payload))
@@ -0,0 +1,50 @@
+import base64
+from datetime import datetime
+from django.db.models import Q
+
+# (created_at, id) の順で並べたクエリセットをカーソルで区切るページネーション
+# OFFSET を使わないので、何ページ目でもインデックスを辿るだけで済む
+
+def encode_cursor(created_at, pk):
+    raw = f'{created_at.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    # 不正なカーソルは先頭ページ扱いにする
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeError):
+        return None
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+def paginate_keyset(queryset, cursor, per_page, field='created_at', descending=True):
+    if descending:
+        queryset = queryset.order_by(f'-{field}', '-pk')
+        lookup = 'lt'
+    else:
+        queryset = queryset.order_by(field, 'pk')
+        lookup = 'gt'
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        value, pk = position
+        queryset = queryset.filter(
+            Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'pk__{lookup}': pk})
+        )
+    # 1件多く取得して次ページの有無を判定
+    rows = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.pk)
+    return KeysetPage(rows, next_cursor)
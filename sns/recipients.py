@@ -0,0 +1,45 @@
+from django.contrib.auth.models import User
+from .models import ConversationMember
+from .timeline import following_ids
+
+# メッセージの宛先検索
+# ユーザー名の前方一致を範囲検索（username >= 入力 AND username < 入力 + U+10FFFF）にして、
+# auth_user.username の一意インデックスをそのまま使う（LIKE だと SQLite ではインデックスが効かない）
+# 最近やり取りした相手 → フォロー中 → その他の順に並べる
+
+LIMIT = 10
+# 候補の先頭に出す最近の相手（直近のスレッド数）
+RECENT_CONVERSATIONS = 20
+
+def prefix_range(prefix):
+    return {'username__gte': prefix, 'username__lt': prefix + '\U0010ffff'}
+
+def recent_contact_ids(user_id):
+    conversation_ids = list(
+        ConversationMember.objects.filter(user_id=user_id)
+        .order_by('-last_message_at', '-id')
+        .values_list('conversation_id', flat=True)[:RECENT_CONVERSATIONS]
+    )
+    order = {pk: i for i, pk in enumerate(conversation_ids)}
+    members = (
+        ConversationMember.objects.filter(conversation_id__in=conversation_ids)
+        .exclude(user_id=user_id).values_list('conversation_id', 'user_id')
+    )
+    ids = []
+    for _, member_id in sorted(members, key=lambda row: order[row[0]]):
+        if member_id not in ids:
+            ids.append(member_id)
+    return ids
+
+def lookup_recipients(user, prefix, limit=LIMIT):
+    users = User.objects.filter(is_active=True, **prefix_range(prefix)).only('pk', 'username')
+    recent = recent_contact_ids(user.pk)
+    ranked = sorted(users.filter(pk__in=recent), key=lambda u: recent.index(u.pk))[:limit]
+    exclude = [u.pk for u in ranked]
+    if len(ranked) < limit:
+        following = users.filter(pk__in=following_ids(user.pk)).exclude(pk__in=exclude).order_by('username')
+        ranked += following[:limit - len(ranked)]
+        exclude = [u.pk for u in ranked]
+    if len(ranked) < limit:
+        ranked += users.exclude(pk__in=exclude).order_by('username')[:limit - len(ranked)]
+    return ranked
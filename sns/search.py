@@ -0,0 +1,180 @@
+import re
+import unicodedata
+from django.db import connection
+from accounts.models import Profile
+from .models import Comment, Post, SearchDocument
+
+# 投稿・コメント・プロフィールの全文検索
+# 日本語は単語境界が無いので、かな・漢字の連続部分を 2-gram に分割して保存・検索する
+# SQLite は FTS5（bm25）、PostgreSQL は tsvector（ts_rank）、それ以外は LIKE で検索する
+
+CJK = '\u3005\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff66-\uff9f'
+TOKEN_RE = re.compile(rf'[{CJK}]+|[^\W_{CJK}]+')
+CJK_RE = re.compile(rf'^[{CJK}]+$')
+
+def _runs(text):
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return TOKEN_RE.findall(text)
+
+def ngram_tokens(text):
+    tokens = []
+    for run in _runs(text):
+        if CJK_RE.match(run):
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            # 1文字検索のために末尾の1文字も入れる
+            tokens.append(run[-1])
+        else:
+            tokens.append(run)
+    return ' '.join(tokens)
+
+def query_terms(text):
+    # [(トークン, 前方一致か), ...]
+    # 1文字の日本語と英数字の単語は前方一致（ユーザー名の途中までの入力でも見つかるように）
+    terms = []
+    for run in _runs(text):
+        if CJK_RE.match(run) and len(run) > 1:
+            terms.extend((run[i:i + 2], False) for i in range(len(run) - 1))
+        else:
+            terms.append((run, True))
+    return terms
+
+# ---- 索引の更新 ----
+
+def document_fields(kind, obj):
+    if kind == 'post':
+        return obj.title, obj.content
+    if kind == 'comment':
+        return '', obj.body
+    return obj.user.username, obj.bio
+
+def build_document(kind, obj):
+    title, body = document_fields(kind, obj)
+    return SearchDocument(
+        kind=kind, object_id=obj.pk,
+        title_tokens=ngram_tokens(title), body_tokens=ngram_tokens(body),
+    )
+
+def index_object(kind, obj):
+    document = build_document(kind, obj)
+    # 索引する項目が変わっていなければ書き込まない（ログインのたびの Profile 保存など）
+    current = SearchDocument.objects.filter(kind=kind, object_id=obj.pk).values_list('title_tokens', 'body_tokens').first()
+    if current == (document.title_tokens, document.body_tokens):
+        return
+    SearchDocument.objects.update_or_create(
+        kind=kind, object_id=obj.pk,
+        defaults={'title_tokens': document.title_tokens, 'body_tokens': document.body_tokens},
+    )
+
+def unindex_object(kind, pk):
+    SearchDocument.objects.filter(kind=kind, object_id=pk).delete()
+
+SOURCES = {
+    'post': lambda: Post.objects.all(),
+    'comment': lambda: Comment.objects.all(),
+    'profile': lambda: Profile.objects.select_related('user'),
+}
+
+def reindex(kind, batch_size=1000):
+    # 主キー順にバッチで作り直す（作り直し中も他のバッチの検索は使える）
+    last_pk = 0
+    total = 0
+    while True:
+        batch = list(SOURCES[kind]().filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not batch:
+            break
+        pks = [obj.pk for obj in batch]
+        SearchDocument.objects.filter(kind=kind, object_id__in=pks).delete()
+        SearchDocument.objects.bulk_create([build_document(kind, obj) for obj in batch])
+        last_pk = pks[-1]
+        total += len(batch)
+    # 削除済みの対象の文書を消す
+    stale = SearchDocument.objects.filter(kind=kind).exclude(object_id__in=SOURCES[kind]().values('pk'))
+    stale.delete()
+    return total
+
+# ---- 検索 ----
+
+class SQLiteBackend:
+    def match_expression(self, terms):
+        return ' AND '.join(f'"{token}"*' if prefix else f'"{token}"' for token, prefix in terms)
+
+    def search(self, terms, kind, limit, offset):
+        sql = (
+            'SELECT d.kind, d.object_id, bm25(sns_searchdocument_fts, 5.0, 1.0) AS score '
+            'FROM sns_searchdocument_fts JOIN sns_searchdocument d ON d.id = sns_searchdocument_fts.rowid '
+            'WHERE sns_searchdocument_fts MATCH %s'
+        )
+        params = [self.match_expression(terms)]
+        if kind:
+            sql += ' AND d.kind = %s'
+            params.append(kind)
+        # bm25 は小さいほど関連度が高い
+        sql += ' ORDER BY score, d.id LIMIT %s OFFSET %s'
+        params += [limit, offset]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [(kind, pk, -score) for kind, pk, score in cursor.fetchall()]
+
+class PostgresBackend:
+    def tsquery(self, terms):
+        return ' & '.join(f'{token}:*' if prefix else token for token, prefix in terms)
+
+    def search(self, terms, kind, limit, offset):
+        sql = (
+            "SELECT d.kind, d.object_id, ts_rank(d.search_vector, q) AS score "
+            "FROM sns_searchdocument d, to_tsquery('simple', %s) q "
+            "WHERE d.search_vector @@ q"
+        )
+        params = [self.tsquery(terms)]
+        if kind:
+            sql += ' AND d.kind = %s'
+            params.append(kind)
+        sql += ' ORDER BY score DESC, d.id LIMIT %s OFFSET %s'
+        params += [limit, offset]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+class BasicBackend:
+    # 全文検索の無いデータベース用（順位付けなし）
+    def search(self, terms, kind, limit, offset):
+        documents = SearchDocument.objects.all()
+        if kind:
+            documents = documents.filter(kind=kind)
+        for token, _ in terms:
+            documents = documents.filter(title_tokens__contains=token) | documents.filter(body_tokens__contains=token)
+        rows = documents.order_by('-updated_at').values_list('kind', 'object_id')[offset:offset + limit]
+        return [(kind, pk, 0) for kind, pk in rows]
+
+def get_backend():
+    return {'sqlite': SQLiteBackend, 'postgresql': PostgresBackend}.get(connection.vendor, BasicBackend)()
+
+class SearchResult:
+    def __init__(self, kind, obj, score):
+        self.kind = kind
+        self.object = obj
+        self.score = score
+
+def search_ids(text, kind=None, limit=20, offset=0):
+    # [(kind, object_id, score), ...] を関連度順に返す
+    terms = query_terms(text)
+    if not terms:
+        return []
+    return get_backend().search(terms, kind, limit, offset)
+
+LOADERS = {
+    'post': lambda pks: Post.objects.select_related('author').in_bulk(pks),
+    'comment': lambda pks: Comment.objects.select_related('user', 'post').in_bulk(pks),
+    'profile': lambda pks: Profile.objects.select_related('user').in_bulk(pks),
+}
+
+def search(text, kind=None, limit=20, offset=0):
+    hits = search_ids(text, kind, limit, offset)
+    # 種類ごとに1クエリでまとめて取得する
+    objects = {}
+    for hit_kind in {hit[0] for hit in hits}:
+        objects[hit_kind] = LOADERS[hit_kind]([pk for k, pk, _ in hits if k == hit_kind])
+    return [
+        SearchResult(k, objects[k][pk], score)
+        for k, pk, score in hits if pk in objects[k]
+    ]
@@ -0,0 +1,69 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from .models import Attachment, Comment, Message, Notification, Post
+from .unread import adjust_unread_count
+from .blobs import release_blob
+from .thumbnails import remember_source, schedule_all, source_changed
+from .search import index_object, unindex_object
+
+KINDS = {
+    Message: 'message',
+    Notification: 'notification',
+}
+
+def remember_state(instance):
+    instance._unread_state = (instance.recipient_id, instance.is_read)
+
+@receiver(post_init, sender=Message)
+@receiver(post_init, sender=Notification)
+def track_unread_state(sender, instance, **kwargs):
+    remember_state(instance)
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=Notification)
+def update_unread_on_save(sender, instance, created, **kwargs):
+    kind = KINDS[sender]
+    old_recipient, old_is_read = (None, True) if created else instance._unread_state
+    # 変更前の未読を減らし、変更後の未読を増やす（宛先変更にも対応）
+    if old_recipient and not old_is_read:
+        adjust_unread_count(kind, old_recipient, -1)
+    if not instance.is_read:
+        adjust_unread_count(kind, instance.recipient_id, 1)
+    remember_state(instance)
+
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=Notification)
+def update_unread_on_delete(sender, instance, **kwargs):
+    if not instance.is_read:
+        adjust_unread_count(KINDS[sender], instance.recipient_id, -1)
+
+@receiver(post_delete, sender=Attachment)
+def release_attachment_blob(sender, instance, **kwargs):
+    # 削除ビューでも、メッセージ削除による連鎖削除でも参照数を減らす
+    release_blob(instance.file.name)
+
+@receiver(post_init, sender=Post)
+def track_post_image(sender, instance, **kwargs):
+    remember_source(instance, 'image')
+
+@receiver(post_save, sender=Post)
+def generate_post_thumbnails(sender, instance, **kwargs):
+    if source_changed(instance, 'image'):
+        schedule_all(instance.image, ['post_detail'])
+        remember_source(instance, 'image')
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    index_object('post', instance)
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, **kwargs):
+    index_object('comment', instance)
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    unindex_object('post', instance.pk)
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, **kwargs):
+    unindex_object('comment', instance.pk)
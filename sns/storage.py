@@ -0,0 +1,40 @@
+import hashlib
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    # 内容の SHA-256 をファイル名にして保存する（同じ内容は1回だけ保存される）
+    # 参照数は sns.models.Blob で管理し、削除は gc_blobs コマンドで行う
+    prefix = 'blobs'
+
+    def content_name(self, content):
+        # 同じファイルを何度もハッシュしないよう、計算した名前をファイルオブジェクトに覚えておく
+        name = getattr(content, '_content_name', None)
+        if name is None:
+            sha256 = hashlib.sha256()
+            for chunk in content.chunks():
+                sha256.update(chunk)
+            digest = sha256.hexdigest()
+            name = f'{self.prefix}/{digest[:2]}/{digest[2:4]}/{digest}'
+            content._content_name = name
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        # 保存先は _save で決めるので、ここでは重複回避の名前変更をしない
+        # ただし _save 中に同じ内容が先に保存されたときは、同じ名前を返すと
+        # FileSystemStorage が無限に再試行するので FileExistsError で抜ける
+        if name.startswith(f'{self.prefix}/') and self.exists(name):
+            raise FileExistsError(name)
+        return name
+
+    def _save(self, name, content):
+        name = self.content_name(content)
+        if self.exists(name):
+            return name
+        content.seek(0)
+        try:
+            return super()._save(name, content)
+        except FileExistsError:
+            # 同じ内容の同時アップロードに先を越された（中身は同じなのでそのまま使う）
+            return name
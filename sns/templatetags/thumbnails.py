@@ -0,0 +1,10 @@
+from django import template
+from sns import thumbnails
+
+register = template.Library()
+
+@register.simple_tag
+def thumbnail_url(image, spec, fmt='webp', fallback=True):
+    # 使い方: {% thumbnail_url obj.avatar 'avatar_card' 'jpeg' %}
+    # <source type="image/webp"> には fallback=False で取得し、空なら出さない（元画像を WebP と偽らない）
+    return thumbnails.thumbnail_url(image, spec, fmt, fallback)
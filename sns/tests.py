@@ -1,3 +1,728 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from PIL import Image
+from django.test import TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.template import Context, Template
+from django.urls import reverse
+from .models import Post, Comment, Conversation, Message, Notification, NotificationOutbox, Attachment, Blob
+from .blobs import collect_garbage
+from .unread import get_unread_count
+from .notifications import OutboxDispatcher, ThreadDispatcher, get_dispatcher, write_notifications
+from .search import ngram_tokens, reindex, search
+from .models import SearchDocument, TimelineEntry
+from .timeline import follow_author, get_dispatcher as get_timeline_dispatcher, home_timeline, unfollow_author
+from .recipients import lookup_recipients
+from . import thumbnails
+
+class PostListViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='viewer', password='pass')
+        self.client.force_login(self.user)
+
+    def create_posts(self, count):
+        authors = [
+            User.objects.create_user(username=f'author{User.objects.count()}', password='pass')
+            for _ in range(3)
+        ]
+        for i in range(count):
+            Post.objects.create(author=authors[i % 3], title=f'title{i}', content='本文')
+
+    def count_queries(self):
+        # 未読バッジのキャッシュを温めてから計測する
+        self.client.get(reverse('sns:post_list'))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('sns:post_list'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_is_constant(self):
+        self.create_posts(3)
+        few = self.count_queries()
+        self.create_posts(60)
+        many = self.count_queries()
+        self.assertEqual(few, many)
+        # セッション・ユーザー・投稿一覧
+        self.assertEqual(many, 3)
+
+    def test_cursor_walks_every_post_once(self):
+        self.create_posts(45)
+        seen = []
+        url = reverse('sns:post_list')
+        while url:
+            response = self.client.get(url)
+            page = response.context['page']
+            seen.extend(post.pk for post in page.object_list)
+            url = f"{reverse('sns:post_list')}?cursor={page.next_cursor}" if page.has_next else None
+        expected = list(Post.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        self.create_posts(5)
+        response = self.client.get(reverse('sns:post_list'), {'cursor': 'broken'})
+        self.assertEqual(len(response.context['page'].object_list), 5)
+
+class PostDetailViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='viewer', password='pass')
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.post = Post.objects.create(author=self.author, title='title', content='本文')
+        self.client.force_login(self.user)
+
+    def add_comments(self, count):
+        for i in range(count):
+            comment = Comment.objects.create(post=self.post, user=self.author, body=f'comment{i}')
+            if i % 2:
+                comment.toggle_like(self.user)
+
+    def count_queries(self):
+        url = reverse('sns:post_detail', kwargs={'pk': self.post.pk})
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_query_count_is_constant(self):
+        self.add_comments(2)
+        few, _ = self.count_queries()
+        self.add_comments(30)
+        many, _ = self.count_queries()
+        self.assertEqual(few, many)
+
+    def test_liked_by_me_annotation(self):
+        self.add_comments(4)
+        _, response = self.count_queries()
+        liked = [comment.liked_by_me for comment in response.context['comment_page'].object_list]
+        self.assertEqual(liked, [False, True, False, True])
+
+    def test_comments_are_paginated(self):
+        self.add_comments(60)
+        _, response = self.count_queries()
+        page = response.context['comment_page']
+        self.assertEqual(len(page.object_list), 50)
+        self.assertTrue(page.has_next)
+
+class LikeCounterTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='writer', password='pass')
+        self.fan = User.objects.create_user(username='fan', password='pass')
+        self.post = Post.objects.create(author=self.author, title='title', content='本文')
+
+    def test_toggle_updates_counter(self):
+        self.assertTrue(self.post.toggle_like(self.fan))
+        self.assertTrue(self.post.toggle_like(self.author))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 2)
+        self.assertFalse(self.post.toggle_like(self.fan))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+        self.assertEqual(self.post.likes.count(), 1)
+
+    def test_concurrent_like_is_not_reported_as_new(self):
+        self.post.toggle_like(self.fan)
+        through = Post.likes.through
+        # 削除とINSERTの間に他のリクエストが追加した状態を再現する
+        with mock.patch.object(Post, '_like_rows', return_value=through.objects.none()):
+            self.assertIsNone(self.post.toggle_like(self.fan))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+
+    def test_like_view_notifies_only_new_likes(self):
+        self.client.force_login(self.fan)
+        url = reverse('sns:post_like', args=[self.post.pk])
+        with mock.patch('sns.views.notify') as notify:
+            self.client.post(url)
+            self.client.post(url)
+            with mock.patch.object(Post, 'toggle_like', return_value=None):
+                self.client.post(url)
+        self.assertEqual(notify.call_count, 1)
+
+    def test_rebuild_like_counts(self):
+        comment = Comment.objects.create(post=self.post, user=self.author, body='コメント')
+        self.post.toggle_like(self.fan)
+        comment.toggle_like(self.fan)
+        Post.objects.update(likes_count=10)
+        Comment.objects.update(likes_count=0)
+        call_command('rebuild_like_counts', batch_size=1, stdout=StringIO())
+        self.post.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual((self.post.likes_count, comment.likes_count), (1, 1))
+
+@override_settings(
+    TIMELINE_DISPATCHER='sns.notifications.SyncDispatcher',
+    TIMELINE_DISPATCHER_OPTIONS={'handler': 'sns.timeline.handle_payloads'},
+    NOTIFICATION_DISPATCHER='sns.notifications.SyncDispatcher',
+    NOTIFICATION_DISPATCHER_OPTIONS={},
+)
+class HomeTimelineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for dispatcher in (get_timeline_dispatcher, get_dispatcher):
+            dispatcher.cache_clear()
+            self.addCleanup(dispatcher.cache_clear)
+        self.reader = User.objects.create_user(username='reader', password='pass')
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.celebrity = User.objects.create_user(username='celebrity', password='pass')
+        for user in (self.author, self.celebrity):
+            user.profile.followers.add(self.reader)
+        self.client.force_login(self.author)
+
+    def publish(self, title):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.client.post(reverse('sns:post_create'), {'title': title, 'content': '本文'})
+        self.assertEqual(len(callbacks), 1)
+        return Post.objects.latest('pk')
+
+    def titles(self, page):
+        return [post.title for post in page.object_list]
+
+    def test_fan_out_runs_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            self.client.post(reverse('sns:post_create'), {'title': '未配信', 'content': '本文'})
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader).exists())
+        post = self.publish('配信')
+        self.assertTrue(TimelineEntry.objects.filter(user=self.reader, post=post).exists())
+        self.assertTrue(TimelineEntry.objects.filter(user=self.author, post=post).exists())
+
+    def test_merges_pushed_and_pulled_posts(self):
+        self.publish('push1')
+        Post.objects.create(author=self.celebrity, title='pull1', content='本文', fanned_out=False)
+        self.publish('push2')
+        Post.objects.create(author=self.celebrity, title='pull2', content='本文', fanned_out=False)
+        first = home_timeline(self.reader, None, 3)
+        self.assertEqual(self.titles(first), ['pull2', 'push2', 'pull1'])
+        second = home_timeline(self.reader, first.next_cursor, 3)
+        self.assertEqual(self.titles(second), ['push1'])
+        self.assertFalse(second.has_next)
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        other = User.objects.create_user(username='newcomer', password='pass')
+        old = self.publish('以前の投稿')
+        self.client.force_login(other)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.client.post(reverse('accounts:follow_toggle', args=['author']))
+        # 取り込みはリクエスト内では行わない
+        self.assertEqual(self.titles(home_timeline(other, None, 10)), [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.titles(home_timeline(other, None, 10)), ['以前の投稿'])
+        self.client.post(reverse('accounts:follow_toggle', args=['author']))
+        self.assertEqual(self.titles(home_timeline(other, None, 10)), [])
+        self.assertTrue(TimelineEntry.objects.filter(user=self.reader, post=old).exists())
+        # キュー待ちの間にフォローを解除していれば取り込まない
+        follow_author(other.pk, self.author.pk)
+        self.assertEqual(self.titles(home_timeline(other, None, 10)), [])
+
+    @override_settings(TIMELINE_MAX_LENGTH=3)
+    def test_timelines_are_trimmed_on_write(self):
+        with mock.patch('sns.timeline.random.random', return_value=0.99):
+            for i in range(5):
+                self.publish(f'post{i}')
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader).count(), 5)
+        # 1 / TIMELINE_TRIM_SLACK の確率で当たったタイムラインだけ上限まで切り詰める
+        with mock.patch('sns.timeline.random.random', return_value=0):
+            self.publish('post5')
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader).count(), 3)
+        self.assertEqual(self.titles(home_timeline(self.reader, None, 10)), ['post5', 'post4', 'post3'])
+
+class UnreadCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sender = User.objects.create_user(username='sender', password='pass')
+        self.recipient = User.objects.create_user(username='recipient', password='pass')
+
+    def send(self):
+        return Message.objects.create(sender=self.sender, recipient=self.recipient, subject='件名', body='本文')
+
+    def test_counter_follows_create_read_and_delete(self):
+        self.assertEqual(get_unread_count('message', self.recipient.pk), 0)
+        first = self.send()
+        second = self.send()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_count('message', self.recipient.pk), 2)
+        first.is_read = True
+        first.save()
+        second.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_count('message', self.recipient.pk), 0)
+
+    def test_counter_falls_back_to_database(self):
+        Notification.objects.create(sender=self.sender, recipient=self.recipient, notification_type='follow')
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_unread_count('notification', self.recipient.pk), 1)
+
+class NotificationCoalescingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.post = Post.objects.create(author=self.author, title='title', content='本文')
+
+    def like(self, user):
+        return {
+            'sender_id': user.pk, 'recipient_id': self.author.pk,
+            'post_id': self.post.pk, 'comment_id': None, 'notification_type': 'like_post',
+        }
+
+    def test_likes_on_same_post_are_merged_and_toggles_deduplicated(self):
+        fans = [User.objects.create_user(username=f'fan{i}', password='pass') for i in range(3)]
+        write_notifications([self.like(fan) for fan in fans])
+        # いいね→取り消し→いいね をもう一度送っても人数は増えない
+        write_notifications([self.like(fans[0])])
+        notification = Notification.objects.get()
+        self.assertEqual(notification.actor_count, 3)
+        self.assertEqual(notification.sender, fans[0])
+        self.assertEqual(get_unread_count('notification', self.author.pk), 1)
+
+    def test_older_actor_is_not_counted_twice(self):
+        fans = [User.objects.create_user(username=f'fan{i}', password='pass') for i in range(Notification.RECENT_ACTORS + 2)]
+        write_notifications([self.like(fans[0])])
+        write_notifications([self.like(fan) for fan in fans[1:]])
+        # 直近の送信者から外れた人がもう一度いいねしても数えない
+        write_notifications([self.like(fans[0])])
+        notification = Notification.objects.get()
+        self.assertEqual(notification.actor_count, len(fans))
+        self.assertEqual(notification.actors.count(), len(fans))
+        self.assertEqual(notification.recent_actors[0]['id'], fans[0].pk)
+
+    def test_marking_read_keeps_order(self):
+        other = User.objects.create_user(username='other', password='pass')
+        write_notifications([self.like(other)])
+        first = Notification.objects.get()
+        Notification.objects.filter(pk=first.pk).update(updated_at=first.updated_at - timedelta(hours=1))
+        write_notifications([{**self.like(other), 'notification_type': 'comment'}])
+        first.refresh_from_db()
+        before = first.updated_at
+        self.client.force_login(self.author)
+        self.client.get(reverse('sns:notification_mark_read', args=[first.pk]))
+        first.refresh_from_db()
+        self.assertTrue(first.is_read)
+        self.assertEqual(first.updated_at, before)
+        response = self.client.get(reverse('sns:notification_list'))
+        self.assertEqual([n.notification_type for n in response.context['page'].object_list], ['comment', 'like_post'])
+
+handled_batches = []
+handled_event = threading.Event()
+
+def record_batch(payloads):
+    # ThreadDispatcher のテスト用ハンドラ
+    handled_batches.append(payloads)
+    if sum(len(batch) for batch in handled_batches) >= 5:
+        handled_event.set()
+
+class NotificationDispatcherTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_dispatcher.cache_clear()
+        self.addCleanup(get_dispatcher.cache_clear)
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.fan = User.objects.create_user(username='fan', password='pass')
+        self.post = Post.objects.create(author=self.author, title='title', content='本文')
+
+    def like(self):
+        self.client.force_login(self.fan)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('sns:post_like', args=[self.post.pk]))
+
+    @override_settings(NOTIFICATION_DISPATCHER='sns.notifications.SyncDispatcher', NOTIFICATION_DISPATCHER_OPTIONS={})
+    def test_sync_dispatcher_writes_after_commit(self):
+        self.like()
+        notification = Notification.objects.get()
+        self.assertEqual((notification.sender, notification.notification_type), (self.fan, 'like_post'))
+
+    @override_settings(NOTIFICATION_DISPATCHER='sns.notifications.OutboxDispatcher', NOTIFICATION_DISPATCHER_OPTIONS={})
+    def test_outbox_dispatcher_and_drain_command(self):
+        self.like()
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(NotificationOutbox.objects.count(), 1)
+        out = StringIO()
+        call_command('drain_notification_outbox', batch_size=1, stdout=out)
+        self.assertIn('1 件', out.getvalue())
+        self.assertEqual(Notification.objects.get().sender, self.fan)
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertEqual(get_unread_count('notification', self.author.pk), 1)
+
+    def test_outbox_dispatcher_only_writes_notifications(self):
+        with self.assertRaises(ImproperlyConfigured):
+            OutboxDispatcher(handler='sns.timeline.fan_out_posts')
+
+    def test_thread_dispatcher_batches_in_one_worker(self):
+        handled_batches.clear()
+        handled_event.clear()
+        dispatcher = ThreadDispatcher(batch_size=10, wait=0.1, handler='sns.tests.record_batch')
+        for i in range(5):
+            dispatcher.enqueue({'n': i})
+        self.assertTrue(handled_event.wait(timeout=5))
+        self.assertEqual(len(dispatcher._threads), 1)
+        self.assertEqual(sorted(p['n'] for batch in handled_batches for p in batch), [0, 1, 2, 3, 4])
+        self.assertLess(len(handled_batches), 5)
+
+class NotificationListViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='viewer', password='pass')
+        self.client.force_login(self.user)
+        senders = [User.objects.create_user(username=f'sender{i}', password='pass') for i in range(3)]
+        post = Post.objects.create(author=self.user, title='title', content='本文')
+        for i in range(40):
+            comment = Comment.objects.create(post=post, user=senders[i % 3], body=f'comment{i}')
+            Notification.objects.create(
+                sender=senders[i % 3], recipient=self.user, post=post, comment=comment, notification_type='comment',
+            )
+
+    def test_list_is_paginated_without_n_plus_one(self):
+        url = reverse('sns:notification_list')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        # セッション・ユーザー・通知一覧
+        self.assertEqual(len(ctx.captured_queries), 3)
+        self.assertEqual(len(response.context['page'].object_list), 30)
+        self.assertTrue(response.context['page'].has_next)
+
+    def test_mark_page_and_mark_all_read(self):
+        page = Notification.objects.order_by('-updated_at', '-id')[:30]
+        ids = [str(n.pk) for n in page]
+        url = reverse('sns:notification_bulk_mark_read')
+        self.client.post(url, {'scope': 'page', 'ids': ids})
+        self.assertEqual(get_unread_count('notification', self.user.pk), 10)
+        with self.assertNumQueries(3):
+            # セッション・ユーザー・UPDATE
+            self.client.post(url)
+        self.assertEqual(get_unread_count('notification', self.user.pk), 0)
+
+class ConversationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='pass')
+        self.bob = User.objects.create_user(username='bob', password='pass')
+
+    def send(self, sender, recipient, url_name='sns:message_create', **kwargs):
+        self.client.force_login(sender)
+        self.client.post(reverse(url_name, **kwargs), {
+            'recipient': recipient.pk, 'subject': '件名', 'body': '本文',
+        })
+        return Message.objects.latest('pk')
+
+    def test_reply_joins_thread_and_inbox_lists_threads(self):
+        carol = User.objects.create_user(username='carol', password='pass')
+        first = self.send(self.alice, self.bob)
+        reply = self.send(self.bob, self.alice, 'sns:message_reply', kwargs={'pk': first.pk})
+        # 返信でなくても同じ2人なら同じスレッド
+        again = self.send(self.alice, self.bob)
+        self.send(carol, self.bob)
+        self.assertEqual(reply.conversation, first.conversation)
+        self.assertEqual(again.conversation, first.conversation)
+
+        self.client.force_login(self.bob)
+        url = reverse('sns:message_inbox')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        # セッション・ユーザー・スレッド一覧
+        self.assertEqual(len(ctx.captured_queries), 3)
+        members = response.context['page'].object_list
+        self.assertEqual([m.unread_count for m in members], [1, 2])
+
+    def test_update_cannot_change_recipient(self):
+        carol = User.objects.create_user(username='carol', password='pass')
+        message = self.send(self.alice, self.bob)
+        self.client.post(reverse('sns:message_update', args=[message.pk]), {
+            'recipient': carol.pk, 'subject': '件名（修正）', 'body': '本文',
+        })
+        message.refresh_from_db()
+        self.assertEqual((message.recipient, message.subject), (self.bob, '件名（修正）'))
+        self.assertFalse(carol.conversation_memberships.exists())
+
+    def test_build_conversations_groups_by_pair(self):
+        Message.objects.bulk_create([
+            Message(sender=self.alice, recipient=self.bob, subject='件名', body='1', is_read=True),
+            Message(sender=self.bob, recipient=self.alice, subject='件名', body='2'),
+            Message(sender=self.alice, recipient=self.bob, subject='件名', body='3'),
+        ])
+        out = StringIO()
+        call_command('build_conversations', batch_size=2, stdout=out)
+        self.assertIn('1 件', out.getvalue())
+        conversation = Conversation.objects.get()
+        self.assertEqual(conversation.messages.count(), 3)
+        self.assertEqual(conversation.last_message.body, '3')
+        self.assertEqual(conversation.members.get(user=self.bob).unread_count, 1)
+        self.assertEqual(conversation.members.get(user=self.alice).unread_count, 1)
+
+    def test_opening_thread_marks_it_read(self):
+        first = self.send(self.alice, self.bob)
+        self.client.force_login(self.bob)
+        self.client.get(reverse('sns:conversation_detail', kwargs={'pk': first.conversation_id}))
+        first.refresh_from_db()
+        self.assertTrue(first.is_read)
+        self.assertEqual(first.conversation.members.get(user=self.bob).unread_count, 0)
+        self.assertEqual(get_unread_count('message', self.bob.pk), 0)
+
+class AttachmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, ATTACHMENT_MAX_SIZE=1024)
+        self.settings_override.enable()
+        self.alice = User.objects.create_user(username='alice', password='pass')
+        self.bob = User.objects.create_user(username='bob', password='pass')
+        self.client.force_login(self.alice)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def send(self, *files):
+        return self.client.post(reverse('sns:message_create'), {
+            'recipient': self.bob.pk, 'subject': '件名', 'body': '本文', 'files': list(files),
+        })
+
+    def test_files_are_saved_in_one_insert(self):
+        files = [SimpleUploadedFile(f'f{i}.txt', b'x' * 100) for i in range(3)]
+        with CaptureQueriesContext(connection) as ctx:
+            self.send(*files)
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "sns_attachment"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(Attachment.objects.count(), 3)
+
+    def test_oversized_file_is_rejected(self):
+        response = self.send(SimpleUploadedFile('big.bin', b'x' * 2048))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].non_field_errors())
+        self.assertFalse(Message.objects.exists())
+
+    def test_range_download(self):
+        self.send(SimpleUploadedFile('data.txt', b'0123456789'))
+        attachment = Attachment.objects.get()
+        self.client.force_login(self.bob)
+        url = reverse('sns:attachment_download', kwargs={'pk': attachment.pk})
+        response = self.client.get(url, headers={'Range': 'bytes=2-5'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        response = self.client.get(url)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    def test_same_content_is_stored_once_and_reference_counted(self):
+        self.send(SimpleUploadedFile('a.txt', b'same'))
+        self.send(SimpleUploadedFile('b.txt', b'same'))
+        names = set(Attachment.objects.values_list('file', flat=True))
+        self.assertEqual(len(names), 1)
+        blob = Blob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+
+        Attachment.objects.first().delete()
+        Message.objects.all().delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 0)
+        storage = Attachment._meta.get_field('file').storage
+        self.assertTrue(storage.exists(blob.name))
+        self.assertEqual(collect_garbage(grace_seconds=-1), 1)
+        self.assertFalse(storage.exists(blob.name))
+
+    def test_concurrent_upload_of_same_content_does_not_loop(self):
+        storage = Attachment._meta.get_field('file').storage
+        first = SimpleUploadedFile('a.txt', b'race')
+        name = storage.save('a.txt', first)
+        # 存在確認の後に他のリクエストが同じ内容を保存した状態を再現する
+        with mock.patch.object(type(storage), 'exists', side_effect=[False, True]):
+            self.assertEqual(storage.save('b.txt', SimpleUploadedFile('b.txt', b'race')), name)
+
+    def test_reference_is_taken_before_file_is_saved(self):
+        storage = Attachment._meta.get_field('file').storage
+        save = type(storage)._save
+
+        def checked_save(storage, name, content):
+            self.assertEqual(Blob.objects.get(name=storage.content_name(content)).ref_count, 1)
+            return save(storage, name, content)
+
+        with mock.patch.object(type(storage), '_save', checked_save):
+            self.send(SimpleUploadedFile('a.txt', b'ordered'))
+        self.assertTrue(storage.exists(Blob.objects.get().name))
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='searcher', password='pass')
+        self.client.force_login(self.user)
+
+    def test_ngram_tokens(self):
+        self.assertEqual(ngram_tokens('東京タワー Django'), '東京 京タ タワ ワー ー django')
+
+    def test_japanese_word_matches_and_ranks_title_first(self):
+        body_hit = Post.objects.create(author=self.user, title='日記', content='今日は東京に行った')
+        title_hit = Post.objects.create(author=self.user, title='東京の写真', content='散歩')
+        Post.objects.create(author=self.user, title='京都', content='旅行')
+        results = search('東京', kind='post')
+        self.assertEqual([r.object for r in results], [title_hit, body_hit])
+
+    def test_index_follows_updates_and_deletes(self):
+        post = Post.objects.create(author=self.user, title='猫', content='')
+        comment = Comment.objects.create(post=post, user=self.user, body='かわいい猫ですね')
+        self.assertEqual([r.object for r in search('猫', kind='comment')], [comment])
+        post.title = '犬'
+        post.save()
+        self.assertEqual(search('猫', kind='post'), [])
+        post.delete()
+        self.assertFalse(SearchDocument.objects.exclude(kind='profile').exists())
+
+    def test_reindex_rebuilds_missing_documents(self):
+        Post.objects.create(author=self.user, title='検索テスト', content='')
+        SearchDocument.objects.all().delete()
+        self.assertEqual(reindex('post', batch_size=1), 1)
+        self.assertEqual(len(search('検索', kind='post')), 1)
+
+    def test_search_view_paginates(self):
+        for i in range(25):
+            Post.objects.create(author=self.user, title=f'ページ{i}', content='')
+        response = self.client.get(reverse('sns:search'), {'q': 'ページ', 'kind': 'post'})
+        self.assertEqual(len(response.context['results']), 20)
+        self.assertTrue(response.context['has_next'])
+        response = self.client.get(reverse('sns:search'), {'q': 'ページ', 'kind': 'post', 'page': 2})
+        self.assertEqual(len(response.context['results']), 5)
+        self.assertFalse(response.context['has_next'])
+
+    def test_profile_list_uses_search_index(self):
+        User.objects.create_user(username='tanaka', password='pass')
+        response = self.client.get(reverse('accounts:profile_list'), {'q': 'tana'})
+        self.assertEqual([p.user.username for p in response.context['object_list']], ['tanaka'])
+
+    def test_backfill_migration_indexes_existing_rows(self):
+        from importlib import import_module
+        from django.apps import apps
+        post = Post.objects.create(author=self.user, title='移行前の投稿', content='')
+        SearchDocument.objects.filter(kind='profile', object_id=self.user.profile.pk).delete()
+        SearchDocument.objects.filter(kind='post').delete()
+        import_module('sns.migrations.0028_search_backfill').fill_documents(apps, None)
+        self.assertEqual([r.object for r in search('移行', kind='post')], [post])
+        response = self.client.get(reverse('accounts:profile_list'), {'q': 'search'})
+        self.assertEqual([p.user.username for p in response.context['object_list']], ['searcher'])
+
+    def test_login_does_not_rewrite_profile_document(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.login(username='searcher', password='pass')
+        writes = [q['sql'] for q in queries if 'sns_searchdocument' in q['sql'] and not q['sql'].startswith('SELECT')]
+        self.assertEqual(writes, [])
+        self.user.profile.bio = '自己紹介'
+        self.user.profile.save()
+        self.assertEqual([r.object for r in search('自己紹介', kind='profile')], [self.user.profile])
+
+
+class RecipientLookupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.me = User.objects.create_user(username='me', password='pass')
+        User.objects.bulk_create([User(username=f'user{i:03}') for i in range(200)])
+        self.followed = User.objects.create_user(username='user_friend', password='pass')
+        self.followed.profile.followers.add(self.me)
+        self.contact = User.objects.create_user(username='user_zzz', password='pass')
+        self.client.force_login(self.me)
+        self.client.post(reverse('sns:message_create'), {'recipient': self.contact.pk, 'subject': '件名', 'body': '本文'})
+
+    def test_recent_contacts_and_following_come_first(self):
+        names = [user.username for user in lookup_recipients(self.me, 'user')]
+        self.assertEqual(names[:4], ['user_zzz', 'user_friend', 'user000', 'user001'])
+        self.assertEqual(len(names), 10)
+        self.assertEqual([user.username for user in lookup_recipients(self.me, 'user19')][:2], ['user190', 'user191'])
+        self.assertEqual(lookup_recipients(self.me, 'nobody'), [])
+
+    def test_endpoint_returns_json(self):
+        data = self.client.get(reverse('sns:recipient_lookup'), {'q': 'user_f'}).json()
+        self.assertEqual(data['results'], [{'id': self.followed.pk, 'text': 'user_friend'}])
+
+    def test_form_does_not_render_every_user(self):
+        response = self.client.get(reverse('sns:message_create'))
+        self.assertContains(response, reverse('sns:recipient_lookup'))
+        self.assertNotContains(response, 'user000')
+        message = Message.objects.get(sender=self.me)
+        response = self.client.get(reverse('sns:message_update', args=[message.pk]))
+        self.assertContains(response, f'<option value="{self.contact.pk}" selected>user_zzz</option>', html=True)
+        # 宛先は選ばれた1件だけを取得して検証する
+        self.client.post(reverse('sns:message_create'), {'recipient': 0, 'subject': '件名', 'body': '本文'})
+        self.assertEqual(Message.objects.filter(sender=self.me).count(), 1)
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.addCleanup(self.settings_override.disable)
+        self.author = User.objects.create_user(username='photographer', password='pass')
+
+    def image_file(self, name='photo.png', size=(1200, 800)):
+        output = BytesIO()
+        Image.new('RGB', size, 'red').save(output, 'PNG')
+        return SimpleUploadedFile(name, output.getvalue(), content_type='image/png')
+
+    def create_post(self):
+        with mock.patch('sns.signals.schedule_all'):
+            return Post.objects.create(author=self.author, title='写真', content='本文', image=self.image_file())
+
+    def test_render_fits_spec(self):
+        data = thumbnails.render(self.image_file(), 'post_detail', 'webp')
+        image = Image.open(BytesIO(data))
+        self.assertEqual((image.format, image.size), ('WEBP', (600, 400)))
+        data = thumbnails.render(self.image_file(), 'avatar_card', 'jpeg')
+        self.assertEqual(Image.open(BytesIO(data)).size, (100, 100))
+
+    def test_generate_and_thumbnail_url(self):
+        post = self.create_post()
+        with mock.patch.object(thumbnails, 'schedule') as schedule:
+            # 生成前は元画像（fallback=False なら空）を返して生成を予約する
+            self.assertEqual(thumbnails.thumbnail_url(post.image, 'post_detail', 'jpeg'), post.image.url)
+            self.assertEqual(thumbnails.thumbnail_url(post.image, 'post_detail', fallback=False), '')
+            self.assertEqual(schedule.call_count, 2)
+        thumbnails.generate(post.image.storage, post.image.name, 'post_detail')
+        webp_name = thumbnails.derivative_name(post.image.name, 'post_detail', 'webp')
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, webp_name)))
+        self.assertTrue(thumbnails.thumbnail_url(post.image, 'post_detail').endswith('.webp'))
+        self.assertTrue(thumbnails.thumbnail_url(post.image, 'post_detail', 'jpeg').endswith('.jpeg'))
+
+    def test_template_emits_webp_source_only_when_ready(self):
+        post = self.create_post()
+        template = Template(
+            "{% load thumbnails %}{% thumbnail_url image 'post_detail' fallback=False as webp_url %}"
+            "{% if webp_url %}<source srcset=\"{{ webp_url }}\" type=\"image/webp\">{% endif %}"
+            "<img src=\"{% thumbnail_url image 'post_detail' 'jpeg' %}\">"
+        )
+        with mock.patch.object(thumbnails, 'schedule'):
+            html = template.render(Context({'image': post.image}))
+        self.assertNotIn('image/webp', html)
+        self.assertIn(post.image.url, html)
+        thumbnails.generate(post.image.storage, post.image.name, 'post_detail')
+        html = template.render(Context({'image': post.image}))
+        self.assertIn('.webp" type="image/webp"', html)
+        self.assertNotIn(post.image.url, html)
+
+    def test_avatar_thumbnails_only_when_image_changes(self):
+        self.client.force_login(self.author)
+        with mock.patch('accounts.signals.schedule_all') as schedule_all:
+            # ログイン（last_login の更新）では Profile も保存されるが画像は変わらない
+            self.client.login(username='photographer', password='pass')
+            self.author.refresh_from_db()
+            self.author.save()
+            self.assertFalse(schedule_all.called)
+            profile = self.author.profile
+            profile.avatar = self.image_file('avatar.png', (300, 300))
+            profile.save()
+            self.assertEqual(schedule_all.call_count, 1)
+            profile.save()
+            self.assertEqual(schedule_all.call_count, 1)
 
-# Create your tests here.
@@ -0,0 +1,119 @@
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from PIL import Image, ImageOps
+
+# 投稿画像・アバターの縮小版（WebP / JPEG）
+# アップロード時にワーカースレッドで生成し、元画像の保存名と規格から決まるパスにキャッシュする
+# 生成前に表示された場合は元画像を返し、その場で生成を予約する
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+def derivative_name(source_name, spec, fmt):
+    # アップロードされたファイルの保存名は上書きされないので、保存名と規格をキーにする
+    width, height = settings.THUMBNAIL_SPECS[spec]['size']
+    key = hashlib.sha1(f'{source_name}|{spec}|{width}x{height}'.encode()).hexdigest()
+    return f'thumbnails/{key[:2]}/{key}.{fmt}'
+
+def _ready_key(name):
+    return f'thumbnail:ready:{name}'
+
+def is_ready(name):
+    if cache.get(_ready_key(name)):
+        return True
+    if default_storage.exists(name):
+        cache.set(_ready_key(name), True, None)
+        return True
+    return False
+
+def render(source, spec, fmt):
+    options = settings.THUMBNAIL_SPECS[spec]
+    image = ImageOps.exif_transpose(Image.open(source))
+    if options.get('crop'):
+        image = ImageOps.fit(image, options['size'], Image.LANCZOS)
+    else:
+        image.thumbnail(options['size'], Image.LANCZOS)
+    pil_format, _ = FORMATS[fmt]
+    if pil_format == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGB')
+    output = BytesIO()
+    image.save(output, pil_format, quality=settings.THUMBNAIL_QUALITY)
+    return output.getvalue()
+
+def generate(storage, source_name, spec):
+    # 初期アバターなど、元画像がまだ置かれていない場合は何もしない
+    if not storage.exists(source_name):
+        return
+    for fmt in FORMATS:
+        name = derivative_name(source_name, spec, fmt)
+        if is_ready(name):
+            continue
+        with storage.open(source_name, 'rb') as source:
+            data = render(source, spec, fmt)
+        default_storage.save(name, ContentFile(data))
+        cache.set(_ready_key(name), True, None)
+
+def _run(storage, source_name, spec):
+    try:
+        generate(storage, source_name, spec)
+    except Exception:
+        logger.exception('縮小版の生成に失敗しました: %s (%s)', source_name, spec)
+    finally:
+        with _lock:
+            _pending.discard((source_name, spec))
+        close_old_connections()
+
+def schedule(field_file, spec):
+    # 同じ画像・規格の生成は重複して予約しない
+    global _executor
+    job = (field_file.name, spec)
+    with _lock:
+        if job in _pending:
+            return
+        _pending.add(job)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.THUMBNAIL_WORKERS, thread_name_prefix='thumbnail')
+    _executor.submit(_run, field_file.storage, field_file.name, spec)
+
+def schedule_all(field_file, specs):
+    if field_file:
+        for spec in specs:
+            schedule(field_file, spec)
+
+def _source_name(instance, field):
+    # 読み込まれていない（遅延読み込みの）フィールドは読まない
+    value = instance.__dict__.get(field)
+    return getattr(value, 'name', value)
+
+def remember_source(instance, field):
+    instance._thumbnail_source = _source_name(instance, field)
+
+def source_changed(instance, field):
+    # 画像が変わったときだけ生成する（User の保存のたびに Profile も保存されるため）
+    return _source_name(instance, field) != getattr(instance, '_thumbnail_source', None)
+
+def thumbnail_url(field_file, spec, fmt='webp', fallback=True):
+    # 縮小版がまだ無ければ生成を予約し、元画像の URL（fallback=False なら空文字）を返す
+    if not field_file:
+        return ''
+    name = derivative_name(field_file.name, spec, fmt)
+    if is_ready(name):
+        return default_storage.url(name)
+    schedule(field_file, spec)
+    return field_file.url if fallback else ''
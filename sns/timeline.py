@@ -0,0 +1,143 @@
+import random
+from functools import cache
+from itertools import islice
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from accounts.models import Profile
+from .models import Post, TimelineEntry
+from .notifications import make_dispatcher
+from .pagination import KeysetPage, decode_cursor, encode_cursor
+
+# ホームタイムライン（フォロー中ユーザーの投稿）
+# 通常は投稿時にフォロワー全員の TimelineEntry を作成する（fan-out on write）
+# フォロワーが TIMELINE_FANOUT_LIMIT を超えるアカウントは配信せず、読み込み時に取得する（fan-out on read）
+# 配信とフォロー直後の取り込みはリクエスト内で行わず、TIMELINE_DISPATCHER に登録して裏で行う
+# 切り詰めは書き込みのたびに確率 1 / TIMELINE_TRIM_SLACK で行う（件数を数えずに、超過を平均 TIMELINE_TRIM_SLACK 件程度に抑える）
+
+BATCH_SIZE = 1000
+
+def follower_ids(author_id):
+    return Profile.followers.through.objects.filter(profile__user_id=author_id).values_list('user_id', flat=True)
+
+def following_ids(user_id):
+    return Profile.objects.filter(followers=user_id).values_list('user_id', flat=True)
+
+def is_large_account(author_id):
+    return follower_ids(author_id).count() > settings.TIMELINE_FANOUT_LIMIT
+
+def insert_entries(user_ids, posts):
+    entries = []
+    for user_id in user_ids:
+        for post in posts:
+            entries.append(TimelineEntry(user_id=user_id, post_id=post.pk, created_at=post.created_at))
+            if len(entries) >= BATCH_SIZE:
+                TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+                entries = []
+    if entries:
+        TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+def maybe_trim(user_ids):
+    # 全員のタイムラインの件数を数えると配信のコストがタイムラインの長さに比例するので、一部だけ切り詰める
+    for user_id in user_ids:
+        if random.random() < 1 / settings.TIMELINE_TRIM_SLACK:
+            trim_timeline(user_id)
+
+def fan_out_post(post):
+    # 投稿者本人のタイムラインには必ず配信する
+    if is_large_account(post.author_id):
+        Post.objects.filter(pk=post.pk).update(fanned_out=False)
+        post.fanned_out = False
+    else:
+        followers = follower_ids(post.author_id).iterator(chunk_size=BATCH_SIZE)
+        while batch := list(islice(followers, BATCH_SIZE)):
+            insert_entries(batch, [post])
+            maybe_trim(batch)
+    insert_entries([post.author_id], [post])
+    maybe_trim([post.author_id])
+
+def fan_out_posts(payloads):
+    # キュー待ちの間に削除された投稿は配信しない
+    posts = Post.objects.in_bulk([payload['post_id'] for payload in payloads])
+    for post in posts.values():
+        fan_out_post(post)
+
+def follow_author(user_id, author_id):
+    # フォロー直後に最近の投稿を取り込む（キュー待ちの間にフォローを解除していれば取り込まない）
+    if not Profile.followers.through.objects.filter(profile__user_id=author_id, user_id=user_id).exists():
+        return
+    posts = Post.objects.filter(author_id=author_id, fanned_out=True).order_by('-created_at', '-id')
+    insert_entries([user_id], list(posts[:settings.TIMELINE_MAX_LENGTH]))
+    trim_timeline(user_id)
+
+def handle_payloads(payloads):
+    # ディスパッチャから呼ばれる。投稿の配信（post_id）とフォロー直後の取り込み（follower_id, author_id）
+    fan_out_posts([payload for payload in payloads if 'post_id' in payload])
+    for payload in payloads:
+        if 'follower_id' in payload:
+            follow_author(payload['follower_id'], payload['author_id'])
+
+@cache
+def get_dispatcher():
+    return make_dispatcher(settings.TIMELINE_DISPATCHER, settings.TIMELINE_DISPATCHER_OPTIONS)
+
+def enqueue(payload):
+    dispatcher = get_dispatcher()
+    if dispatcher.transactional:
+        dispatcher.enqueue(payload)
+    else:
+        # 投稿・フォローの保存が確定してから処理する
+        transaction.on_commit(lambda: dispatcher.enqueue(payload))
+
+def schedule_fan_out(post):
+    enqueue({'post_id': post.pk})
+
+def schedule_follow(user_id, author_id):
+    enqueue({'follower_id': user_id, 'author_id': author_id})
+
+def unfollow_author(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id, post__author_id=author_id).delete()
+
+def trim_timeline(user_id):
+    # TIMELINE_MAX_LENGTH 件より古いエントリを削除する
+    oldest_kept = (
+        TimelineEntry.objects.filter(user_id=user_id)
+        .order_by('-created_at', '-post')
+        .values_list('created_at', flat=True)[settings.TIMELINE_MAX_LENGTH - 1:settings.TIMELINE_MAX_LENGTH]
+    )
+    oldest_kept = list(oldest_kept)
+    if oldest_kept:
+        TimelineEntry.objects.filter(user_id=user_id, created_at__lt=oldest_kept[0]).delete()
+
+def _after(position, field, pk_field):
+    created_at, pk = position
+    return Q(**{f'{field}__lt': created_at}) | Q(**{field: created_at, f'{pk_field}__lt': pk})
+
+def home_timeline(user, cursor, per_page):
+    # 配信済みエントリと、大規模アカウントの投稿をそれぞれ (created_at, id) 順に取得してマージする
+    position = decode_cursor(cursor) if cursor else None
+    pushed = TimelineEntry.objects.filter(user=user).order_by('-created_at', '-post')
+    pulled = Post.objects.filter(
+        fanned_out=False, author_id__in=following_ids(user.pk),
+    ).order_by('-created_at', '-id')
+    if position:
+        pushed = pushed.filter(_after(position, 'created_at', 'post_id'))
+        pulled = pulled.filter(_after(position, 'created_at', 'id'))
+    keys = set(pushed.values_list('created_at', 'post_id')[:per_page + 1])
+    keys.update(pulled.values_list('created_at', 'id')[:per_page + 1])
+    keys = sorted(keys, reverse=True)
+
+    next_cursor = None
+    if len(keys) > per_page:
+        keys = keys[:per_page]
+        next_cursor = encode_cursor(*keys[-1])
+    posts = Post.objects.select_related('author').in_bulk([pk for _, pk in keys])
+    return KeysetPage([posts[pk] for _, pk in keys if pk in posts], next_cursor)
+
+def naive_home_timeline(user, per_page):
+    # 比較用：読み込み時に JOIN で組み立てる従来の方法
+    return list(
+        Post.objects.filter(Q(author_id__in=following_ids(user.pk)) | Q(author_id=user.pk))
+        .select_related('author')
+        .order_by('-created_at', '-id')[:per_page]
+    )
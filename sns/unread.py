@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.cache import cache
+from .models import Message, Notification
+
+# ヘッダーの未読バッジ用カウンタ
+# キャッシュを優先し、キャッシュに無いときだけ (recipient, is_read) インデックスで数える
+
+UNREAD_MODELS = {
+    'message': Message,
+    'notification': Notification,
+}
+
+def cache_key(kind, user_id):
+    return f'sns:unread:{kind}:{user_id}'
+
+def get_unread_count(kind, user_id):
+    key = cache_key(kind, user_id)
+    count = cache.get(key)
+    if count is None:
+        count = UNREAD_MODELS[kind].objects.filter(recipient_id=user_id, is_read=False).count()
+        cache.set(key, count, settings.UNREAD_COUNT_TIMEOUT)
+    return count
+
+def adjust_unread_count(kind, user_id, delta):
+    # キャッシュに無ければ何もしない（次回の読み込みでDBから数え直す）
+    key = cache_key(kind, user_id)
+    try:
+        count = cache.incr(key, delta)
+    except ValueError:
+        return
+    if count < 0:
+        cache.delete(key)
+
+def reset_unread_count(kind, user_id):
+    # update() や bulk_create() などシグナルが飛ばない一括処理の後に呼ぶ
+    cache.delete(cache_key(kind, user_id))
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from .models import Attachment
+from .blobs import acquire_blobs
+
+# 添付ファイルのアップロード
+# メモリに載せずに一時ファイルへ少しずつ書き込み、上限サイズを超えたファイルは受け取らない
+
+class AttachmentUploadHandler(TemporaryFileUploadHandler):
+    chunk_size = 256 * 1024
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.ATTACHMENT_MAX_SIZE:
+            self.file.close()
+            self.request.rejected_uploads.append(self.file_name)
+            raise SkipFile
+        return super().receive_data_chunk(raw_data, start)
+
+class AttachmentUploadMixin:
+    # アップロードハンドラは request.POST を読む前に差し替える必要があるため、
+    # CSRF チェックをハンドラ設定後に行う
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = csrf_protect(super().as_view(**initkwargs))
+
+        @csrf_exempt
+        def upload_view(request, *args, **kwargs):
+            request.rejected_uploads = []
+            request.upload_handlers = [AttachmentUploadHandler(request)]
+            return view(request, *args, **kwargs)
+        return upload_view
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['rejected_files'] = getattr(self.request, 'rejected_uploads', [])
+        return kwargs
+
+    def save_attachments(self, message):
+        # 添付ファイルは1回の INSERT でまとめて登録
+        files = self.request.FILES.getlist('files')
+        if files:
+            # 同じ内容のファイルは同じ Blob を参照する。参照はファイルを保存する前に取る
+            storage = Attachment._meta.get_field('file').storage
+            acquire_blobs([(storage.content_name(f), f.size) for f in files])
+            Attachment.objects.bulk_create([
+                Attachment(message=message, file=f, original_name=f.name) for f in files
+            ])
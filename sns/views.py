@@ -1,11 +1,22 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import JsonResponse
 from django.urls import reverse, reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.views.generic import CreateView, ListView, UpdateView, DeleteView, DetailView
+from django.views.generic import CreateView, ListView, UpdateView, DeleteView, DetailView, TemplateView
 from django.views import View
 from django.core.exceptions import PermissionDenied
-from .models import Notification, Post, Message, Attachment, Comment
+from django.db.models import Exists, OuterRef
+from .models import Notification, Post, Message, Attachment, Comment, Conversation
 from .forms import PostCreateForm, MessageForm, CommentForm
+from .pagination import paginate_keyset
+from .timeline import home_timeline, schedule_fan_out
+from .notifications import notify
+from .unread import reset_unread_count
+from .uploads import AttachmentUploadMixin
+from .downloads import attachment_response
+from .conversations import add_message, mark_message_read, mark_conversation_read, inbox
+from .search import search
+from .recipients import lookup_recipients
 
 def index_view(request):
     return render(request, 'sns/index.html')
@@ -13,14 +24,84 @@ def index_view(request):
 class PostListView(LoginRequiredMixin, ListView):
     model = Post
     template_name = 'sns/post_list.html'
+    page_size = 20
+
+    def get_queryset(self):
+        # 作成者をJOINして投稿ごとの追加クエリを防ぐ
+        return Post.objects.select_related('author')
+
+    def get_context_data(self, **kwargs):
+        # (created_at, id) のカーソルでページ分割
+        page = paginate_keyset(self.object_list, self.request.GET.get('cursor'), self.page_size)
+        context = super().get_context_data(object_list=page.object_list, **kwargs)
+        context['page'] = page
+        return context
+
+class HomeTimelineView(LoginRequiredMixin, TemplateView):
+    template_name = 'sns/home_timeline.html'
+    page_size = 20
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        cursor = self.request.GET.get('cursor')
+        context['page'] = home_timeline(self.request.user, cursor, self.page_size)
+        return context
+
+class SearchView(LoginRequiredMixin, TemplateView):
+    template_name = 'sns/search.html'
+    page_size = 20
+    kinds = ('post', 'comment', 'profile')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        q = self.request.GET.get('q', '').strip()
+        kind = self.request.GET.get('kind')
+        if kind not in self.kinds:
+            kind = None
+        try:
+            page_number = max(int(self.request.GET.get('page', 1)), 1)
+        except ValueError:
+            page_number = 1
+        offset = (page_number - 1) * self.page_size
+        # 1件多く取得して次ページの有無を判定
+        results = search(q, kind, limit=self.page_size + 1, offset=offset) if q else []
+        context.update({
+            'q': q,
+            'kind': kind or '',
+            'results': results[:self.page_size],
+            'page_number': page_number,
+            'has_next': len(results) > self.page_size,
+        })
+        return context
 
 class PostDetailView(LoginRequiredMixin, DetailView):
     model = Post
     template_name = 'sns/post_detail.html'
 
+    comment_page_size = 50
+
+    def get_queryset(self):
+        return Post.objects.select_related('author')
+
+    def get_comments(self):
+        # コメント投稿者をJOINし、自分がいいね済みかを1つのサブクエリで判定
+        liked = Comment.likes.through.objects.filter(
+            comment=OuterRef('pk'), user=self.request.user,
+        )
+        return (
+            Comment.objects.filter(post=self.object)
+            .select_related('user')
+            .annotate(liked_by_me=Exists(liked))
+        )
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['form'] = CommentForm()
+        context['post_liked'] = self.object.is_liked_by(self.request.user)
+        # コメントは古い順にカーソルでページ分割
+        context['comment_page'] = paginate_keyset(
+            self.get_comments(), self.request.GET.get('cursor'), self.comment_page_size, descending=False,
+        )
         return context
     
 class CommentCreateView(LoginRequiredMixin, CreateView):
@@ -34,10 +115,10 @@ class CommentCreateView(LoginRequiredMixin, CreateView):
         response = super().form_valid(form)
         # 投稿者にコメントを通知（自分の投稿には通知しない）
         if post.author != self.request.user:
-            Notification.objects.create(
+            notify(
                 sender=self.request.user,
-                recipient = post.author,
-                post= post,
+                recipient=post.author,
+                post=post,
                 comment=self.object,
                 notification_type='comment',
             )
@@ -84,7 +165,10 @@ class PostCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.author = self.request.user
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        # フォロワーのタイムラインへの配信は裏で行う
+        schedule_fan_out(self.object)
+        return response
 
 class PostUpdateView(LoginRequiredMixin, UpdateView):
     model = Post
@@ -111,7 +195,7 @@ class PostDeleteView(LoginRequiredMixin, DeleteView):
             raise PermissionDenied
         return obj
 
-class MessageCreateView(LoginRequiredMixin, CreateView):
+class MessageCreateView(AttachmentUploadMixin, LoginRequiredMixin, CreateView):
     model = Message
     template_name = 'sns/message_create.html'
     form_class = MessageForm
@@ -120,13 +204,18 @@ class MessageCreateView(LoginRequiredMixin, CreateView):
     def form_valid(self, form):
         form.instance.sender = self.request.user
         response = super().form_valid(form)
-        # 複数ファイルをまとめて取得
-        files = self.request.FILES.getlist('files')
-        for f in files:
-            Attachment.objects.create(message=self.object, file=f)
+        add_message(self.object)
+        # 複数ファイルをまとめて登録
+        self.save_attachments(self.object)
         return response
 
-class MessageUpdateView(LoginRequiredMixin, UpdateView):
+class RecipientLookupView(LoginRequiredMixin, View):
+    # 宛先の候補（?q= ユーザー名の前方一致）
+    def get(self, request):
+        users = lookup_recipients(request.user, request.GET.get('q', '').strip())
+        return JsonResponse({'results': [{'id': user.pk, 'text': user.username} for user in users], 'next': None})
+
+class MessageUpdateView(AttachmentUploadMixin, LoginRequiredMixin, UpdateView):
     model = Message
     template_name = 'sns/message_update.html'
     form_class = MessageForm
@@ -137,13 +226,17 @@ class MessageUpdateView(LoginRequiredMixin, UpdateView):
             raise PermissionDenied
         return obj
     
+    def get_form(self, form_class=None):
+        form = super().get_form(form_class)
+        # 宛先を変えるとスレッドの参加者・未読数と食い違うので、編集では変えられない
+        form.fields['recipient'].disabled = True
+        return form
+
     def form_valid(self, form):
         form.instance.is_update = True
         response = super().form_valid(form)
         # 新規ファイルの追加
-        files = self.request.FILES.getlist('files')
-        for f in files:
-            Attachment.objects.create(message=self.object, file=f)
+        self.save_attachments(self.object)
         return response
     
     def get_success_url(self):
@@ -166,16 +259,50 @@ class MessageDeleteView(LoginRequiredMixin, View):
 class MessageInboxView(LoginRequiredMixin, ListView):
     model = Message
     template_name = 'sns/message_inbox.html'
+    page_size = 30
 
     def get_queryset(self):
-        return Message.objects.filter(recipient=self.request.user).order_by('-created_at')
+        # メッセージ単位ではなくスレッド単位で表示する
+        return inbox(self.request.user)
+
+    def get_context_data(self, **kwargs):
+        page = paginate_keyset(self.object_list, self.request.GET.get('cursor'), self.page_size, field='last_message_at')
+        context = super().get_context_data(object_list=page.object_list, **kwargs)
+        context['page'] = page
+        return context
 
 class MessageOutboxView(LoginRequiredMixin, ListView):
     model = Message
     template_name = 'sns/message_outbox.html'
+    page_size = 30
 
     def get_queryset(self):
-        return Message.objects.filter(sender=self.request.user).order_by('-created_at')
+        return Message.objects.filter(sender=self.request.user).select_related('recipient')
+
+    def get_context_data(self, **kwargs):
+        page = paginate_keyset(self.object_list, self.request.GET.get('cursor'), self.page_size)
+        context = super().get_context_data(object_list=page.object_list, **kwargs)
+        context['page'] = page
+        return context
+
+class ConversationDetailView(LoginRequiredMixin, DetailView):
+    model = Conversation
+    template_name = 'sns/conversation_detail.html'
+    page_size = 50
+
+    def get_object(self, queryset=None):
+        obj = super().get_object(queryset)
+        # 参加者でなければ権限なし
+        if not obj.members.filter(user=self.request.user).exists():
+            raise PermissionDenied
+        mark_conversation_read(obj, self.request.user)
+        return obj
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        messages = self.object.messages.select_related('sender', 'recipient')
+        context['page'] = paginate_keyset(messages, self.request.GET.get('cursor'), self.page_size, descending=False)
+        return context
 
 class MessageDetailView(LoginRequiredMixin, DetailView):
     model = Message
@@ -190,9 +317,10 @@ class MessageDetailView(LoginRequiredMixin, DetailView):
         if obj.recipient == self.request.user and not obj.is_read:
             obj.is_read = True
             obj.save()
+            mark_message_read(obj)
         return obj
 
-class MessageReplyView(LoginRequiredMixin, CreateView):
+class MessageReplyView(AttachmentUploadMixin, LoginRequiredMixin, CreateView):
     model = Message
     form_class = MessageForm
     template_name = 'sns/message_reply.html'
@@ -214,16 +342,15 @@ class MessageReplyView(LoginRequiredMixin, CreateView):
         form.instance.sender = self.request.user
         form.instance.recipient = self.origin_message.sender
         response = super().form_valid(form)
-
-        files = self.request.FILES.getlist('files')
-        for f in files:
-            Attachment.objects.create(message=self.object, file=f)
+        # 元のメッセージと同じ2人なので同じスレッドに入る
+        add_message(self.object)
+        self.save_attachments(self.object)
         return response
     
     def get_success_url(self):
         return reverse('sns:message_inbox')
 
-class MessageForwardView(LoginRequiredMixin, CreateView):
+class MessageForwardView(AttachmentUploadMixin, LoginRequiredMixin, CreateView):
     model = Message
     form_class = MessageForm
     template_name = 'sns/message_forward.html'
@@ -249,15 +376,21 @@ class MessageForwardView(LoginRequiredMixin, CreateView):
     def form_valid(self, form):
         form.instance.sender = self.request.user
         response = super().form_valid(form)
-
-        files = self.request.FILES.getlist('files')
-        for f in files:
-            Attachment.objects.create(message=self.object, file=f)
+        add_message(self.object)
+        self.save_attachments(self.object)
         return response
     
     def get_success_url(self):
         return reverse('sns:message_outbox')
     
+class AttachmentDownloadView(LoginRequiredMixin, View):
+    def get(self, request, pk):
+        attachment = get_object_or_404(Attachment.objects.select_related('message'), pk=pk)
+        # 送信者・受信者以外はダウンロード不可
+        if request.user.pk not in (attachment.message.sender_id, attachment.message.recipient_id):
+            raise PermissionDenied
+        return attachment_response(request, attachment.file, attachment.display_name())
+
 class AttachmentDeleteView(LoginRequiredMixin, View):
     def post(self, request, pk):
         attachment = get_object_or_404(Attachment, pk=pk)
@@ -273,14 +406,10 @@ class CommentLikeView(LoginRequiredMixin, View):
         comment = get_object_or_404(Comment, pk=pk)
         user = request.user
 
-        if user in comment.likes.all():
-            # すでに「いいね」していたら取り消す
-            comment.likes.remove(user)
-        else:
-            # 「いいね」していなければ追加する
-            comment.likes.add(user)
+        # すでに「いいね」していたら取り消し、していなければ追加する
+        if comment.toggle_like(user):
             if comment.user != user:
-                Notification.objects.create(
+                notify(
                     sender=user,
                     recipient=comment.user,
                     post=comment.post,
@@ -294,13 +423,10 @@ class PostLikeView(LoginRequiredMixin, View):
         post = get_object_or_404(Post, pk=pk)
         user = request.user
 
-        if user in post.likes.all():
-            post.likes.remove(user)
-        else:
-            post.likes.add(user)
+        if post.toggle_like(user):
             # 通知を作成
             if post.author != user:
-                Notification.objects.create(
+                notify(
                     sender=user,
                     recipient=post.author,
                     notification_type='like_post',
@@ -311,9 +437,31 @@ class PostLikeView(LoginRequiredMixin, View):
 class NotificationListView(LoginRequiredMixin, ListView):
     model = Notification
     template_name = 'sns/notification_list.html'
+    page_size = 30
 
     def get_queryset(self):
-        return Notification.objects.filter(recipient=self.request.user).order_by('-created_at')
+        return (
+            Notification.objects.filter(recipient=self.request.user)
+            .select_related('sender', 'comment', 'post')
+        )
+
+    def get_context_data(self, **kwargs):
+        # まとめられた通知は最後に更新された日時で並べる
+        page = paginate_keyset(self.object_list, self.request.GET.get('cursor'), self.page_size, field='updated_at')
+        context = super().get_context_data(object_list=page.object_list, **kwargs)
+        context['page'] = page
+        return context
+
+class NotificationBulkMarkReadView(LoginRequiredMixin, View):
+    def post(self, request):
+        # 1回の UPDATE で既読にする（scope=page のときは表示中のページのみ）
+        notifications = Notification.objects.filter(recipient=request.user, is_read=False)
+        if request.POST.get('scope') == 'page':
+            ids = [int(pk) for pk in request.POST.getlist('ids') if pk.isdigit()]
+            notifications = notifications.filter(pk__in=ids)
+        if notifications.update(is_read=True):
+            reset_unread_count('notification', request.user.pk)
+        return redirect('sns:notification_list')
     
 class NotificatonDeleteView(LoginRequiredMixin, DeleteView):
     model = Notification
@@ -331,7 +479,8 @@ class NotificationMarkReadView(LoginRequiredMixin, View):
         notification = get_object_or_404(Notification, pk=pk, recipient=request.user)
         if not notification.is_read:
             notification.is_read = True
-            notification.save()
+            # updated_at（並び順）は変えない
+            notification.save(update_fields=['is_read'])
         # 投稿が存在するかをチェック
         if notification.post:
             return redirect('sns:post_detail', pk=notification.post.pk)
@@ -0,0 +1,21 @@
+from django import forms
+
+class LookupSelect(forms.Select):
+    # 選択中の項目だけを <option> に出し、他は static/js/lookup.js が url から検索して追加する
+    # （全件の <option> を出さないので、件数が増えてもページの大きさは変わらない）
+    def __init__(self, url, attrs=None):
+        super().__init__(attrs)
+        self.url = url
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs']['data-lookup-url'] = str(self.url)
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        selected = [v for v in value if v]
+        queryset = self.choices.queryset.filter(pk__in=selected) if selected else self.choices.queryset.none()
+        options = [self.create_option(name, '', self.choices.field.empty_label or '', not selected, 0)]
+        for index, obj in enumerate(queryset, start=1):
+            options.append(self.create_option(name, obj.pk, self.choices.field.label_from_instance(obj), True, index))
+        return [(None, options, 0)]
@@ -0,0 +1,50 @@
+// data-lookup-url 付きの <select> に検索欄を付け、入力に合わせて候補を読み込む
+// サーバーは {"results": [{"id": ..., "text": ...}], "next": カーソル or null} を返す
+document.querySelectorAll('select[data-lookup-url]:not([disabled])').forEach((select) => {
+    const search = document.createElement('input');
+    search.type = 'search';
+    search.className = 'form-control mb-1';
+    search.placeholder = '検索して候補を絞り込む';
+    const more = document.createElement('button');
+    more.type = 'button';
+    more.className = 'btn btn-link btn-sm px-0';
+    more.textContent = 'さらに読み込む';
+    more.hidden = true;
+    select.before(search);
+    select.after(more);
+
+    let next = null;
+    let loaded = false;
+    let timer = null;
+
+    const load = async (append) => {
+        const url = new URL(select.dataset.lookupUrl, location.origin);
+        url.searchParams.set('q', search.value);
+        if (append && next) url.searchParams.set('cursor', next);
+        const response = await fetch(url, {headers: {'Accept': 'application/json'}});
+        if (!response.ok) return;
+        const data = await response.json();
+        if (!append) {
+            // 未選択と選択中の項目は残す
+            [...select.options].forEach((option) => {
+                if (option.value && !option.selected) option.remove();
+            });
+        }
+        const existing = new Set([...select.options].map((option) => option.value));
+        data.results.forEach((item) => {
+            if (!existing.has(String(item.id))) select.add(new Option(item.text, item.id));
+        });
+        next = data.next;
+        more.hidden = !next;
+        loaded = true;
+    };
+
+    search.addEventListener('input', () => {
+        clearTimeout(timer);
+        timer = setTimeout(() => load(false), 250);
+    });
+    select.addEventListener('focus', () => {
+        if (!loaded) load(false);
+    });
+    more.addEventListener('click', () => load(true));
+});